@@ -0,0 +1,267 @@
+"""
+This module contains the benchmarks of the analysis pipeline, run on synthetic price files (see the
+synthetic_price_files module), to catch the performance regressions before they reach the analyses of the real data.
+
+Each stage of the pipeline is benchmarked in a new process (so the peak memory of a stage doesn't include the ones
+of the previous stages, and nothing is shared through in-memory caches), with the cache of decoded price files
+disabled. For each stage the benchmark reports the time (the minimum over the repetitions), the number of market
+books processed per second and the peak resident memory (RSS) of the process. The results can be saved as a baseline
+and the next runs compared against it.
+
+The benchmarks are run from the main directory of the repository:
+    python -m benchmarks.benchmark_pipeline --save-baseline
+    python -m benchmarks.benchmark_pipeline --baseline benchmarks/results/baseline.json
+(the second command exits with code 1 if any stage is slower, or uses more memory, than the baseline by more than
+the tolerance).
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks import synthetic_price_files
+
+BENCHMARK_STAGES = ('read_market_books',
+                    'extract_features_from_price_file',
+                    'apply_function_for_runner_on_entire_price_file',
+                    'analyse_and_plot_multiple_price_files')
+
+DEFAULT_BENCHMARK_CONFIG = {
+    'n_files': 4,
+    'n_updates': 20000,
+    'n_runners': 2,
+    'inplay_ratio': 0.5,
+    'ladder_depth': 10,
+    'seed': 0,
+    'repeats': 3,
+}
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'baseline.json')
+
+
+def _get_peak_rss_mb():
+    import resource
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak_rss / 1024**2 if sys.platform=='darwin' else peak_rss / 1024
+
+
+
+def _run_stage(stage, price_files, work_dir):
+    ## Run in a new process by run_stage
+    os.environ.pop("PRICE_FILE_CACHE_DIRECTORY", None)
+    import matplotlib
+    matplotlib.use('Agg')
+    import betfairutil
+    from src import data_analysis, data_processing, price_file_reader
+
+    start = time.perf_counter()
+    market_books = 0
+    if stage=='read_market_books':
+        for price_file in price_files:
+            market_books += sum(1 for _ in price_file_reader.create_market_book_generator(price_file))
+    elif stage=='extract_features_from_price_file':
+        for price_file in price_files:
+            dict_features, _ = data_analysis.extract_features_from_price_file(price_file)
+            market_books += len(dict_features['Publish time'])
+    elif stage=='apply_function_for_runner_on_entire_price_file':
+        for price_file in price_files:
+            spreads = data_processing.apply_function_for_runner_on_entire_price_file(price_file,
+                                                                                    betfairutil.get_spread)
+            market_books += len(spreads[0])
+    elif stage=='analyse_and_plot_multiple_price_files':
+        results_dir = tempfile.mkdtemp(dir=work_dir)
+        data_analysis.analyse_and_plot_multiple_price_files(data_path=None, results_dir=results_dir,
+                                                            save_result_in_pickle=True, price_files=price_files,
+                                                            plot=False)
+        market_books = None
+    else:
+        raise ValueError(f"Unknown benchmark stage '{stage}', it must be one of {BENCHMARK_STAGES}")
+    seconds = time.perf_counter() - start
+
+    return {'seconds': seconds, 'market_books': market_books, 'peak_rss_mb': _get_peak_rss_mb()}
+
+
+
+def run_stage(stage, price_files, work_dir):
+    """
+    This function runs one stage of the pipeline on the price files, in a new process.
+
+    Args:
+        stage (str): The stage (one of BENCHMARK_STAGES).
+        price_files (list): The paths of the price files.
+        work_dir (str): A directory for the results of the stage.
+
+    Returns:
+        dict: The time of the stage in seconds ('seconds'), the number of market books processed ('market_books',
+        None if the stage doesn't return them) and the peak RSS of the process in MB ('peak_rss_mb').
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_run_stage, stage, price_files, work_dir).result()
+
+
+
+def run_benchmarks(config=None, stages=BENCHMARK_STAGES, data_path=None, verbose=True):
+    """
+    This function generates the synthetic price files and benchmarks the stages of the pipeline on them.
+
+    Args:
+        config (dict or None): The configuration of the benchmarks (the keys missing are taken from
+        DEFAULT_BENCHMARK_CONFIG): the number of price files ('n_files'), the parameters of the synthetic price files
+        ('n_updates', 'n_runners', 'inplay_ratio', 'ladder_depth', 'seed') and the number of repetitions of each
+        stage ('repeats').
+        stages (tuple): The stages to benchmark.
+        data_path (str or None): The directory where the synthetic price files are generated. If None they are
+        generated in a temporary directory, removed at the end.
+        verbose (bool): If True the result of each stage is printed.
+
+    Returns:
+        dict: The results, with the keys 'config', 'environment' and 'stages' (a dictionary with, for each stage,
+        'seconds' (the minimum over the repetitions), 'seconds_all', 'market_books', 'market_books_per_second' and
+        'peak_rss_mb' (the maximum over the repetitions)).
+
+    Example:
+        results = run_benchmarks(config={'n_files': 2, 'n_updates': 5000})
+        save_benchmark_results(results, 'path/to/your/baseline.json')
+    """
+    config = dict(DEFAULT_BENCHMARK_CONFIG, **(config or {}))
+    work_dir = tempfile.mkdtemp(prefix="betfair_benchmarks_")
+    try:
+        price_files = synthetic_price_files.generate_synthetic_data_directory(
+            data_path=data_path or os.path.join(work_dir, 'data'),
+            n_files=config['n_files'],
+            seed=config['seed'],
+            n_updates=config['n_updates'],
+            n_runners=config['n_runners'],
+            inplay_ratio=config['inplay_ratio'],
+            ladder_depth=config['ladder_depth'])
+        ## every file has a market book for each line
+        total_market_books = config['n_files'] * (config['n_updates'] + 1)
+
+        results_stages = {}
+        for stage in stages:
+            runs = [run_stage(stage, price_files, work_dir) for _ in range(config['repeats'])]
+            seconds = min(run['seconds'] for run in runs)
+            market_books = runs[0]['market_books'] or total_market_books
+            results_stages[stage] = {
+                'seconds': seconds,
+                'seconds_all': [run['seconds'] for run in runs],
+                'market_books': market_books,
+                'market_books_per_second': market_books / seconds if seconds>0 else None,
+                'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+            }
+            if verbose:
+                print(f"{stage}: {seconds:.3f} s, {results_stages[stage]['market_books_per_second']:.0f} "
+                      f"market books/s, peak RSS {results_stages[stage]['peak_rss_mb']:.1f} MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'config': config,
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpu_count': os.cpu_count()},
+        'created_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'stages': results_stages,
+    }
+
+
+
+def save_benchmark_results(results, path):
+    """
+    This function saves the results of the benchmarks in a json file (for example as the baseline of the next runs).
+
+    Args:
+        results (dict): The results (see run_benchmarks).
+        path (str): The path of the json file (the directory is created in case it doesn't exist).
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1)
+
+
+
+def load_benchmark_results(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+
+def compare_benchmark_results(results, baseline, tolerance=0.2):
+    """
+    This function compares the results of the benchmarks with a baseline and finds the regressions: the stages that
+    are slower, or whose peak RSS is bigger, than in the baseline by more than the tolerance.
+
+    Args:
+        results (dict): The results (see run_benchmarks).
+        baseline (dict): The results of the baseline.
+        tolerance (float): The relative tolerance (0.2 means that a stage can be up to 20% slower than in the
+        baseline).
+
+    Returns:
+        list: The regressions, as dictionaries with the keys 'stage', 'metric' ('seconds' or 'peak_rss_mb'),
+        'baseline', 'current' and 'ratio'. The stages missing from the baseline are ignored.
+    """
+    ## the number of repetitions doesn't change what is measured
+    if ({name: value for name, value in results['config'].items() if name!='repeats'}!=
+            {name: value for name, value in baseline['config'].items() if name!='repeats'}):
+        print("Warning: the configuration of the benchmarks is different from the one of the baseline")
+
+    regressions = []
+    for stage, result in results['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        for metric in ('seconds', 'peak_rss_mb'):
+            baseline_value = baseline['stages'][stage][metric]
+            if baseline_value and result[metric]>baseline_value * (1 + tolerance):
+                regressions.append({'stage': stage, 'metric': metric, 'baseline': baseline_value,
+                                    'current': result[metric], 'ratio': result[metric] / baseline_value})
+
+    return regressions
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the analysis pipeline on synthetic price files")
+    for name, default in DEFAULT_BENCHMARK_CONFIG.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    parser.add_argument("--stages", nargs="+", choices=BENCHMARK_STAGES, default=list(BENCHMARK_STAGES))
+    parser.add_argument("--baseline", default=None, help="Compare the results with this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE_PATH, default=None,
+                        help=f"Save the results as the baseline (by default in {DEFAULT_BASELINE_PATH})")
+    parser.add_argument("--output", default=None, help="Save the results in this json file")
+    args = parser.parse_args(argv)
+
+    config = {name: getattr(args, name) for name in DEFAULT_BENCHMARK_CONFIG}
+    results = run_benchmarks(config=config, stages=tuple(args.stages))
+
+    if args.output:
+        save_benchmark_results(results, args.output)
+    if args.save_baseline:
+        save_benchmark_results(results, args.save_baseline)
+
+    if args.baseline:
+        regressions = compare_benchmark_results(results, load_benchmark_results(args.baseline),
+                                                tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['stage']} {regression['metric']}: {regression['baseline']:.3f} -> "
+                  f"{regression['current']:.3f} ({regression['ratio']:.2f}x)")
+        if regressions:
+            return 1
+
+    return 0
+
+
+
+if __name__=="__main__":
+    sys.exit(main())
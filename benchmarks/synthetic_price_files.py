@@ -0,0 +1,167 @@
+"""
+This module contains the functions to generate synthetic Betfair price files, used by the benchmarks of the analysis
+pipeline (see the benchmark_pipeline module).
+
+The synthetic price files have the same format of the Betfair historical stream files (one "mcm" message per line,
+compressed with bz2): a first image of the order book, pre-event and in-play updates of the ladders (available to
+back and lay, traded volume, last traded price and total volume traded of each runner), changes of the market
+definition when the market turns in-play and when it is suspended and reopened, and a final closed market
+definition. The number of runners, the number of updates, the ratio of in-play updates and the depth of the ladders
+can be configured, and the files are deterministic (they only depend on the seed).
+"""
+
+import bz2
+import json
+import os
+import random
+
+import betfairutil
+
+START_PUBLISH_TIME = 1672574400000
+START_DATE = "2023-01-01T12:00:00.000Z"
+
+
+def _create_market_definition(n_runners, runner_names, event_id, in_play, status, runner_statuses=None):
+    return {
+        "bspMarket": False, "turnInPlayEnabled": True, "persistenceEnabled": True, "marketBaseRate": 5,
+        "eventId": event_id, "eventTypeId": "2", "numberOfWinners": 1, "bettingType": "ODDS",
+        "marketType": "MATCH_ODDS", "marketTime": START_DATE, "suspendTime": START_DATE, "bspReconciled": False,
+        "complete": True, "inPlay": in_play, "crossMatching": True, "runnersVoidable": False,
+        "numberOfActiveRunners": n_runners, "betDelay": 3 if in_play else 0, "status": status,
+        "runners": [{"status": runner_statuses[idx] if runner_statuses else "ACTIVE", "sortPriority": idx + 1,
+                     "id": 1000 + idx, "name": runner_names[idx]} for idx in range(n_runners)],
+        "regulators": ["MR_INT"], "venue": "", "countryCode": "GB", "discountAllowed": True, "timezone": "GMT",
+        "openDate": START_DATE, "version": 1, "eventName": " v ".join(runner_names[:2]), "name": "Match Odds",
+    }
+
+
+
+def generate_synthetic_price_file(price_file_path, n_updates=2000, n_runners=2, inplay_ratio=0.5, ladder_depth=10,
+                                  market_id="1.100000001", event_id="32000001", seed=0, suspensions=True):
+    """
+    This function generates a synthetic price file.
+
+    Args:
+        price_file_path (str): Path of the price file to generate (the directory is created in case it doesn't
+        exist).
+        n_updates (int): Number of updates of the market (lines of the price file, without the final one that
+        closes the market).
+        n_runners (int): Number of runners of the market.
+        inplay_ratio (float): Fraction of the updates that are in-play (the market turns in-play after
+        n_updates * (1 - inplay_ratio) updates). The in-play updates are more frequent than the pre-event ones.
+        ladder_depth (int): Number of price levels of the ladders (available to back and lay) of each runner.
+        market_id (str): The market ID.
+        event_id (str): The event ID.
+        seed (int): The seed of the random generator (the same seed always generates the same price file).
+        suspensions (bool): If True the market is suspended and reopened twice while in-play.
+
+    Returns:
+        int: The number of lines of the price file.
+
+    Example:
+        generate_synthetic_price_file('path/to/your/data/1.100000001.bz2', n_updates=20000, n_runners=3)
+    """
+    rnd = random.Random(seed)
+    prices = sorted(betfairutil.BETFAIR_PRICE_TO_PRICE_INDEX_MAP)
+    mid_price_idx = [rnd.randint(ladder_depth + 5, len(prices) - ladder_depth - 5) for _ in range(n_runners)]
+    traded = [{} for _ in range(n_runners)]
+    runner_names = [f"Player {idx}" for idx in range(n_runners)]
+    inplay_update = int(n_updates * (1 - inplay_ratio))
+    ## updates of the market definition while in-play: (suspension, reopening) pairs
+    suspension_updates = {inplay_update + 10: "SUSPENDED", inplay_update + 20: "OPEN",
+                          inplay_update + 200: "SUSPENDED", inplay_update + 210: "OPEN"} if suspensions else {}
+
+    publish_time = START_PUBLISH_TIME
+    first_market_change = {
+        "id": market_id,
+        "marketDefinition": _create_market_definition(n_runners, runner_names, event_id, in_play=False,
+                                                      status="OPEN"),
+        "rc": [{"atb": [[prices[mid_price_idx[idx] - level], rnd.randint(1, 500)] for level in range(ladder_depth)],
+                "atl": [[prices[mid_price_idx[idx] + 1 + level], rnd.randint(1, 500)]
+                        for level in range(ladder_depth)],
+                "id": 1000 + idx} for idx in range(n_runners)],
+        "img": True
+    }
+    lines = [{"op": "mcm", "clk": "1", "pt": publish_time, "mc": [first_market_change]}]
+
+    for update in range(1, n_updates):
+        in_play = update>=inplay_update
+        publish_time += rnd.randint(10, 500) if in_play else rnd.randint(50, 5000)
+        market_change = {"id": market_id}
+        if update==inplay_update:
+            market_change["marketDefinition"] = _create_market_definition(n_runners, runner_names, event_id,
+                                                                          in_play=True, status="OPEN")
+        if update in suspension_updates:
+            market_change["marketDefinition"] = _create_market_definition(n_runners, runner_names, event_id,
+                                                                          in_play=True,
+                                                                          status=suspension_updates[update])
+
+        runner_changes = []
+        for idx in range(n_runners):
+            if rnd.random()>=0.6:
+                continue
+            runner_change = {"id": 1000 + idx}
+            if rnd.random()<0.1:
+                mid_price_idx[idx] = max(ladder_depth + 1,
+                                         min(len(prices) - ladder_depth - 2,
+                                             mid_price_idx[idx] + rnd.choice([-1, 1])))
+            ## a volume of 0 removes the price level from the ladder
+            runner_change["atb"] = [[prices[mid_price_idx[idx] - rnd.randint(0, ladder_depth - 1)],
+                                     rnd.choice([0, rnd.randint(1, 500)])]]
+            runner_change["atl"] = [[prices[mid_price_idx[idx] + 1 + rnd.randint(0, ladder_depth - 1)],
+                                     rnd.choice([0, rnd.randint(1, 500)])]]
+            if rnd.random()<0.3:
+                price = prices[mid_price_idx[idx]]
+                traded[idx][price] = round(traded[idx].get(price, 0) + rnd.randint(1, 100), 2)
+                runner_change["trd"] = [[price, traded[idx][price]]]
+                runner_change["ltp"] = price
+                runner_change["tv"] = round(sum(traded[idx].values()), 2)
+            runner_changes.append(runner_change)
+        if runner_changes:
+            market_change["rc"] = runner_changes
+
+        lines.append({"op": "mcm", "clk": str(update + 1), "pt": publish_time, "mc": [market_change]})
+
+    publish_time += 1000
+    closed_market_definition = _create_market_definition(n_runners, runner_names, event_id, in_play=True,
+                                                         status="CLOSED",
+                                                         runner_statuses=["WINNER"] + ["LOSER"] * (n_runners - 1))
+    lines.append({"op": "mcm", "clk": str(n_updates + 1), "pt": publish_time,
+                  "mc": [{"id": market_id, "marketDefinition": closed_market_definition}]})
+
+    directory = os.path.dirname(price_file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with bz2.open(price_file_path, 'wt') as f:
+        for line in lines:
+            f.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+    return len(lines)
+
+
+
+def generate_synthetic_data_directory(data_path, n_files, seed=0, **kwargs):
+    """
+    This function generates a directory of synthetic price files (with consecutive market IDs and different seeds),
+    with the same layout of the Betfair historical data (one directory per event).
+
+    Args:
+        data_path (str): The directory of the price files.
+        n_files (int): The number of price files to generate.
+        seed (int): The seed of the first price file (the i-th price file has seed + i).
+        **kwargs: The other parameters of generate_synthetic_price_file (n_updates, n_runners, inplay_ratio,
+        ladder_depth, suspensions).
+
+    Returns:
+        list: The paths of the generated price files.
+    """
+    price_files = []
+    for idx in range(n_files):
+        market_id = f"1.{100000001 + idx}"
+        event_id = str(32000001 + idx)
+        price_file_path = os.path.join(data_path, event_id, f"{market_id}.bz2")
+        generate_synthetic_price_file(price_file_path, market_id=market_id, event_id=event_id, seed=seed + idx,
+                                      **kwargs)
+        price_files.append(price_file_path)
+
+    return price_files
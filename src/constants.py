@@ -1,12 +1,25 @@
 import betfairutil
 
+from src import order_book
 from utils import pricefileutils
 
+PICKLE_FILE_NAME_AGGREGATE_STATS = 'aggregate_stats_dict.pkl'
+PICKLE_FILE_NAME_MISSING_DATA = 'missing_data_dict.pkl'
 PICKLE_FILE_NAME_TOT_VOLUME = 'tot_volume_traded_dict.pkl'
 PICKLE_FILE_NAME_PRE_EVENT_VOLUME = 'pre_event_volume_traded.pkl'
+PICKLE_FILE_NAME_FEATURE_STATISTICS = 'feature_statistics.pkl'
 NAME_PLOT_TOT_VOLUME = 'tot_volume_distr'
 NAME_PLOT_PRE_EVENT_VOLUME = 'pre_event_volume_distr'
 
+## Job manifest and checkpoints of the resumable analysis of multiple price files (see the job_manifest module),
+## saved in the results directory
+JOB_MANIFEST_FILE_NAME = 'job_manifest.json'
+CHECKPOINTS_DIR_NAME = 'checkpoints'
+
+## Maximum size (in bytes) of the cache of decoded price files (see data_processing). When it is exceeded,
+## the least recently used price files are removed from the cache.
+PRICE_FILE_CACHE_MAX_SIZE = 10 * 1024**3
+
 
 FUNS_FOR_PRICE_FILE = {
     'Total volume traded': betfairutil.get_total_volume_traded_from_prices_file,
@@ -16,11 +29,30 @@ FUNS_FOR_PRICE_FILE = {
     'Date': pricefileutils.get_event_date
 }
 
+## Functions that calculate the same features of FUNS_FOR_PRICE_FILE from the result of
+## data_processing.extract_features_in_single_pass (so without reading the price file again)
+FUNS_FOR_SINGLE_PASS = {
+    'Total volume traded': lambda single_pass: order_book.get_total_volume_traded(single_pass['order_book']),
+    'Pre-event volume': lambda single_pass: order_book.get_pre_event_volume_traded(single_pass['order_book'],
+                                                                                  single_pass['inplay_idx']),
+    'Name': lambda single_pass: single_pass['first_market_definition']['eventName'],
+    'Event Id': lambda single_pass: single_pass['first_market_definition']['eventId'],
+    'Date': lambda single_pass: single_pass['first_market_definition']['openDate']
+}
+
+## Features that are read from the first market definition of the price file (see
+## pricefileutils.get_first_market_definition), without decoding the entire price file
+FUNS_FOR_MARKET_DEFINITION = {
+    'Name': lambda market_definition: market_definition['eventName'],
+    'Event Id': lambda market_definition: market_definition['eventId'],
+    'Date': lambda market_definition: market_definition['openDate']
+}
+
 FUNS_FOR_MB = {
     'Total matched': betfairutil.calculate_total_matched,
     'Available volume back': betfairutil.calculate_available_volume,
     'Available volume lay': betfairutil.calculate_available_volume,
-    'Publish time': lambda mb: betfairutil.publish_time_to_datetime(mb['publishTime'])
+    'Publish time': lambda mb: mb['publishTime']
 }
 
 FUNS_FOR_RUNNERS = {
@@ -31,9 +63,76 @@ FUNS_FOR_RUNNERS = {
     'Last traded price': pricefileutils.get_last_traded_prices_from_runner
 }
 
+## Vectorized versions of the functions in FUNS_FOR_MB and FUNS_FOR_RUNNERS, calculated on the columnar
+## order book of the entire price file (see the order_book module). When a feature is present here
+## the corresponding function in FUNS_FOR_MB or FUNS_FOR_RUNNERS isn't called for each market book.
+VECTORIZED_FUNS_FOR_MB = {
+    'Total matched': order_book.calculate_total_matched,
+    'Available volume back': order_book.calculate_available_volume,
+    'Available volume lay': order_book.calculate_available_volume,
+    'Publish time': order_book.get_publish_times
+}
+
+VECTORIZED_FUNS_FOR_RUNNERS = {
+    'Spread': order_book.get_spread,
+    'Mid price': order_book.get_mid_price,
+    'OB imbalance': order_book.calculate_order_book_imbalance,
+    'Last traded price': order_book.get_last_traded_prices
+}
+
+## Maximum book percentage used to calculate the available volume (it is also the one calculated by the order book
+## engine, see the order_book_engine module)
+AVAILABLE_VOLUME_MAX_BOOK_PERCENTAGE = 1000
+
 PARAMETERS_FOR_FUNCTIONS = {
-    'Available volume back': [betfairutil.Side.BACK, 1000],
-    'Available volume lay': [betfairutil.Side.LAY, 1000],
+    'Available volume back': [betfairutil.Side.BACK, AVAILABLE_VOLUME_MAX_BOOK_PERCENTAGE],
+    'Available volume lay': [betfairutil.Side.LAY, AVAILABLE_VOLUME_MAX_BOOK_PERCENTAGE],
+}
+
+
+
+## Downsampling of the time series plots of the features (see the downsampling module): the default (method,
+## maximum number of points) and the ones of specific features (for the runners features, like 'Spread', the
+## setting applies to all the runners). The method can be 'min_max', 'lttb' or None (no downsampling).
+PLOT_DOWNSAMPLING_DEFAULT = ('min_max', 2000)
+
+PLOT_DOWNSAMPLING = {
+    'Publish time': ('lttb', 2000),
+    'Total matched': ('lttb', 2000),
+    'Mid price': ('lttb', 2000),
+}
+
+
+
+## Resampling of the features into bars of publish time (see the resampling module): the default aggregation and
+## the ones of specific features (for the runners features, like 'Mid price', the setting applies to all the
+## runners). The aggregation can be 'ohlc', 'last', 'sum' or 'mean'.
+RESAMPLING_AGGREGATION_DEFAULT = 'last'
+
+RESAMPLING_AGGREGATIONS = {
+    'Mid price': 'ohlc',
+    'Last traded price': 'ohlc',
+    'Matched': 'sum',
+    'Diff time': 'mean',
 }
 
 
+
+## Size of the quantile sketches of the streaming statistics (see online_statistics.KLLSketch): the biggest
+## compactor keeps this number of values and the rank error of the quantiles is roughly 1.7 / QUANTILE_SKETCH_K
+QUANTILE_SKETCH_K = 400
+
+## Seed of the random offsets of the compactions of the quantile sketches, so the same values always give the same
+## quantiles (it is combined with the values of the first compaction, see online_statistics.KLLSketch)
+QUANTILE_SKETCH_SEED = 0
+
+
+
+## Reader of the price files (see the price_file_reader module): the number of threads that decompress the bz2
+## blocks (the number of CPUs if None), the minimum size (in bytes) of the compressed files whose blocks are
+## decompressed in parallel and the maximum number of decompressed chunks waiting to be parsed.
+PRICE_FILE_READER_WORKERS = None
+
+PRICE_FILE_READER_MIN_PARALLEL_SIZE = 4 * 1024**2
+
+PRICE_FILE_READER_MAX_QUEUED_CHUNKS = 8
@@ -0,0 +1,191 @@
+"""
+This module contains the functions to calculate the correlation matrices (Pearson, Spearman and Kendall) between the
+features extracted from a price file.
+
+The three methods are calculated together, from ranks that are computed only once for each feature (the Spearman
+correlation is the Pearson correlation of the average ranks, and the Kendall tau-b is calculated in O(n log n) from
+the dense ranks), instead of calling pandas.DataFrame.corr once for each method, which ranks every pair of features
+again. The results are the same of pandas.DataFrame.corr (the missing values are excluded pairwise, like in pandas).
+The features can also be subsampled, or bucketed by publish time, before calculating the correlations.
+"""
+
+import numpy as np
+import pandas as pd
+
+CORRELATION_METHODS = ('pearson', 'kendall', 'spearman')
+
+
+def rank_feature(values):
+    """
+    This function calculates the dense ranks (0, 1, 2, ... with equal values having the same rank) and the average
+    ranks (the ones used by the Spearman correlation, starting from 1) of a feature without missing values.
+
+    Args:
+        values (numpy.ndarray): The values of the feature.
+
+    Returns:
+        tuple: The dense ranks (numpy.ndarray of int64) and the average ranks (numpy.ndarray of float64).
+    """
+    _, dense_ranks, counts = np.unique(values, return_inverse=True, return_counts=True)
+    dense_ranks = dense_ranks.reshape(-1).astype(np.int64)
+    ## The average rank of a group of equal values is the mean of the positions they occupy once sorted
+    first_positions = np.cumsum(counts) - counts
+    average_ranks = (first_positions + (counts + 1) / 2)[dense_ranks]
+
+    return dense_ranks, average_ranks
+
+
+
+def kendall_tau_b(x_dense_ranks, y_dense_ranks):
+    """
+    This function calculates the Kendall tau-b correlation between two features from their dense ranks (see
+    rank_feature), with the O(n log n) algorithm of Knight implemented by scipy.stats.kendalltau (the same function
+    used by pandas.DataFrame.corr, so the results are identical).
+
+    Args:
+        x_dense_ranks (numpy.ndarray): The dense ranks of the first feature.
+        y_dense_ranks (numpy.ndarray): The dense ranks of the second feature.
+
+    Returns:
+        float: The Kendall tau-b correlation (NaN if one of the features is constant or there are less than 2
+        values).
+    """
+    from scipy.stats import kendalltau
+
+    if len(x_dense_ranks)<2 or x_dense_ranks.max()==0 or y_dense_ranks.max()==0:
+        return np.nan
+
+    return float(kendalltau(x_dense_ranks, y_dense_ranks)[0])
+
+
+
+def _pearson(x, y):
+    if len(x)<2:
+        return np.nan
+    x = x - x.mean()
+    y = y - y.mean()
+    denominator = np.sqrt(np.dot(x, x) * np.dot(y, y))
+    if denominator==0:
+        return np.nan
+
+    return float(np.clip(np.dot(x, y) / denominator, -1, 1))
+
+
+
+def _correlation_of_pair(x_ranks, y_ranks, x_values, y_values, method):
+    if method=='pearson':
+        return _pearson(x_values, y_values)
+    elif method=='spearman':
+        return _pearson(x_ranks[1], y_ranks[1])
+    else:
+        return kendall_tau_b(x_ranks[0], y_ranks[0])
+
+
+
+def subsample_features(df_features, max_samples=None, publish_times=None, bucket_ms=None):
+    """
+    This function reduces the number of rows of the features before calculating the correlations.
+
+    Args:
+        df_features (pandas.DataFrame): The features (one column per feature, one row per market book).
+        max_samples (int or None): If not None and the features have more rows, the rows are subsampled at regular
+        intervals to (at most) this number of rows.
+        publish_times (numpy.ndarray or None): The publish times of the rows (epoch milliseconds), needed by
+        'bucket_ms'.
+        bucket_ms (int or None): If not None, the rows are grouped in time buckets of this length (in milliseconds)
+        and only the last row of each bucket is kept.
+
+    Returns:
+        pandas.DataFrame: The subsampled features.
+    """
+    if bucket_ms is not None:
+        if publish_times is None:
+            raise ValueError("The publish times are needed to bucket the features by time")
+        buckets = np.asarray(publish_times, dtype=np.int64) // bucket_ms
+        is_last_of_bucket = np.append(buckets[1:]!=buckets[:-1], True) if len(buckets) else np.zeros(0, dtype=bool)
+        df_features = df_features[is_last_of_bucket]
+
+    if max_samples is not None and len(df_features)>max_samples:
+        idx = np.unique(np.linspace(0, len(df_features)-1, max_samples).round().astype(np.int64))
+        df_features = df_features.iloc[idx]
+
+    return df_features
+
+
+
+def calculate_correlation_matrices(df_features, methods=CORRELATION_METHODS, max_samples=None, publish_times=None,
+                                   bucket_ms=None):
+    """
+    This function calculates the correlation matrices of the features with the given methods. The ranks of each
+    feature are calculated only once and shared by all the methods and pairs of features. The features without
+    missing values (the common case) are ranked on all the rows; for the pairs of features with missing values the
+    ranks are calculated on the rows where both the features are present, like in pandas.DataFrame.corr.
+
+    Args:
+        df_features (pandas.DataFrame): The features (one column per feature, one row per market book).
+        methods (tuple): The correlation methods ('pearson', 'kendall' and/or 'spearman').
+        max_samples (int or None): See subsample_features.
+        publish_times (numpy.ndarray or None): See subsample_features.
+        bucket_ms (int or None): See subsample_features.
+
+    Returns:
+        dict: A dictionary with the methods as keys and the correlation matrices (pandas.DataFrame with the names of
+        the features as index and columns) as values.
+
+    Example:
+        correlation_matrices = calculate_correlation_matrices(df_features)
+        correlation_matrices['kendall']
+    """
+    for method in methods:
+        if method not in CORRELATION_METHODS:
+            raise ValueError(f"Unknown correlation method '{method}', it must be one of {CORRELATION_METHODS}")
+
+    df_features = subsample_features(df_features=df_features, max_samples=max_samples,
+                                     publish_times=publish_times, bucket_ms=bucket_ms)
+    features = list(df_features.columns)
+    values = df_features.to_numpy(dtype=float, na_value=np.nan).T
+    valid = ~np.isnan(values)
+    complete = valid.all(axis=1)
+
+    needs_ranks = any(method!='pearson' for method in methods)
+    ranks = [rank_feature(values[idx]) if needs_ranks and complete[idx] else None for idx in range(len(features))]
+
+    complete_idx = np.flatnonzero(complete)
+
+    correlation_matrices = {}
+    for method in methods:
+        matrix = np.full((len(features), len(features)), np.nan)
+
+        ## The Pearson and Spearman correlations of the features without missing values are calculated all together
+        if method!='kendall' and len(complete_idx)>0 and values.shape[1]>=2:
+            if method=='pearson':
+                complete_values = values[complete_idx]
+            else:
+                complete_values = np.array([ranks[idx][1] for idx in complete_idx])
+            with np.errstate(invalid='ignore', divide='ignore'):
+                matrix[np.ix_(complete_idx, complete_idx)] = np.clip(np.corrcoef(complete_values), -1, 1)
+
+        for i in range(len(features)):
+            for j in range(i, len(features)):
+                if complete[i] and complete[j]:
+                    if method!='kendall':
+                        continue
+                    x_values, y_values = values[i], values[j]
+                    x_ranks, y_ranks = ranks[i], ranks[j]
+                else:
+                    mask = valid[i] & valid[j]
+                    x_values, y_values = values[i][mask], values[j][mask]
+                    if len(x_values)==0:
+                        continue
+                    x_ranks = rank_feature(x_values) if method!='pearson' else None
+                    y_ranks = rank_feature(y_values) if method!='pearson' else None
+                if i==j and method=='kendall':
+                    ## Like pandas, the Kendall correlation of a feature with itself is always 1
+                    matrix[i, j] = 1.0 if len(x_values)>0 else np.nan
+                else:
+                    matrix[i, j] = matrix[j, i] = _correlation_of_pair(x_ranks, y_ranks, x_values, y_values,
+                                                                       method)
+
+        correlation_matrices[method] = pd.DataFrame(matrix, index=features, columns=features)
+
+    return correlation_matrices
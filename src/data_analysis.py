@@ -5,6 +5,7 @@ data_exploration module where the data exploration is performed.
 
 import os
 import pickle
+from concurrent.futures import ProcessPoolExecutor
 from pprint import pprint
 
 import betfairutil
@@ -14,19 +15,58 @@ import pandas as pd
 import seaborn as sns
 from alive_progress import alive_it
 
-from src import constants, data_plotting, data_processing
+from src import (constants, correlation, data_plotting, data_processing, job_manifest,
+                 online_statistics, order_book, resampling, results_store)
 from utils import pricefileutils
 
 
-def calculate_and_plot_mean_correlation_matrix(data_path, path_plot):
+def get_price_file_paths(data_path, price_files=None):
+    """
+    This function returns the paths of the price files to analyse: the given list of price files if it isn't None
+    (for example the result of a query on the market catalogue, see the market_catalogue module), otherwise all the
+    price files found in the directory 'data_path' (and its subdirectories).
+
+    Args:
+        data_path (str or None): The path to the directory where the data files are located.
+        price_files (list or None): The paths of the price files to analyse.
+
+    Returns:
+        list: The paths of the price files.
+    """
+    if price_files is not None:
+        return list(price_files)
+
+    return [os.path.join(root, file_name)
+            for root, _, files in os.walk(data_path)
+            for file_name in files
+            if ".bz2" in file_name]
+
+
+
+def calculate_and_plot_mean_correlation_matrix(data_path, path_plot, price_files=None, workers=None,
+                                               files_per_task=16, resample_interval=None,
+                                               correlation_max_samples=None, correlation_bucket_ms=None):
     """
     This function extracts several features from all price files in the specified directory,
     computes the mean correlation matrix between these features and then it plots the mean
     correlation matrix as a heatmap and saves it to the specified location.
+    The correlation matrices of the price files aren't kept in memory: they are aggregated one at the time by a
+    MeanCorrelationAggregator (see the online_statistics module), aligned by feature name, so the memory used doesn't
+    grow with the number of price files.
 
     Args:
         data_path (str): The path to the directory where the data files are located.
         path_plot (str): The path where the plot should be saved.
+        price_files (list or None): If not None, only these price files are analysed instead of all the price files
+        in 'data_path' (see get_price_file_paths).
+        workers (int or None): Number of processes used to analyse the price files in parallel. If None or 1 the price
+        files are analysed in the current process. Each process aggregates the correlation matrices of a group of
+        'files_per_task' price files and the aggregators are then merged.
+        files_per_task (int): Number of price files aggregated by each task when 'workers' is greater than 1.
+        resample_interval (int, str or None): If not None, the correlation matrices are calculated on the features
+        resampled into bars of this interval of publish time, like '10s' (see resample_features_from_price_file).
+        correlation_max_samples (int or None): See calculate_correlation_matrix_of_price_file.
+        correlation_bucket_ms (int or None): See calculate_correlation_matrix_of_price_file.
 
     Returns:
         mean_matrix (numpy array): The mean correlation matrix computed from all data files.
@@ -36,28 +76,34 @@ def calculate_and_plot_mean_correlation_matrix(data_path, path_plot):
         path_plot = 'path/to/save/your/corr_matrix.png'
         calculate_and_plot_mean_correlation_matrix(data_path, path_plot)
     """
-    list_corr_matrices = []
-
-    for root, _, files in alive_it(list(os.walk(data_path))):
-        for file_name in files:
-            if ".bz2" in file_name:
-                file_path = os.path.join(root, file_name)
-                dict_features, inplay_idx = extract_features_from_price_file(price_file=file_path)
-                dict_features_only_lists = {feature_name: feature for feature_name, feature in dict_features.items()
-                                        if isinstance(feature, list)}
-
-                df_features = pd.DataFrame.from_dict(dict_features_only_lists)
-                corr_matrix = df_features.corr()
-
-                if corr_matrix.shape==(11,11):
-                    list_corr_matrices.append(corr_matrix)
-
-    mean_matrix = np.nanmean(list_corr_matrices, axis=0)
+    list_file_paths = get_price_file_paths(data_path=data_path, price_files=price_files)
+    aggregator = online_statistics.MeanCorrelationAggregator()
+
+    if workers is None or workers<=1:
+        for file_path in alive_it(list_file_paths):
+            aggregator.update(calculate_correlation_matrix_of_price_file(
+                price_file=file_path,
+                resample_interval=resample_interval,
+                correlation_max_samples=correlation_max_samples,
+                correlation_bucket_ms=correlation_bucket_ms))
+    else:
+        list_tasks = [list_file_paths[idx:idx+files_per_task]
+                      for idx in range(0, len(list_file_paths), files_per_task)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for task_aggregator in alive_it(executor.map(aggregate_correlation_matrices_of_price_files, list_tasks,
+                                                         [resample_interval]*len(list_tasks),
+                                                         [correlation_max_samples]*len(list_tasks),
+                                                         [correlation_bucket_ms]*len(list_tasks)),
+                                            total=len(list_tasks)):
+                aggregator.merge(task_aggregator)
+
+    df_mean_matrix = aggregator.mean()
+    mean_matrix = df_mean_matrix.to_numpy()
 
     f, ax = plt.subplots(figsize=(12, 9))
     mask = np.triu(mean_matrix)
-    sns.heatmap(mean_matrix, square=False, annot=True, xticklabels=[col for col in list_corr_matrices[0]],
-            yticklabels=[col for col in list_corr_matrices[0]],
+    sns.heatmap(mean_matrix, square=False, annot=True, xticklabels=list(df_mean_matrix.columns),
+            yticklabels=list(df_mean_matrix.columns),
             fmt='.2f',
             mask=mask)
     f.tight_layout()
@@ -68,9 +114,81 @@ def calculate_and_plot_mean_correlation_matrix(data_path, path_plot):
 
 
 
+def calculate_correlation_matrix_of_price_file(price_file, resample_interval=None, correlation_max_samples=None,
+                                               correlation_bucket_ms=None):
+    """
+    This function calculates the correlation matrix between the features (the ones that are lists or arrays, except
+    the publish times and the pre-event and in-play diff times, that have a different length) extracted from a
+    price file.
 
+    Args:
+        price_file (str): Path to the price file.
+        resample_interval (int, str or None): If not None, the correlation matrix is calculated on the features
+        resampled into bars of this interval of publish time (the close of the bars, see
+        resample_features_from_price_file), so it isn't weighted by the frequency of the market books.
+        correlation_max_samples (int or None): If not None, the correlation matrix is calculated on (at most) this
+        number of rows, subsampled at regular intervals (see correlation.subsample_features).
+        correlation_bucket_ms (int or None): If not None, the correlation matrix is calculated only on the last row of
+        each time bucket of this length (in milliseconds) of publish time (see correlation.subsample_features).
 
-def analyse_and_plot_multiple_price_files(data_path, results_dir, save_result_in_pickle):
+    Returns:
+        pandas.DataFrame: The correlation matrix, with the names of the features as index and columns.
+    """
+    if resample_interval is None:
+        dict_features, inplay_idx = extract_features_from_price_file(price_file=price_file)
+    else:
+        dict_bars, inplay_idx = resample_features_from_price_file(price_file=price_file,
+                                                                  resample_interval=resample_interval)
+        dict_features = resampling.get_close_features(dict_bars)
+    dict_features_only_lists = {feature_name: feature for feature_name, feature in dict_features.items()
+                            if isinstance(feature, (list, np.ndarray)) and
+                            feature_name!='Pre-event diff time' and
+                            feature_name!='In-play diff time' and
+                            feature_name!='Publish time'}
+
+    df_features = pd.DataFrame.from_dict(dict_features_only_lists)
+
+    return correlation.calculate_correlation_matrices(df_features=df_features,
+                                                      methods=('pearson',),
+                                                      max_samples=correlation_max_samples,
+                                                      publish_times=dict_features['Publish time'],
+                                                      bucket_ms=correlation_bucket_ms)['pearson']
+
+
+
+def aggregate_correlation_matrices_of_price_files(price_files, resample_interval=None, correlation_max_samples=None,
+                                                  correlation_bucket_ms=None):
+    """
+    This function aggregates the correlation matrices of a group of price files (it is the task executed by each
+    process in calculate_and_plot_mean_correlation_matrix).
+
+    Args:
+        price_files (list): The paths of the price files.
+        resample_interval (int, str or None): See calculate_correlation_matrix_of_price_file.
+        correlation_max_samples (int or None): See calculate_correlation_matrix_of_price_file.
+        correlation_bucket_ms (int or None): See calculate_correlation_matrix_of_price_file.
+
+    Returns:
+        online_statistics.MeanCorrelationAggregator: The aggregator of the correlation matrices of the price files.
+    """
+    aggregator = online_statistics.MeanCorrelationAggregator()
+    for price_file in price_files:
+        aggregator.update(calculate_correlation_matrix_of_price_file(price_file=price_file,
+                                                                     resample_interval=resample_interval,
+                                                                     correlation_max_samples=correlation_max_samples,
+                                                                     correlation_bucket_ms=correlation_bucket_ms))
+
+    return aggregator
+
+
+
+
+
+def analyse_and_plot_multiple_price_files(data_path, results_dir, save_result_in_pickle, workers=None,
+                                          price_files=None, plot=True, plot_features=None, plot_workers=None,
+                                          resume=False, incremental=False, results_store_dir=None,
+                                          resample_interval=None, correlation_max_samples=None,
+                                          correlation_bucket_ms=None):
     """
     This function traverses through a given directory, analyses and generates plots for every price file found,
     and saves the result in pickle files. It calculates aggregate statistics, identifies missing data,
@@ -81,6 +199,14 @@ def analyse_and_plot_multiple_price_files(data_path, results_dir, save_result_in
         - 4 pickle files ('aggregate_stats_dict.pkl', 'missing_data_dict.pkl',
           'tot_volume_traded_dict.pkl', 'pre_event_volume_traded.pkl') are saved
           in the 'results-dir' directory.
+        - the streaming statistics of the features of all the price files (see
+          online_statistics.FeatureStatisticsAggregator) are saved in 'feature_statistics.pkl', so the
+          aggregate statistics and the missing data of several results directories (for example all the days
+          of a month) can be merged (see merge_feature_statistics).
+        - the quantile sketches of the total volume traded and of the pre-event volume traded are saved
+          alongside their pickle files ('tot_volume_traded_dict_sketch.pkl' and
+          'pre_event_volume_traded_sketch.pkl'), so the distribution of the volumes of many results
+          directories can be calculated merging them (see data_plotting.load_and_plot_all_volume_pickle_files).
         - 2 plots are saved in the 'results_dir' directory. One showes the distribution of the
         feature 'total volume traded' in all the events analysed and the other one shows the
         distribution of the 'Pre event volume traded' feature.
@@ -91,10 +217,43 @@ def analyse_and_plot_multiple_price_files(data_path, results_dir, save_result_in
         total volume traded and pre event volume traded) will be saved (the directory doesn't
         have to exist already, it is created in case it doesn't).
         save_result_in_pickle (bool): If True, the function saves the results in pickle files.
+        workers (int or None): Number of processes used to analyse the price files in parallel (each price file is
+        analysed independently by one process). If None or 1 the price files are analysed one at the time in the
+        current process. The results are merged in the same order of the sequential analysis in both cases.
+        price_files (list or None): If not None, only these price files are analysed instead of all the price files
+        in 'data_path' (see get_price_file_paths).
+        plot (bool): If False, the plots of the single price files aren't rendered.
+        plot_features (list or None): If not None, only the plots of these features (and the correlation matrices)
+        are rendered for each price file.
+        plot_workers (int or None): Number of processes used to render the plots of the price files (see
+        data_plotting.PlotQueue), separately from the analysis. If None the plots are rendered in the current
+        process, after the analysis of each price file.
+        resume (bool): If True, the run is resumable (see the job_manifest module): the list of the price files is
+        saved in a job manifest in 'results_dir' and the result of each price file is saved in a checkpoint as soon
+        as it is analysed. If the run is interrupted, the next run with resume=True and the same 'results_dir'
+        analyses only the price files of the manifest that don't have a checkpoint yet, and merges their results
+        with the checkpointed ones (for these price files 'dict_all_results' contains the checkpoint, that
+        doesn't include the time series of the features). The 'results.txt' file is written again from the start.
+        incremental (bool): If True, the run is resumable (like with resume=True) and the job manifest is updated
+        with the price files currently in 'data_path' (see job_manifest.update_job_manifest): only the price files
+        that have been added or changed since the previous run are analysed, the removed ones are dropped, and the
+        aggregate pickles are updated merging the new results with the checkpointed ones. A results directory
+        created without a manifest is analysed entirely the first time.
+        results_store_dir (str or None): If not None, the results of the price files (one row per market) are
+        appended to the results store in this directory (see the results_store module). The store can be shared by
+        the analyses of different days. In an incremental run only the rows of the price files analysed again are
+        appended (and the removed price files are removed from the store).
+        resample_interval (int, str or None): If not None, the plots and the correlation matrices of each price file
+        are calculated on its features resampled into bars of this interval of publish time, like '10s' (see
+        analyse_and_plot_single_price_file). The aggregate statistics and the missing data are still calculated on
+        the market books.
+        correlation_max_samples (int or None): See analyse_and_plot_single_price_file.
+        correlation_bucket_ms (int or None): See analyse_and_plot_single_price_file.
 
     Returns:
         dict: A dictionary containing aggregate statistics, missing data, total volume traded, and pre-event volume
-              traded for each price file.
+              traded for each price file, and the streaming statistics of all the price files
+              ('feature_statistics').
 
     Example:
 
@@ -113,27 +272,122 @@ def analyse_and_plot_multiple_price_files(data_path, results_dir, save_result_in
     dict_tot_volume_traded = {}
     dict_pre_event_vol_traded = {}
     dict_all_results = {}
-
-    for root, _, files in alive_it(list(os.walk(data_path))):
-        for file_name in files:
-            if ".bz2" in file_name:
-                plot_dir_name = file_name.split(".bz2")[0]
-                file_path = os.path.join(root, file_name)
-                plot_path = os.path.join(plot_dir, plot_dir_name)
-                print(file_path)
-
-                if not os.path.exists(plot_path):
-                    os.makedirs(plot_path)
-
-                dict_result = analyse_and_plot_single_price_file(price_file_path=file_path,
-                                        results_dir=results_dir)
-
-                dict_all_results[file_name] = dict_result
-
-                dict_aggregate_stats[file_name] = dict_result['aggr_stats']
-                dict_missing_data[file_name] = dict_result['missing_data']
-                dict_tot_volume_traded[file_name] = dict_result['tot_vol_traded']
-                dict_pre_event_vol_traded[file_name] = dict_result['pre_event_vol_traded']
+    ## the streaming statistics of all the price files, merged one price file at the time
+    feature_statistics = online_statistics.FeatureStatisticsAggregator()
+
+    list_file_paths = get_price_file_paths(data_path=data_path, price_files=price_files)
+    dict_checkpoints = {}
+    list_removed_file_paths = []
+    ## the rows of the checkpointed price files are already in the results store only if the previous run completed
+    store_checkpointed_results = True
+    resume = resume or incremental
+    if resume:
+        manifest = job_manifest.load_job_manifest(results_dir)
+        if manifest is None:
+            manifest = job_manifest.create_job_manifest(data_path=data_path, price_files=list_file_paths)
+            job_manifest.save_job_manifest(results_dir, manifest)
+        elif incremental:
+            store_checkpointed_results = not manifest['complete']
+            old_file_paths = [file['path'] for file in manifest['files']]
+            manifest, _ = job_manifest.update_job_manifest(results_dir=results_dir, manifest=manifest,
+                                                           data_path=data_path, price_files=list_file_paths)
+            job_manifest.save_job_manifest(results_dir, manifest)
+            new_file_paths = {file['path'] for file in manifest['files']}
+            list_removed_file_paths = [file_path for file_path in old_file_paths if file_path not in new_file_paths]
+        list_file_paths = [file['path'] for file in manifest['files']]
+
+        for file_path in list_file_paths:
+            checkpoint = job_manifest.load_price_file_checkpoint(results_dir, os.path.basename(file_path))
+            if checkpoint is not None:
+                dict_checkpoints[file_path] = checkpoint
+
+        ## the results of the checkpointed price files are written again, in the order of the manifest
+        if os.path.exists(os.path.join(results_dir, 'results.txt')):
+            os.remove(os.path.join(results_dir, 'results.txt'))
+
+    list_file_paths_to_analyse = [file_path for file_path in list_file_paths if file_path not in dict_checkpoints]
+    if plot:
+        for file_path in list_file_paths_to_analyse:
+            plot_dir_name = os.path.basename(file_path).split(".bz2")[0]
+            plot_path = os.path.join(plot_dir, plot_dir_name)
+
+            if not os.path.exists(plot_path):
+                os.makedirs(plot_path)
+
+    if workers is None or workers<=1:
+        iterator_results = (analyse_and_plot_single_price_file(price_file_path=file_path,
+                                                               results_dir=results_dir,
+                                                               write_results=False,
+                                                               plot=False,
+                                                               resample_interval=resample_interval,
+                                                               correlation_max_samples=correlation_max_samples,
+                                                               correlation_bucket_ms=correlation_bucket_ms)
+                            for file_path in list_file_paths_to_analyse)
+        executor = None
+    else:
+        ## Executor.map returns the results in the same order of list_file_paths, so the merge is deterministic
+        executor = ProcessPoolExecutor(max_workers=workers)
+        iterator_results = executor.map(analyse_and_plot_single_price_file,
+                                        list_file_paths_to_analyse,
+                                        [results_dir]*len(list_file_paths_to_analyse),
+                                        [False]*len(list_file_paths_to_analyse),
+                                        [False]*len(list_file_paths_to_analyse),
+                                        [None]*len(list_file_paths_to_analyse),
+                                        [resample_interval]*len(list_file_paths_to_analyse),
+                                        [correlation_max_samples]*len(list_file_paths_to_analyse),
+                                        [correlation_bucket_ms]*len(list_file_paths_to_analyse))
+
+    ## The plots are rendered by the plot queue, so the analysis of the next price files doesn't wait for them
+    plot_queue = data_plotting.PlotQueue(workers=plot_workers)
+
+    list_store_rows = []
+
+    try:
+        for file_path in alive_it(list_file_paths):
+            file_name = os.path.basename(file_path)
+            print(file_path)
+            if file_path in dict_checkpoints:
+                dict_result = dict_checkpoints[file_path]
+                if results_store_dir is not None and store_checkpointed_results:
+                    list_store_rows.append(results_store.price_file_result_to_row(file_path, dict_result))
+            else:
+                dict_result = next(iterator_results)
+                if resume:
+                    job_manifest.save_price_file_checkpoint(results_dir=results_dir,
+                                                            file_name=file_name,
+                                                            dict_result=dict_result)
+                if results_store_dir is not None:
+                    list_store_rows.append(results_store.price_file_result_to_row(file_path, dict_result))
+            write_price_file_results(results_dir=results_dir, dict_features=dict_result['dict_features'])
+
+            if plot and file_path not in dict_checkpoints:
+                if dict_result.get('dict_bars') is not None:
+                    dict_features_to_plot = resampling.get_close_features(dict_result['dict_bars'])
+                    plot_inplay_idx = dict_result['bars_inplay_idx']
+                else:
+                    dict_features_to_plot, plot_inplay_idx = dict_result['dict_features'], dict_result['inplay_idx']
+                plot_queue.submit(dict_features=get_features_to_plot(dict_features_to_plot),
+                                  inplay_idx=plot_inplay_idx,
+                                  plot_path=os.path.join(plot_dir, file_name.split(".bz2")[0]),
+                                  correlation_matrices=dict_result['corr_matrices'],
+                                  features=plot_features)
+
+            dict_all_results[file_name] = dict_result
+
+            dict_aggregate_stats[file_name] = dict_result['aggr_stats']
+            dict_missing_data[file_name] = dict_result['missing_data']
+            ## (the checkpoints saved before the streaming statistics don't have them)
+            if dict_result.get('feature_statistics') is not None:
+                feature_statistics.merge(dict_result['feature_statistics'])
+            dict_tot_volume_traded[file_name] = dict_result['tot_vol_traded']
+            dict_pre_event_vol_traded[file_name] = dict_result['pre_event_vol_traded']
+
+        ## Wait for the last plots to be rendered
+        plot_queue.close()
+    finally:
+        plot_queue.close(wait=False)
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
     data_plotting.plot_distr_volume_traded(dict_volume_traded=dict_tot_volume_traded,
                                                 path_plot=os.path.join(results_dir, constants.NAME_PLOT_TOT_VOLUME),
@@ -143,28 +397,51 @@ def analyse_and_plot_multiple_price_files(data_path, results_dir, save_result_in
                                                 binwidth=5000)
 
     if save_result_in_pickle:
-        with open(os.path.join(results_dir,'aggregate_stats_dict.pkl'), 'wb') as f:
+        with open(os.path.join(results_dir, constants.PICKLE_FILE_NAME_AGGREGATE_STATS), 'wb') as f:
             pickle.dump(dict_aggregate_stats, f)
 
-        with open(os.path.join(results_dir,'missing_data_dict.pkl'), 'wb') as f:
+        with open(os.path.join(results_dir, constants.PICKLE_FILE_NAME_MISSING_DATA), 'wb') as f:
             pickle.dump(dict_missing_data, f)
 
-        with open(os.path.join(results_dir,'tot_volume_traded_dict.pkl'), 'wb') as f:
+        with open(os.path.join(results_dir, constants.PICKLE_FILE_NAME_TOT_VOLUME), 'wb') as f:
             pickle.dump(dict_tot_volume_traded, f)
 
-        with open(os.path.join(results_dir,'pre_event_volume_traded.pkl'), 'wb') as f:
+        with open(os.path.join(results_dir, constants.PICKLE_FILE_NAME_PRE_EVENT_VOLUME), 'wb') as f:
             pickle.dump(dict_pre_event_vol_traded, f)
 
+        with open(os.path.join(results_dir, constants.PICKLE_FILE_NAME_FEATURE_STATISTICS), 'wb') as f:
+            pickle.dump(feature_statistics, f)
+
+        ## the quantile sketches of the volumes, merged by data_plotting.load_and_plot_all_volume_pickle_files
+        for name_pickle_file, dict_volume_traded in ((constants.PICKLE_FILE_NAME_TOT_VOLUME, dict_tot_volume_traded),
+                                                     (constants.PICKLE_FILE_NAME_PRE_EVENT_VOLUME,
+                                                      dict_pre_event_vol_traded)):
+            with open(os.path.join(results_dir, data_plotting.get_volume_sketch_file_name(name_pickle_file)),
+                      'wb') as f:
+                pickle.dump(data_plotting.create_volume_statistics(dict_volume_traded), f)
+
+    if results_store_dir is not None:
+        results_store.append_to_results_store(store_dir=results_store_dir,
+                                              rows=list_store_rows,
+                                              removed_price_files=list_removed_file_paths)
+
+    if resume:
+        manifest['complete'] = True
+        job_manifest.save_job_manifest(results_dir, manifest)
+
     return {'aggr_stats': dict_aggregate_stats,
             'missing_data': dict_missing_data,
             'tot_vol_traded': dict_tot_volume_traded,
             'pre_event_vol_traded': dict_pre_event_vol_traded,
+            'feature_statistics': feature_statistics,
             'dict_all_results': dict_all_results}
 
 
 
 
-def analyse_and_plot_single_price_file(price_file_path, results_dir):
+def analyse_and_plot_single_price_file(price_file_path, results_dir, write_results=True, plot=True,
+                                       plot_features=None, resample_interval=None, correlation_max_samples=None,
+                                       correlation_bucket_ms=None):
     """
     This function analyses a given price file, generates several plots based on its features, calculates aggregate
     statistics, identifies missing data, and returns these results in a dictionary format.
@@ -172,10 +449,30 @@ def analyse_and_plot_single_price_file(price_file_path, results_dir):
     Args:
         price_file_path (str): The path for the price file to be analysed.
         results_dir (str): The path where the plots  and some textaul results will be saved.
+        write_results (bool): If True, the textual results are appended to the 'results.txt' file in 'results_dir'
+        (see write_price_file_results). It is False when the price files are analysed in parallel, so that
+        the results are written by the main process in a deterministic order.
+        plot (bool): If False, the plots aren't rendered (the features and the correlation matrices are returned, so
+        they can be rendered later, see data_plotting.PlotQueue).
+        plot_features (list or None): If not None, only the plots of these features (and the correlation matrices)
+        are rendered.
+        resample_interval (int, str or None): If not None, the plots and the correlation matrices are calculated on
+        the features resampled into bars of this interval of publish time, like '10s' (the close of the bars, see
+        resample_features_from_price_file), instead of on every market book.
+        correlation_max_samples (int or None): If not None, the correlation matrices are calculated on (at most) this
+        number of rows, subsampled at regular intervals (see correlation.subsample_features). The plots and the
+        statistics still use all the rows.
+        correlation_bucket_ms (int or None): If not None, the correlation matrices are calculated only on the last row
+        of each time bucket of this length (in milliseconds) of publish time (see correlation.subsample_features).
 
     Returns:
-        dict: A dictionary containing aggregate statistics, missing data, total volume traded, and pre-event volume
-              traded for the price file.
+        dict: A dictionary containing aggregate statistics, missing data, total volume traded, pre-event volume
+              traded and the correlation matrices (Pearson, Kendall and Spearman) of the features of the price file.
+              The aggregate statistics are exact (like pandas.DataFrame.describe), the streaming statistics of the
+              features ('feature_statistics', see online_statistics.FeatureStatisticsAggregator) are returned to be
+              merged with the ones of other price files (their quantiles are approximated). When the features are
+              resampled, it also contains the resampled features ('dict_bars') and the index of the in-play bar
+              ('bars_inplay_idx'), otherwise they are None.
 
     Example:
 
@@ -191,28 +488,128 @@ def analyse_and_plot_single_price_file(price_file_path, results_dir):
 
     dict_features, inplay_idx = extract_features_from_price_file(price_file=price_file_path)
 
-    dict_features_only_lists = {feature_name: feature for feature_name, feature in dict_features.items()
-                               if isinstance(feature, list)}
-
-    df_features = pd.DataFrame.from_dict({k: v for k, v in dict_features_only_lists.items()
-                                          if k!='Pre-event diff time' and
-                                          k!='In-play diff time'})
+    dict_features_only_lists = get_features_to_plot(dict_features)
+    dict_series = {k: v for k, v in dict_features_only_lists.items()
+                   if k!='Pre-event diff time' and
+                   k!='In-play diff time' and
+                   k!='Publish time'}
+
+    ## The plots and the correlation matrices use the bars of publish time, if the features are resampled
+    dict_bars, bars_inplay_idx = None, None
+    if resample_interval is None:
+        dict_features_to_plot, plot_inplay_idx = dict_features_only_lists, inplay_idx
+        df_correlation = pd.DataFrame.from_dict(dict_series)
+        correlation_publish_times = dict_features['Publish time']
+    else:
+        dict_bars, bars_inplay_idx = resample_features_from_price_file(price_file=price_file_path,
+                                                                       resample_interval=resample_interval,
+                                                                       features=(dict_features, inplay_idx))
+        dict_features_to_plot = get_features_to_plot(resampling.get_close_features(dict_bars))
+        plot_inplay_idx = bars_inplay_idx
+        df_correlation = pd.DataFrame.from_dict({k: v for k, v in dict_features_to_plot.items()
+                                                 if k!='Pre-event diff time' and
+                                                 k!='In-play diff time' and
+                                                 k!='Publish time'})
+        correlation_publish_times = dict_features_to_plot['Publish time']
+
+    ## The correlation matrices are calculated once, plotted and returned
+    correlation_matrices = correlation.calculate_correlation_matrices(df_features=df_correlation,
+                                                                      max_samples=correlation_max_samples,
+                                                                      publish_times=correlation_publish_times,
+                                                                      bucket_ms=correlation_bucket_ms)
 
     ## PLOTS
-    data_plotting.plot_dict_features_from_price_file(dict_features=dict_features_only_lists,
-                                                   inplay_idx=inplay_idx,
-                                                   plot_path=plot_path)
+    if plot:
+        data_plotting.render_price_file_plots(dict_features=dict_features_to_plot,
+                                              inplay_idx=plot_inplay_idx,
+                                              plot_path=plot_path,
+                                              correlation_matrices=correlation_matrices,
+                                              features=plot_features)
+
+    ## AGGREGATE STATS AND MISSING DATA
+    ## The statistics of the price file are exact (its features are in memory), the streaming statistics are only
+    ## returned to be merged with the ones of other price files. The publish time is in the missing data, but it
+    ## isn't described.
+    feature_statistics = online_statistics.FeatureStatisticsAggregator()
+    feature_statistics.update({**dict_series, 'Publish time': dict_features_only_lists['Publish time']},
+                              missing_only=['Publish time'])
+    df_aggregate_stats = pd.DataFrame.from_dict(dict_series).describe()
+    df_missing_data = feature_statistics.missing_data()
 
-    data_plotting.plot_correlation_matrix(df_features=df_features,
-                                          plot_path=plot_path)
+    # WRITE TOT. VOLUME AND PRE-EVENT VOLUME
+    if write_results:
+        write_price_file_results(results_dir=results_dir, dict_features=dict_features)
 
-    ## AGGREGATE STATS
-    df_aggregate_stats = df_features.describe()
+    return {'aggr_stats': df_aggregate_stats,
+            'missing_data': df_missing_data,
+            'tot_vol_traded': dict_features['Total volume traded'],
+            'pre_event_vol_traded': dict_features['Pre-event volume'],
+            'corr_matrices': correlation_matrices,
+            'inplay_idx': inplay_idx,
+            'dict_features': dict_features,
+            'dict_bars': dict_bars,
+            'bars_inplay_idx': bars_inplay_idx,
+            'feature_statistics': feature_statistics}
 
-    ## MISSING DATA
-    df_missing_data = calculate_missing_data(df_features=df_features)
 
-    # WRITE TOT. VOLUME AND PRE-EVENT VOLUME
+
+def merge_feature_statistics(results_dirs):
+    """
+    This function merges the streaming statistics of the features saved in several results directories (see
+    analyse_and_plot_multiple_price_files), for example the ones of all the days of a month. Only the small
+    aggregators are loaded, and never the features or the results of the single price files.
+
+    Args:
+        results_dirs (list): The paths of the results directories (the ones without the streaming statistics are
+        skipped).
+
+    Returns:
+        online_statistics.FeatureStatisticsAggregator: The merged statistics (see its describe and missing_data
+        methods).
+
+    Example:
+        results_dirs = ['path/to/your/results_1', 'path/to/your/results_2']
+        feature_statistics = merge_feature_statistics(results_dirs)
+        df_aggregate_stats = feature_statistics.describe()
+        df_missing_data = feature_statistics.missing_data()
+    """
+    feature_statistics = online_statistics.FeatureStatisticsAggregator()
+    for results_dir in results_dirs:
+        statistics_path = os.path.join(results_dir, constants.PICKLE_FILE_NAME_FEATURE_STATISTICS)
+        if not os.path.exists(statistics_path):
+            continue
+        with open(statistics_path, 'rb') as f:
+            feature_statistics.merge(pickle.load(f))
+
+    return feature_statistics
+
+
+
+def get_features_to_plot(dict_features):
+    """
+    This function selects the features of a price file that are plotted as time series (the ones that are lists or
+    arrays).
+
+    Args:
+        dict_features (dict): The features of the price file (as returned by extract_features_from_price_file).
+
+    Returns:
+        dict: The features that are lists or arrays.
+    """
+    return {feature_name: feature for feature_name, feature in dict_features.items()
+            if isinstance(feature, (list, np.ndarray))}
+
+
+
+def write_price_file_results(results_dir, dict_features):
+    """
+    This function appends the features of a price file that are calculated on the entire price file (name, id, date,
+    total volume traded and pre event volume traded) to the 'results.txt' file in 'results_dir'.
+
+    Args:
+        results_dir (str): The path of the directory that contains the 'results.txt' file.
+        dict_features (dict): The features of the price file (as returned by extract_features_from_price_file).
+    """
     with open(os.path.join(results_dir,'results.txt'), 'a') as f:
         for name, _ in constants.FUNS_FOR_PRICE_FILE.items():
             f.write(f"{name}: {dict_features[name]}\n")
@@ -221,21 +618,26 @@ def analyse_and_plot_single_price_file(price_file_path, results_dir):
             # f.write(f"Pre event volume traded: {dict_features['Pre-event volume']}\n\n")
         f.write("\n")
 
-    return {'aggr_stats': df_aggregate_stats,
-            'missing_data': df_missing_data,
-            'tot_vol_traded': dict_features['Total volume traded'],
-            'pre_event_vol_traded': dict_features['Pre-event volume'],
-            'dict_features': dict_features}
 
 
+def _needs_order_book_ladders(feature_names):
+    ## the order book engine calculates the available volume only with the default maximum book percentage,
+    ## the other ones are calculated from the ladders
+    return any(name.startswith('Available volume') and name in constants.PARAMETERS_FOR_FUNCTIONS
+               and constants.PARAMETERS_FOR_FUNCTIONS[name][-1]!=constants.AVAILABLE_VOLUME_MAX_BOOK_PERCENTAGE
+               for name in feature_names)
+
 
-def extract_single_feature_from_multiple_price_files(data_path, feature_name):
+
+def extract_single_feature_from_multiple_price_files(data_path, feature_name, price_files=None):
     """
     This function extracts a specific feature from multiple data files stored in a directory.
 
     Args:
         data_path (str): The path to the directory where the data files are located.
         feature_name (str): The name of the feature to be extracted from the data files.
+        price_files (list or None): If not None, the feature is extracted only from these price files instead of all
+        the price files in 'data_path' (see get_price_file_paths).
 
     Returns:
         dict_results (dict): A dictionary with file names as keys and another dictionary as values. The nested
@@ -251,15 +653,17 @@ def extract_single_feature_from_multiple_price_files(data_path, feature_name):
     """
     dict_results = {}
 
-    for root, _, files in alive_it(list(os.walk(data_path))):
-        for file_name in files:
-            if ".bz2" in file_name:
-                file_path = os.path.join(root, file_name)
-                dict_results[file_name] = {}
+    for file_path in alive_it(get_price_file_paths(data_path=data_path, price_files=price_files)):
+        file_name = os.path.basename(file_path)
+        dict_results[file_name] = {}
 
-                dict_results[file_name]['inplay_idx'] = pricefileutils.get_last_pre_event_market_book_id_from_prices_file(file_path)
-                dict_results[file_name][feature_name] = extract_single_feature_from_price_file(price_file=file_path,
-                                                                feature_name=feature_name)
+        ## the price file is read only once, for both the in-play index and the feature
+        single_pass = data_processing.extract_features_in_single_pass_with_cache(
+            price_file_path=file_path, ladders=_needs_order_book_ladders([feature_name]))
+        dict_results[file_name]['inplay_idx'] = single_pass['inplay_idx']
+        dict_results[file_name][feature_name] = extract_single_feature_from_price_file(price_file=file_path,
+                                                        feature_name=feature_name,
+                                                        single_pass=single_pass)
 
 
     return dict_results
@@ -267,7 +671,7 @@ def extract_single_feature_from_multiple_price_files(data_path, feature_name):
 
 
 
-def extract_single_feature_from_price_file(price_file, feature_name):
+def extract_single_feature_from_price_file(price_file, feature_name, single_pass=None):
     """
     This function extracts a specific feature from a data file.
 
@@ -277,6 +681,8 @@ def extract_single_feature_from_price_file(price_file, feature_name):
     Args:
         price_file (str): The path to the data file.
         feature_name (str): The name of the feature to be extracted from the data file.
+        single_pass (dict or None): The single pass of the price file (see
+        data_processing.extract_features_in_single_pass_with_cache), if it has already been extracted.
 
     Returns:
         The result of the feature extraction function if the feature can be calculated, otherwise None.
@@ -286,7 +692,27 @@ def extract_single_feature_from_price_file(price_file, feature_name):
         feature_name = 'OB imbalance'
         extract_single_feature_from_price_file(price_file, feature_name)
     """
-    if feature_name in constants.FUNS_FOR_PRICE_FILE:
+    ## The metadata of the price file are read from its first market definition, without decoding the entire file
+    if feature_name in constants.FUNS_FOR_MARKET_DEFINITION:
+        return constants.FUNS_FOR_MARKET_DEFINITION[feature_name](pricefileutils.get_first_market_definition(price_file))
+
+    ## The features with a vectorized version are calculated on the (cached) columnar order book
+    elif (feature_name in constants.FUNS_FOR_SINGLE_PASS or feature_name in constants.VECTORIZED_FUNS_FOR_MB
+        or feature_name in constants.VECTORIZED_FUNS_FOR_RUNNERS):
+        if single_pass is None:
+            single_pass = data_processing.extract_features_in_single_pass_with_cache(
+                price_file_path=price_file, ladders=_needs_order_book_ladders([feature_name]))
+        parameters = constants.PARAMETERS_FOR_FUNCTIONS.get(feature_name, [])
+
+        if feature_name in constants.FUNS_FOR_SINGLE_PASS:
+            return constants.FUNS_FOR_SINGLE_PASS[feature_name](single_pass)
+        elif feature_name in constants.VECTORIZED_FUNS_FOR_MB:
+            return constants.VECTORIZED_FUNS_FOR_MB[feature_name](single_pass['order_book'], *parameters)
+        else:
+            results = constants.VECTORIZED_FUNS_FOR_RUNNERS[feature_name](single_pass['order_book'], *parameters)
+            return [results[:, idx] for idx in range(len(single_pass['first_market_definition']['runners']))]
+
+    elif feature_name in constants.FUNS_FOR_PRICE_FILE:
         return constants.FUNS_FOR_PRICE_FILE[feature_name](price_file)
 
     elif feature_name in constants.FUNS_FOR_MB:
@@ -311,7 +737,9 @@ def extract_single_feature_from_price_file(price_file, feature_name):
 def extract_features_from_price_file(price_file):
     """
     This function extracts statistics from a given price file. The statistics are calculated based on functions
-    defined in FUNS_FOR_PRICE_FILE, FUNS_FOR_MB, and FUNS_FOR_RUNNERS dictionaries in the constants module.
+    defined in FUNS_FOR_SINGLE_PASS, FUNS_FOR_MB, and FUNS_FOR_RUNNERS dictionaries in the constants module.
+    The price file is decompressed and parsed only once (see data_processing.extract_features_in_single_pass), and
+    not at all if it is already in the cache of decoded price files (see data_processing.get_price_file_cache_dir).
 
     Args:
         price_file (str): Path to the price file.
@@ -329,42 +757,57 @@ def extract_features_from_price_file(price_file):
 
     """
     dict_features = {}
-    inplay_idx = pricefileutils.get_last_pre_event_market_book_id_from_prices_file(price_file)
-
-
-    for name, function in constants.FUNS_FOR_PRICE_FILE.items():
-        dict_features[name] = function(price_file)
-
-    for name, function in constants.FUNS_FOR_MB.items():
-        dict_features[name] = data_processing.apply_function_for_mb_on_entire_price_file(
-            price_file_path=price_file,
-            function_for_mb=function,
-            parameters=constants.PARAMETERS_FOR_FUNCTIONS.get(name, [])
-        )
 
-    for name, function in constants.FUNS_FOR_RUNNERS.items():
-        #print(name)
-        results = data_processing.apply_function_for_runner_on_entire_price_file(
-            price_file_path=price_file,
-            function_for_runner=function,
-            parameters=constants.PARAMETERS_FOR_FUNCTIONS.get(name, [])
-        )
-        if results!=None:
-            for idx, result in enumerate(results):
-                dict_features[name+f"_{idx+1}"] = result
-
-    dict_features['Matched'] = list(np.diff(dict_features['Total matched'], prepend=0))
-    final_matched_volume = max(dict_features['Total matched'])
+    ## The price file is read only once and all the features are calculated from that single pass
+    ## (the features with a vectorized version are calculated on the columnar order book instead)
+    single_pass = data_processing.extract_features_in_single_pass_with_cache(
+        price_file_path=price_file,
+        funs_for_mb={name: function for name, function in constants.FUNS_FOR_MB.items()
+                     if name not in constants.VECTORIZED_FUNS_FOR_MB},
+        funs_for_runners={name: function for name, function in constants.FUNS_FOR_RUNNERS.items()
+                          if name not in constants.VECTORIZED_FUNS_FOR_RUNNERS},
+        parameters_for_functions=constants.PARAMETERS_FOR_FUNCTIONS,
+        ladders=_needs_order_book_ladders(constants.FUNS_FOR_MB)
+    )
+    inplay_idx = single_pass['inplay_idx']
+    columns = single_pass['order_book']
+
+    for name, function in constants.FUNS_FOR_SINGLE_PASS.items():
+        dict_features[name] = function(single_pass)
+
+    for name in constants.FUNS_FOR_MB:
+        if name in constants.VECTORIZED_FUNS_FOR_MB:
+            dict_features[name] = constants.VECTORIZED_FUNS_FOR_MB[name](
+                columns, *constants.PARAMETERS_FOR_FUNCTIONS.get(name, []))
+        else:
+            dict_features[name] = single_pass['features_for_mb'][name]
+
+    ## The runners are identified by their selection IDs (in the order of the first market definition),
+    ## so their features are extracted even when the runner names get changed during the match
+    n_runners = len(single_pass['first_market_definition']['runners'])
+    for name in constants.FUNS_FOR_RUNNERS:
+        if name in constants.VECTORIZED_FUNS_FOR_RUNNERS:
+            results = constants.VECTORIZED_FUNS_FOR_RUNNERS[name](
+                columns, *constants.PARAMETERS_FOR_FUNCTIONS.get(name, []))
+            results = [results[:, idx] for idx in range(n_runners)]
+        else:
+            results = single_pass['features_for_runners'][name]
+        for idx, result in enumerate(results):
+            dict_features[name+f"_{idx+1}"] = result
+
+    dict_features['Matched'] = np.diff(dict_features['Total matched'], prepend=0)
+    final_matched_volume = np.max(dict_features['Total matched'])
     if final_matched_volume>0:
-        dict_features['Normalized matched'] = [volume/final_matched_volume for volume in dict_features['Total matched']]
+        dict_features['Normalized matched'] = np.asarray(dict_features['Total matched']) / final_matched_volume
     dict_features['Diff time'] = calculate_avg_time_between_market_books(dict_features['Publish time'])
 
     # print(f"Event name: {dict_features['Name']}")
     # print(f"Total volume traded: {dict_features['Total volume traded']}")
     # print(f"Pre-event volume: {dict_features['Pre-event volume']}")
     if inplay_idx!=None:
-        dict_features['Pre-event diff time'] = dict_features['Diff time'][:inplay_idx]
-        dict_features['In-play diff time'] = dict_features['Diff time'][inplay_idx:]
+        ## (views of the diff times, not copies)
+        dict_features['Pre-event diff time'], dict_features['In-play diff time'] = order_book.split_pre_event_in_play(
+            dict_features['Diff time'], inplay_idx)
         dict_features['Pre-event avg diff time'] = np.average(dict_features['Pre-event diff time'])
         dict_features['In-play avg diff time'] = np.average(dict_features['In-play diff time'])
         # print(f"Pre-event avg diff time: {dict_features['Pre-event avg diff time']}")
@@ -375,60 +818,112 @@ def extract_features_from_price_file(price_file):
     return dict_features, inplay_idx
 
 
-def calculate_avg_time_between_market_books(list_timestamps):
+
+def resample_features_from_price_file(price_file, resample_interval, features=None, cache_dir=None):
     """
-    This function calculates the average time in seconds between subsequent market books,
-    represented by timestamps.
+    This function extracts the features of a price file (see extract_features_from_price_file) and resamples them
+    into bars of a fixed interval of publish time (see resampling.resample_features), so that each bar has the same
+    weight in the correlations and in the plots, however many market books it contains. The pre-event and in-play
+    diff times are split again at the in-play bar.
+    The resampled features are cached in the entry of the price file in the cache of decoded price files (see
+    data_processing.load_resampled_features_from_cache), so the next time the price file isn't read at all.
 
     Args:
-        list_timestamps (list): A list of datetime objects representing the timestamps of the market books.
+        price_file (str): Path to the price file.
+        resample_interval (int or str): The interval of the bars, in milliseconds or like '1s', '10s' or '1m' (see
+        resampling.parse_resample_interval).
+        features (tuple or None): The features and the in-play index already extracted from the price file (as
+        returned by extract_features_from_price_file), used instead of extracting them again if the resampled
+        features aren't in the cache.
+        cache_dir (str or None): Directory of the cache (see data_processing.get_price_file_cache_dir).
 
     Returns:
-        list: A list of the time differences (in seconds) between subsequent market books. The last element is always 0
-              as it's the difference with itself.
+        dict: The resampled features. The prices (like 'Mid price_1') have also the open, high and low of the bars
+        (like 'Mid price_1 open', see resampling.get_close_features to remove them).
+        int or None: The index of the bar that contains the first in-play market book.
 
     Example:
+        dict_bars, bars_inplay_idx = resample_features_from_price_file('path/to/your/file.bz2', '10s')
+    """
+    interval_ms = resampling.parse_resample_interval(resample_interval)
+    cached = data_processing.load_resampled_features_from_cache(price_file_path=price_file, interval_ms=interval_ms,
+                                                                cache_dir=cache_dir)
+    if cached is not None:
+        return cached
+
+    dict_features, inplay_idx = features if features is not None else extract_features_from_price_file(price_file)
+    dict_bars, bars_inplay_idx = resampling.resample_features(dict_features=dict_features, inplay_idx=inplay_idx,
+                                                              interval=interval_ms)
+    if bars_inplay_idx!=None and 'Diff time' in dict_bars:
+        dict_bars['Pre-event diff time'], dict_bars['In-play diff time'] = order_book.split_pre_event_in_play(
+            dict_bars['Diff time'], bars_inplay_idx)
 
-        timestamps = [datetime(2020, 1, 1, 10, 0), datetime(2020, 1, 1, 11, 0), datetime(2020, 1, 1, 12, 0)]
-        diffs_seconds = calculate_avg_time_between_market_books(timestamps)
-        # diffs_seconds would be [3600.0, 3600.0, 0]
+    data_processing.save_resampled_features_to_cache(price_file_path=price_file, interval_ms=interval_ms,
+                                                     dict_bars=dict_bars, bars_inplay_idx=bars_inplay_idx,
+                                                     cache_dir=cache_dir)
+
+    return dict_bars, bars_inplay_idx
+
+
+
+def calculate_avg_time_between_market_books(publish_times):
     """
-    diffs = [(list_timestamps[i+1]-list_timestamps[i])
-            for i in range(len(list_timestamps)-1)]
+    This function calculates the time in seconds between subsequent market books, represented by their publish
+    times.
+
+    Args:
+        publish_times (numpy.ndarray or list): The publish times of the market books in epoch milliseconds (like the
+        'Publish time' feature). A list of datetime objects is also accepted.
+
+    Returns:
+        numpy.ndarray: An array of the time differences (in seconds) between subsequent market books. The last
+        element is always 0 as it's the difference with itself.
+
+    Example:
 
-    diffs_seconds = [diff.total_seconds() for diff in diffs]
-    diffs_seconds.append(0)
+        publish_times = np.array([1577872800000, 1577876400000, 1577880000000])
+        diffs_seconds = calculate_avg_time_between_market_books(publish_times)
+        # diffs_seconds would be array([3600., 3600., 0.])
+    """
+    publish_times = _to_epoch_milliseconds(publish_times)
 
-    return diffs_seconds
+    return np.append(np.diff(publish_times) / 1000, 0.0)
 
 
 
-def calculate_time_from_inplay(list_timestamps, inplay_idx):
+def calculate_time_from_inplay(publish_times, inplay_idx):
     """
-    This function calculates the time difference between each timestamp in a list and a specific timestamp
-    (identified by the inplay_idx) that represents the first in-play timestamp in the same list.
+    This function calculates the time difference between each publish time in an array and a specific publish time
+    (identified by the inplay_idx) that represents the first in-play market book.
 
-    It returns a list of differences in seconds between each timestamp and the "in-play" timestamp.
+    It returns an array of differences in seconds between each publish time and the "in-play" publish time.
 
     Args:
-        list_timestamps (list): The list of timestamps.
-        inplay_idx (int): The index of the "in-play" timestamp in the list_timestamps.
+        publish_times (numpy.ndarray or list): The publish times of the market books in epoch milliseconds (like the
+        'Publish time' feature). A list of datetime objects is also accepted.
+        inplay_idx (int): The index of the "in-play" publish time in publish_times.
 
     Returns:
-        diffs_seconds (list): A list of time differences in seconds.
+        diffs_seconds (numpy.ndarray): An array of time differences in seconds.
 
     Example:
-        list_timestamps = [datetime(2023, 7, 11, 13, 0, 0), datetime(2023, 7, 11, 13, 5, 0), datetime(2023, 7, 11, 13, 10, 0)]
+        publish_times = np.array([1689080400000, 1689080700000, 1689081000000])
         inplay_idx = 1
-        calculate_time_from_inplay(list_timestamps, inplay_idx)
-        # Output: [0, 300, 600]
+        calculate_time_from_inplay(publish_times, inplay_idx)
+        # Output: array([-300., 0., 300.])
     """
-    diffs = [(timestamp-list_timestamps[inplay_idx])
-            for idx, timestamp in enumerate(list_timestamps)]
+    publish_times = _to_epoch_milliseconds(publish_times)
+
+    return (publish_times - publish_times[inplay_idx]) / 1000
+
+
 
-    diffs_seconds = [diff.total_seconds() for diff in diffs]
+def _to_epoch_milliseconds(publish_times):
+    publish_times = np.asarray(publish_times)
+    if publish_times.dtype==object or np.issubdtype(publish_times.dtype, np.datetime64):
+        publish_times = pd.to_datetime(publish_times, utc=True).asi8 // 10**6
 
-    return diffs_seconds
+    return publish_times.astype(np.int64)
 
 
 
@@ -0,0 +1,142 @@
+"""
+This module contains the functions to convert the Betfair price files (".bz2" files with one JSON message per line) into
+a columnar Parquet dataset, partitioned by date, event ID and market ID, and to load it back.
+
+Each row of the dataset represents one runner in one market book (so there is one row per (publish time, runner)) and
+contains the order book of the runner (best prices and sizes on the back and lay side, up to a given depth), its last
+traded price and traded volume, and the state of the market.
+Once the data directory has been converted, the analyses can load only the columns and the markets they need
+(with predicate pushdown on the partitions and on the statistics of the Parquet files), instead of decompressing and
+parsing the JSON lines of every price file again.
+"""
+
+import os
+
+import betfairutil
+import numpy as np
+import pandas as pd
+from alive_progress import alive_it
+
+from src import data_processing, order_book
+
+PARTITION_COLS = ['date', 'event_id', 'market_id']
+
+
+def price_file_to_data_frame(price_file_path, depth=3):
+    """
+    This function converts a price file into a DataFrame with one row per (publish time, runner), built on the
+    columnar order book of the price file (see the order_book module).
+
+    Args:
+        price_file_path (str): Path to the Betfair price file.
+        depth (int): Number of levels of the back and lay ladders stored for each runner.
+
+    Returns:
+        pandas.DataFrame: A DataFrame with the following columns: 'date', 'event_id', 'market_id' (the partition
+        columns), 'market_book_idx', 'publish_time' (epoch milliseconds), 'status', 'inplay', 'total_matched',
+        'selection_id', 'runner_name', 'runner_status', 'last_traded_price', 'traded_volume' and, for each level
+        from 1 to depth, 'back_price_<level>', 'back_size_<level>', 'lay_price_<level>', 'lay_size_<level>'.
+
+    Example:
+        df = price_file_to_data_frame('path/to/your/data/1.208791811.bz2', depth=3)
+    """
+    ## the ladders of the runners are needed, so the order book isn't built by the order book engine
+    single_pass = data_processing.extract_features_in_single_pass_with_cache(price_file_path=price_file_path,
+                                                                             ladders=True)
+    columns = single_pass['order_book']
+    market_definition = single_pass['first_market_definition']
+
+    entry_book = np.asarray(columns['entry_book'])
+    entry_runner = np.asarray(columns['entry_runner'])
+    selection_ids = np.asarray(columns['selection_ids'])
+    runners_names = {runner['id']: runner.get('name') for runner in market_definition['runners']}
+    market_id = (betfairutil.get_market_id_from_string(os.path.basename(price_file_path))
+                 or os.path.basename(price_file_path).split(".bz2")[0])
+
+    data = {
+        'date': market_definition['openDate'][:10],
+        'event_id': market_definition['eventId'],
+        'market_id': market_id,
+        'market_book_idx': entry_book,
+        'publish_time': columns['publish_time'][entry_book],
+        'status': pd.Categorical.from_codes(columns['status'][entry_book], categories=order_book.MARKET_STATUSES),
+        'inplay': columns['inplay'][entry_book],
+        'total_matched': columns['total_matched'][entry_book],
+        'selection_id': selection_ids[entry_runner],
+        'runner_name': [runners_names.get(selection_id) for selection_id in selection_ids[entry_runner].tolist()],
+        'runner_status': pd.Categorical.from_codes(columns['runner_status'][entry_book, entry_runner],
+                                                   categories=order_book.RUNNER_STATUSES),
+        'last_traded_price': columns['last_traded_price'][entry_book, entry_runner],
+        'traded_volume': columns['traded_volume'][entry_book, entry_runner],
+    }
+
+    for side in ('back', 'lay'):
+        offsets = np.asarray(columns[f'{side}_offsets'])
+        ladder_depth = np.diff(offsets)
+        for level in range(depth):
+            has_level = ladder_depth > level
+            for field in ('price', 'size'):
+                values = np.full(len(entry_book), np.nan)
+                values[has_level] = columns[f'{side}_{field}s'][offsets[:-1][has_level] + level]
+                data[f'{side}_{field}_{level+1}'] = values
+
+    return pd.DataFrame(data)
+
+
+
+def convert_price_files_to_dataset(data_path, dataset_dir, depth=3):
+    """
+    This function converts all the price files found in a directory (and its subdirectories) into a Parquet dataset
+    partitioned by date, event ID and market ID (see price_file_to_data_frame for the columns).
+    The partition of a market is overwritten if the market is converted again, so the function can be run again on
+    the same directory (or on new directories) to update the dataset.
+
+    Args:
+        data_path (str): The path of the directory containing the price files.
+        dataset_dir (str): The path of the directory of the dataset (it is created in case it doesn't exist).
+        depth (int): Number of levels of the back and lay ladders stored for each runner.
+
+    Example:
+        data_path = 'path/to/your/data/Jan'
+        dataset_dir = 'path/to/your/dataset'
+        convert_price_files_to_dataset(data_path, dataset_dir)
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(dataset_dir, exist_ok=True)
+
+    for root, _, files in alive_it(list(os.walk(data_path))):
+        for file_name in files:
+            if ".bz2" in file_name:
+                df = price_file_to_data_frame(price_file_path=os.path.join(root, file_name), depth=depth)
+                if len(df)==0:
+                    continue
+                pq.write_to_dataset(pa.Table.from_pandas(df, preserve_index=False),
+                                    root_path=dataset_dir,
+                                    partition_cols=PARTITION_COLS,
+                                    existing_data_behavior='delete_matching')
+
+
+
+def load_price_dataset(dataset_dir, columns=None, filters=None):
+    """
+    This function loads (part of) the Parquet dataset created by convert_price_files_to_dataset. Only the given
+    columns are read, and the filters are pushed down to the partitions and to the Parquet files, so the markets
+    that don't satisfy them aren't read at all.
+
+    Args:
+        dataset_dir (str): The path of the directory of the dataset.
+        columns (list or None): The columns to load (all the columns if None).
+        filters (list or None): Filters in the format of pyarrow/pandas.read_parquet, like
+        [('event_id', '=', '32035350'), ('inplay', '=', True)].
+
+    Returns:
+        pandas.DataFrame: The rows of the dataset satisfying the filters.
+
+    Example:
+        df = load_price_dataset('path/to/your/dataset',
+                                columns=['market_id', 'publish_time', 'selection_id', 'back_price_1', 'lay_price_1'],
+                                filters=[('date', '>=', '2023-01-01'), ('date', '<=', '2023-01-31')])
+    """
+    return pd.read_parquet(dataset_dir, columns=columns, filters=filters)
@@ -12,7 +12,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 from alive_progress import alive_it
 
-from src import constants, data_analysis, data_plotting
+from src import (constants, data_analysis, data_conversion, data_plotting,
+                 job_manifest, market_catalogue)
 
 
 def data_exploration():
@@ -55,12 +56,67 @@ def data_exploration():
 
         ## the if statement is in case in the data directory you don't have all the days continuosly
         ## (if you skip some days) and in case you have already analyzed some of
-        ## the days' folder and produced the plots (hence the 'results_dir' directory
-        ## already exists).
-        if os.path.exists(day_folder_path) and not os.path.exists(results_dir):
+        ## the days' folder and produced the plots (hence the analysis in 'results_dir'
+        ## is complete). If the analysis of a day was interrupted, it is resumed from
+        ## the first price file that hasn't been analysed yet (check the 'job_manifest'
+        ## module documentation for more details).
+        if os.path.exists(day_folder_path) and not job_manifest.is_job_complete(results_dir):
             data_analysis.analyse_and_plot_multiple_price_files(data_path=day_folder_path,
                                                     results_dir=results_dir,
-                                                    save_result_in_pickle=True)
+                                                    save_result_in_pickle=True,
+                                                    resume=True,
+                                                    results_store_dir="./results_for_thesis/results_store")
+
+    # ## AGGREGATE STATS AND MISSING DATA OF THE WHOLE MONTH
+    # ## (merging the streaming statistics saved in the results directory of each day)
+    # feature_statistics = data_analysis.merge_feature_statistics(
+    #     [f"./results_for_thesis/results_{day_of_the_month}" for day_of_the_month in range(29, 32)])
+    # print(feature_statistics.describe())
+    # print(feature_statistics.missing_data())
+
+
+
+
+    # ## INCREMENTAL RE-ANALYSIS (NIGHTLY REFRESH)
+    # ## Only the price files added or changed since the previous run on the same
+    # ## 'results_dir' are analysed, and the aggregate pickles are updated with their
+    # ## results (check 'analyse_and_plot_multiple_price_files' documentation for more details).
+    # data_analysis.analyse_and_plot_multiple_price_files(data_path=os.path.join(data_directory, "match_odds"),
+    #                                                     results_dir="./results_match_odds",
+    #                                                     save_result_in_pickle=True,
+    #                                                     incremental=True)
+
+
+
+
+    # ## CONVERT PRICE FILES TO PARQUET DATASET
+    # ## This converts all the price files in the data directory into a Parquet dataset partitioned
+    # ## by date, event ID and market ID, so that the analyses can then load only the columns and
+    # ## markets they need (check 'convert_price_files_to_dataset' documentation for more details).
+    # data_conversion.convert_price_files_to_dataset(data_path=os.path.join(data_directory, "match_odds"),
+    #                                                dataset_dir="./price_dataset")
+    # df = data_conversion.load_price_dataset(dataset_dir="./price_dataset",
+    #                                         columns=['market_id', 'publish_time', 'selection_id', 'last_traded_price'],
+    #                                         filters=[('date', '>=', '2023-01-01'), ('date', '<=', '2023-01-31')])
+
+
+
+
+    # ## BUILD THE MARKET CATALOGUE AND ANALYSE ONLY THE SELECTED MARKETS
+    # ## The catalogue is updated incrementally (only new or modified price files are read), then the
+    # ## markets are selected with a query instead of walking the data directory (check the
+    # ## 'market_catalogue' module documentation for more details).
+    # catalogue_path = "./market_catalogue.sqlite"
+    # market_catalogue.update_market_catalogue(data_path=data_directory, catalogue_path=catalogue_path)
+    # price_files = market_catalogue.get_price_files_from_market_catalogue(catalogue_path,
+    #                                                                      market_type='MATCH_ODDS',
+    #                                                                      event_name='Djokovic',
+    #                                                                      start_date='2023-01-01',
+    #                                                                      end_date='2023-01-31')
+    # dict_result = data_analysis.analyse_and_plot_multiple_price_files(data_path=None,
+    #                                         results_dir="./results_djokovic_jan",
+    #                                         save_result_in_pickle=True,
+    #                                         price_files=price_files)
 
 
 
@@ -85,6 +141,22 @@ def data_exploration():
 
 
 
+    # ## LOAD AND PLOT DISTRIBUTION OF VOLUMES FROM THE RESULTS STORE
+    # ## The results of all the days analysed with 'results_store_dir' are in a single
+    # ## columnar store (one row per market), so the distribution of a feature over
+    # ## all the days is a single read of one column (check the 'results_store' module
+    # ## documentation for more details).
+    # data_plotting.load_and_plot_volume_from_results_store(
+    #     store_dir="./results_for_thesis/results_store",
+    #     column='Total volume traded',
+    #     path_plot="./results_for_thesis",
+    #     limit_volume=100000,
+    #     binwidth=1500,
+    # )
+
+
+
+
     # ## LOAD AND PLOT DISTRIBUTION OF ALL VOLUME PICKLE FILES
     # ## This is to load all the pickle files in a results directory
     # ## ('tot_volume_traded_dict.pkl' or 'pre_event_volume_traded.pkl') and
@@ -5,58 +5,105 @@ This module contains all the necessary function to plot the data. these function
 import os
 import pickle
 import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
 from alive_progress import alive_it
+from matplotlib.figure import Figure
+
+from src import constants, correlation, downsampling, online_statistics, results_store
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 
-def plot_dict_features_from_price_file(dict_features, inplay_idx, plot_path):
+def get_plot_downsampling(feature_name, plot_downsampling=None):
+    """
+    This function returns the downsampling (method, maximum number of points) of the time series plot of a feature:
+    the one of the feature in 'plot_downsampling' (or in constants.PLOT_DOWNSAMPLING if it is None), looked up by the
+    name of the feature and then by the name without the runner suffix (like 'Spread' for 'Spread_1'), or
+    constants.PLOT_DOWNSAMPLING_DEFAULT.
+
+    Args:
+        feature_name (str): The name of the feature.
+        plot_downsampling (dict or None): The downsampling of the features.
+
+    Returns:
+        tuple: The downsampling method and the maximum number of points.
+    """
+    if plot_downsampling is None:
+        plot_downsampling = constants.PLOT_DOWNSAMPLING
+
+    if feature_name in plot_downsampling:
+        return plot_downsampling[feature_name]
+
+    return plot_downsampling.get(feature_name.rsplit("_", 1)[0], constants.PLOT_DOWNSAMPLING_DEFAULT)
+
+
+
+def plot_dict_features_from_price_file(dict_features, inplay_idx, plot_path, features=None, plot_downsampling=None):
     """
     This code block is used to generate a set of line plots and distribution plots for each feature in a given DataFrame.
     Each feature is both plotted as a time series and as a distribution. The point at which in-play begins is indicated with
     a vertical line in the line plot. The plots are saved to the specified path.
+    The plots are drawn on a single figure that is reused for all the features (it isn't managed by pyplot, so the
+    function works with any backend and also in the processes of a PlotQueue).
+    The long series are downsampled before being plotted (see get_plot_downsampling and the downsampling module):
+    the kept points are plotted at their original indexes, so the in-play marker stays aligned.
 
     Args:
         df_features (pandas.DataFrame): A DataFrame where each column is a feature to be plotted.
         inplay_idx (int): Index to represent the start of in-play in the line plot.
         plot_path (str): The path where the plots will be saved.
+        features (list or None): If not None, only these features are plotted.
+        plot_downsampling (dict or None): The downsampling of the features (see get_plot_downsampling).
 
     """
-    plt.rcParams["figure.figsize"] = (10,5)
+    fig = Figure(figsize=(10,5))
+    ax = fig.add_subplot()
+
     for feature_name, feature in dict_features.items():
+        if features is not None and feature_name not in features:
+            continue
+        ax.clear()
+
+        method, n_points = get_plot_downsampling(feature_name, plot_downsampling)
+        ## The points around the in-play marker are always kept (the in-play diff times start from the in-play)
+        keep = (inplay_idx-1, inplay_idx) if inplay_idx!=None and feature_name!="In-play diff time" else ()
+        idx = downsampling.downsample_indexes(feature, method=method, n_points=n_points, keep=keep)
+
         ## LINE PLOT
         # print(feature_name)
         if feature_name=="Publish time":
-            plt.plot(feature, range(len(feature)), label=feature_name)
+            ## the publish times are epoch milliseconds, converted to datetimes only here
+            ax.plot(np.asarray(feature, dtype='datetime64[ms]')[idx], idx, label=feature_name)
             if inplay_idx!=None:
-                plt.axhline(y = inplay_idx, color = 'r', label = 'in-play')
+                ax.axhline(y = inplay_idx, color = 'r', label = 'in-play')
         else:
-            plt.plot(feature, label=feature_name)
+            ax.plot(idx, np.asarray(feature, dtype=float)[idx], label=feature_name)
 
             if feature_name!="In-play diff time":
                 if inplay_idx!=None:
-                    plt.axvline(x = inplay_idx, color = 'r', label = 'in-play')
+                    ax.axvline(x = inplay_idx, color = 'r', label = 'in-play')
 
         if "Mid price" in feature_name:
-            plt.ylim(0, 15)
+            ax.set_ylim(0, 15)
         if "Matched" in feature_name:
-            plt.ylim(0, 20000)
+            ax.set_ylim(0, 20000)
         if "Last traded price" in feature_name:
-            plt.ylim(0, 20)
+            ax.set_ylim(0, 20)
 
-        plt.legend()
+        ax.legend()
         if "time" in feature_name and (feature_name!="Publish time"):
-            plt.title(f"{feature_name} (seconds)")
+            ax.set_title(f"{feature_name} (seconds)")
         else:
-            plt.title(feature_name)
+            ax.set_title(feature_name)
 
-        plt.xlabel("# Orders arrived")
-        plt.savefig(os.path.join(plot_path, feature_name))
-        plt.close()
+        ax.set_xlabel("# Orders arrived")
+        fig.savefig(os.path.join(plot_path, feature_name))
 
         ## DISTRIBUTION PLOT
         ## Note: This was commented out due to too much time to calculate
@@ -68,23 +115,132 @@ def plot_dict_features_from_price_file(dict_features, inplay_idx, plot_path):
 
 
 
-def plot_correlation_matrix(df_features, plot_path):
+def plot_correlation_matrix(df_features, plot_path, correlation_matrices=None):
     """
     This function plots the correlation matrix of the input DataFrame's features and saves the plot to a specified path.
+    The correlation matrices (Pearson, Kendall and Spearman) are calculated together by the correlation module,
+    unless they are passed already calculated.
 
     Args:
         df_features (pandas.DataFrame): A DataFrame whose features' correlation matrix is to be plotted.
         plot_path (str): The path where the plot will be saved.
-    """
-    corr_methods = ['pearson', 'kendall', 'spearman']
+        correlation_matrices (dict or None): The correlation matrices already calculated (a dictionary with the
+        methods as keys, like the result of correlation.calculate_correlation_matrices). If None they are calculated
+        from 'df_features'.
 
-    for method in corr_methods:
-        correlation_matrix = df_features.corr(method=method)
+    Returns:
+        dict: The correlation matrices, with the methods as keys.
+    """
+    if correlation_matrices is None:
+        correlation_matrices = correlation.calculate_correlation_matrices(df_features=df_features)
+
+    fig = Figure(figsize=(12, 9))
+    for method, correlation_matrix in correlation_matrices.items():
+        ## the figure is reused, but it is cleared because the heatmap adds the axes of the colorbar
+        fig.clear()
+        ax = fig.add_subplot()
         mask = np.triu(correlation_matrix)
-        f, ax = plt.subplots(figsize=(12, 9))
-        sns.heatmap(correlation_matrix, square=False, annot=True, mask=mask)
-        plt.savefig(os.path.join(plot_path, f"corr_matrix_{method}"))
-        plt.close()
+        sns.heatmap(correlation_matrix, square=False, annot=True, mask=mask, ax=ax)
+        fig.savefig(os.path.join(plot_path, f"corr_matrix_{method}"))
+
+    return correlation_matrices
+
+
+
+def render_price_file_plots(dict_features, inplay_idx, plot_path, correlation_matrices=None, features=None,
+                            plot_downsampling=None):
+    """
+    This function renders all the plots of a price file from its already calculated features: the line plot of each
+    feature (see plot_dict_features_from_price_file) and the correlation matrices (see plot_correlation_matrix).
+    It is the job executed by a PlotQueue.
+
+    Args:
+        dict_features (dict): The features of the price file to plot (lists or arrays).
+        inplay_idx (int or None): Index of the first in-play market book.
+        plot_path (str): The path of the directory where the plots will be saved.
+        correlation_matrices (dict or None): The correlation matrices to plot (they aren't plotted if None).
+        features (list or None): If not None, only these features (and the correlation matrices) are plotted.
+        plot_downsampling (dict or None): The downsampling of the features (see get_plot_downsampling).
+    """
+    plot_dict_features_from_price_file(dict_features=dict_features,
+                                       inplay_idx=inplay_idx,
+                                       plot_path=plot_path,
+                                       features=features,
+                                       plot_downsampling=plot_downsampling)
+
+    if correlation_matrices is not None:
+        plot_correlation_matrix(df_features=None,
+                                plot_path=plot_path,
+                                correlation_matrices=correlation_matrices)
+
+
+
+def _init_plot_process():
+    matplotlib.use("Agg")
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+
+
+
+class PlotQueue:
+    """
+    This class is a queue of plots to render, separated from the analysis of the price files: the analysis submits
+    the already calculated features of each price file and the plots are rendered by a pool of processes (with the
+    non-interactive "Agg" backend), so the analysis doesn't wait for the rendering and the encoding of the images.
+    If 'workers' is None or 0 the plots are rendered immediately in the current process, when they are submitted.
+    At most 'max_pending' price files are waiting to be rendered at the same time (submit waits for the oldest one
+    when there are more), so the features waiting to be plotted don't fill the memory.
+
+    Example:
+        with PlotQueue(workers=2) as plot_queue:
+            for ...:
+                plot_queue.submit(dict_features=dict_features, inplay_idx=inplay_idx, plot_path=plot_path)
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = workers
+        self.max_pending = max_pending if max_pending is not None else 2 * (workers or 1)
+        self._executor = (ProcessPoolExecutor(max_workers=workers, initializer=_init_plot_process)
+                          if workers else None)
+        self._pending = deque()
+
+
+    def submit(self, dict_features, inplay_idx, plot_path, correlation_matrices=None, features=None,
+               plot_downsampling=None):
+        """
+        Adds the plots of a price file to the queue (see render_price_file_plots for the arguments).
+        """
+        if self._executor is None:
+            render_price_file_plots(dict_features, inplay_idx, plot_path, correlation_matrices, features,
+                                    plot_downsampling)
+            return
+
+        while len(self._pending)>=self.max_pending:
+            self._pending.popleft().result()
+        self._pending.append(self._executor.submit(render_price_file_plots, dict_features, inplay_idx, plot_path,
+                                                   correlation_matrices, features, plot_downsampling))
+
+
+    def close(self, wait=True):
+        """
+        Waits until all the plots in the queue have been rendered (the errors of the rendering are raised here). If
+        'wait' is False the plots that haven't started rendering yet are cancelled.
+        """
+        try:
+            while wait and self._pending:
+                self._pending.popleft().result()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(wait=exc_type is None)
+
 
 
 def plot_distr_volume_traded(dict_volume_traded, path_plot, binwidth):
@@ -139,15 +295,142 @@ def load_dict_from_pickle_and_plot_distr(path_pickle_file, path_plot):
     plt.close()
 
 
+def get_volume_sketch_file_name(name_pickle_file):
+    """
+    This function returns the name of the file of the quantile sketch of the volumes saved in a pickle file (like
+    'tot_volume_traded_dict_sketch.pkl' for 'tot_volume_traded_dict.pkl'), saved alongside it in the results
+    directory (see create_volume_statistics).
+
+    Args:
+        name_pickle_file (str): The name of the pickle file of the volumes.
+
+    Returns:
+        str: The name of the file of the sketch.
+    """
+    return name_pickle_file.split(".pkl")[0] + "_sketch.pkl"
+
+
+
+def create_volume_statistics(dict_volume_traded):
+    """
+    This function calculates the streaming statistics (count, mean, minimum, maximum and quantile sketch, see
+    online_statistics.StreamingStatistics) of the volumes of a results directory, like the ones saved in the
+    'tot_volume_traded_dict.pkl' and 'pre_event_volume_traded.pkl' files. The statistics of many results directories
+    can be merged, so the distribution of the volumes of years of markets is calculated without loading every value.
+
+    Args:
+        dict_volume_traded (dict): Dictionary with keys being file names and values being the volume traded in the
+        corresponding file (the None values are excluded).
+
+    Returns:
+        online_statistics.StreamingStatistics: The statistics of the volumes.
+    """
+    volume_statistics = online_statistics.StreamingStatistics()
+    volume_statistics.update([v for v in dict_volume_traded.values() if v!=None])
+
+    return volume_statistics
+
+
+
+def load_all_volume_statistics(results_dir, name_pickle_file):
+    """
+    This function recursively searches through a directory and its subdirectories for 'name_pickle_file'
+    files and merges the statistics of their volumes: the quantile sketch saved alongside each pickle file (see
+    get_volume_sketch_file_name), or, for the results directories saved before the sketches, the statistics
+    calculated from the pickle file itself.
+
+    Args:
+        results_dir (str): The root directory containing the pickle files.
+        name_pickle_file (str): The name of the pickle files of the volumes.
+
+    Returns:
+        online_statistics.StreamingStatistics: The merged statistics of the volumes.
+    """
+    name_sketch_file = get_volume_sketch_file_name(name_pickle_file)
+    volume_statistics = online_statistics.StreamingStatistics()
+    for root, _, files in alive_it(list(os.walk(results_dir))):
+        if name_sketch_file in files:
+            with open(os.path.join(root, name_sketch_file), 'rb') as f:
+                volume_statistics.merge(pickle.load(f))
+        elif name_pickle_file in files:
+            with open(os.path.join(root, name_pickle_file), 'rb') as f:
+                volume_statistics.merge(create_volume_statistics(pickle.load(f)))
+
+    return volume_statistics
+
+
+
+def plot_volume_statistics(volume_statistics, path_plot, binwidth=1000, limit_volume=None):
+    """
+    This function prints and plots the distribution of the volumes of the markets (see create_volume_statistics) with
+    their mean, median and 95th percentile. The histogram and the quantiles are approximated from the quantile
+    sketch of the volumes (they are exact as long as the sketch hasn't been compacted, see
+    online_statistics.KLLSketch) and the mean is exact (unless 'limit_volume' is set).
+
+    Args:
+        volume_statistics (online_statistics.StreamingStatistics): The statistics of the volumes.
+        path_plot (str): Path of the distribution plot.
+        binwidth (int): The size of the bins for the histogram.
+        limit_volume (float or None): Represent the volume above which values are excluded from the plot (no limit
+        if None).
+    """
+    if limit_volume!=None:
+        sketch = volume_statistics.sketch.truncate(limit_volume)
+        mean_value = sketch.mean()
+    else:
+        sketch = volume_statistics.sketch
+        mean_value = volume_statistics.mean
+    if sketch.n==0:
+        print("No volumes found")
+        return
+    value_95_perc = sketch.quantile(0.95)
+    median_value = sketch.quantile(0.5)
+
+    max_value = volume_statistics.max if limit_volume==None else min(volume_statistics.max, limit_volume)
+    bins = _get_volume_bins(volume_statistics.min, max_value, binwidth)
+    _print_and_plot_volume_distribution(counts=sketch.histogram(bins), bins=bins, mean_value=mean_value,
+                                        median_value=median_value, value_95_perc=value_95_perc, path_plot=path_plot)
+
+
+
+def _get_volume_bins(min_value, max_value, binwidth):
+    ## the last bin contains the maximum value, also when all the values are the same
+    min_bin = np.floor(min_value / binwidth) * binwidth
+
+    return min_bin + binwidth * np.arange(int((max_value - min_bin) // binwidth) + 2)
+
+
+
+def _print_and_plot_volume_distribution(counts, bins, mean_value, median_value, value_95_perc, path_plot):
+    print(f"Mean: {mean_value}")
+    print(f"Median: {median_value}")
+    print(f"95th percentile: {value_95_perc}")
+
+    fig = Figure(figsize=(6, 5))
+    ax = fig.add_subplot()
+    ax.stairs(counts, bins, fill=True, alpha=0.6)
+    ax.axvline(value_95_perc, color='red', label="95th percentile")
+    ax.axvline(mean_value, color='blue', label="Mean")
+    ax.axvline(median_value, color='green', label="Median")
+    ax.set_ylabel("Count")
+    ax.legend()
+    fig.savefig(path_plot)
+
+
+
 def load_and_plot_all_volume_pickle_files(results_dir, name_pickle_file, path_plot, binwidth=1000, limit_volume=None):
     """
     This function recursively searches through a directory and its subdirectories for 'name_pickle_file'
-    files. For each 'name_pickle_file' file, it loads the contents using pickle and extends the contents
-    to a list, excluding any None values. The resulting list of total volumes is returned.
+    files and merges the quantile sketches of their volumes (see load_all_volume_statistics), then it prints and
+    plots the distribution of the volumes with their mean, median and 95th percentile.
 
     The pickle files with that name are the files saved by the function 'analyse_and_plot_price_files' when
     analysing price files. This pickle files contain a dictionary where the keys are the price files' names and
     the values are the value of the feature 'Total volume traded' or of the feature 'Pre-event volume traded'.
+    The quantile sketch of the volumes is saved alongside each of them, so the values are never loaded and sorted
+    all together: the histogram and the quantiles are approximated from the merged sketch (they are exact as long
+    as the sketch hasn't been compacted, see online_statistics.KLLSketch) and the mean is exact (unless
+    'limit_volume' is set).
 
     The purpose of this function is to collect all the different values of one of those two feature and plot their
     distribution.
@@ -156,70 +439,68 @@ def load_and_plot_all_volume_pickle_files(results_dir, name_pickle_file, path_pl
         results_dir (str): The root directory containing the pickle files.
         name_pickle_file (str): The name of the pickle files to load.
         path_plot (str): Path where to save the distribution plot.
+        binwidth (int): The size of the bins for the histogram.
         limit_volume (float or None): Represent the volume above which values are excluded from the plot. it has
         the purpose of making the plot useful (when very high values are included the plot is useless). Set it
         to None if no you want no limit.
 
     Returns:
-        list: A list of total volumes obtained from all 'tot_volume_traded_dict.pkl' files in the given directory
-        and its subdirectories.
+        online_statistics.StreamingStatistics: The merged statistics of the volumes obtained from all the
+        'name_pickle_file' files in the given directory and its subdirectories (without the limit).
 
     Example:
 
         results_dir = 'path/to/your/results/directory'
         name_pickle_file = 'tot_volume_traded_dict.pkl'
-        total_volumes = load_and_plot_all_tot_volume_dicts(results_dir, name_pickle_file)
+        volume_statistics = load_and_plot_all_volume_pickle_files(results_dir, name_pickle_file, results_dir)
+        print(volume_statistics.quantile(0.99))
 
     """
-    list_tot_volumes = []
-    for root, _, files in alive_it(list(os.walk(results_dir))):
-        for file_name in files:
-            if file_name==name_pickle_file:
-                with open(os.path.join(root, file_name), 'rb') as f:
-                    tot_volume_traded_dict = pickle.load(f)
-                if limit_volume!=None:
-                    list_tot_volumes.extend(
-                        [v for v in tot_volume_traded_dict.values()
-                        if v!=None and
-                        #v>0 and
-                        v<limit_volume]
-                    )
-                else:
-                    list_tot_volumes.extend(
-                        [v for v in tot_volume_traded_dict.values()
-                        if v!=None]
-                    )
-
-    sorted_list = sorted(list_tot_volumes)
-    idx_95_perc = int(len(list_tot_volumes)*0.95)
-    value_95_perc = sorted_list[idx_95_perc]
-    mean_value = np.mean(list_tot_volumes)
-    median_value = np.median(list_tot_volumes)
-
-    print(f"Mean: {mean_value}")
-    print(f"Median: {median_value}")
-    print(f"95th percentile: {value_95_perc}")
-
-    name_plot = name_pickle_file.split(".pkl")[0] + "_total"
-
-    sns.displot(list_tot_volumes,
-                binwidth=binwidth,
-                kde=True,
-                )
-    plt.axvline(value_95_perc, color='red', label="95th percentile")
-    plt.axvline(np.mean(list_tot_volumes), color='blue', label="Mean")
-    plt.axvline(np.median(list_tot_volumes), color='green', label="Median")
-    plt.legend()
-    plt.savefig(os.path.join(path_plot, name_plot))
-    plt.close()
-
-    return list_tot_volumes
-
-
+    volume_statistics = load_all_volume_statistics(results_dir=results_dir, name_pickle_file=name_pickle_file)
+    plot_volume_statistics(volume_statistics=volume_statistics,
+                           path_plot=os.path.join(path_plot, name_pickle_file.split(".pkl")[0] + "_total"),
+                           binwidth=binwidth,
+                           limit_volume=limit_volume)
 
+    return volume_statistics
 
 
 
+def load_and_plot_volume_from_results_store(store_dir, column, path_plot, binwidth=1000, limit_volume=None):
+    """
+    This function plots the distribution of a feature of all the markets in the results store (see the
+    results_store module), like 'Total volume traded' or 'Pre-event volume', with its mean, median and 95th
+    percentile. It is the equivalent of load_and_plot_all_volume_pickle_files, but the values are read from a single
+    column of the store instead of loading all the pickle files of a results directory.
+    The column is read entirely, so the statistics and the histogram are exact (calculated with numpy on the column).
 
+    Args:
+        store_dir (str): The directory of the results store.
+        column (str): The name of the feature (column of the store).
+        path_plot (str): Path of the directory where to save the distribution plot.
+        binwidth (int): The size of the bins for the histogram.
+        limit_volume (float or None): Represent the volume above which values are excluded from the plot (no limit
+        if None).
 
+    Returns:
+        numpy.ndarray: The values of the feature in the store (below 'limit_volume', without the missing ones).
 
+    Example:
+        store_dir = 'path/to/your/results_store'
+        total_volumes = load_and_plot_volume_from_results_store(store_dir, 'Total volume traded', './results')
+    """
+    volumes = results_store.get_results_store_column(store_dir=store_dir, column=column).astype(float)
+    volumes = volumes[~np.isnan(volumes)]
+    if limit_volume!=None:
+        volumes = volumes[volumes<limit_volume]
+    if len(volumes)==0:
+        print("No volumes found")
+        return volumes
+
+    bins = _get_volume_bins(volumes.min(), volumes.max(), binwidth)
+    counts, _ = np.histogram(volumes, bins=bins)
+    _print_and_plot_volume_distribution(counts=counts, bins=bins, mean_value=np.mean(volumes),
+                                        median_value=np.median(volumes), value_95_perc=np.percentile(volumes, 95),
+                                        path_plot=os.path.join(path_plot, column.lower().replace(" ", "_") + "_total"))
+
+    return volumes
@@ -3,33 +3,113 @@ This module contains functions necessary to process and parse the Betfair price
 """
 
 import bz2
+import hashlib
 import json
 import os
+import shutil
+import tempfile
+from collections import deque
 from datetime import datetime
 from typing import Dict, List
 
 import betfairutil
+import numpy as np
 import pandas as pd
 
+from src import constants, order_book, order_book_engine, price_file_reader
 from utils import pricefileutils
 
+## The last pre-event market books of the single pass built from the market books, saved in the cache too
+PRE_EVENT_MARKET_BOOKS = ('last_pre_event_market_book', 'last_not_suspended_pre_event_market_book')
 
-def apply_function_for_mb_on_entire_price_file(price_file_path, function_for_mb, parameters=[]):
+
+def apply_function_for_mb_on_entire_price_file(price_file_path, function_for_mb, parameters=[], lazy=False):
     """
     This function applies a specified function to each MarketBook object in a Betfair price file.
+    The market books are streamed from the price file, so only one of them is held in memory at a time.
+
+    Args:
+        price_file_path (str): Path to the Betfair price file.
+        function_for_mb (function): Function to be applied to each MarketBook object in the price file.
+                                    The function should take a single non-optional argument, which is a MarketBook object.
+        parameters (list): contains the additional parameters needed to call function_for_mb.
+        lazy (bool): If True, a generator that yields the results one at the time is returned instead of a list
+                     (see iterate_function_for_mb_on_entire_price_file).
+
+    Returns:
+        list: Returns a list of the results of applying function_for_mb to each MarketBook object in the price file
+        (or a generator of the results if lazy is True).
+    """
+    results = iterate_function_for_mb_on_entire_price_file(price_file_path=price_file_path,
+                                                           function_for_mb=function_for_mb,
+                                                           parameters=parameters)
+    if lazy:
+        return results
+
+    return list(results)
+
+
+
+def iterate_function_for_mb_on_entire_price_file(price_file_path, function_for_mb, parameters=[]):
+    """
+    This function lazily applies a specified function to each MarketBook object in a Betfair price file: the market
+    books are read from the price file one at the time (with price_file_reader.create_market_book_generator)
+    and the result for each one of them is yielded as soon as it is calculated. The memory used is therefore bounded
+    by one market book, regardless of the length of the price file.
+
+    Args:
+        price_file_path (str): Path to the Betfair price file.
+        function_for_mb (function): Function to be applied to each MarketBook object in the price file.
+                                    The function should take a single non-optional argument, which is a MarketBook object.
+        parameters (list): contains the additional parameters needed to call function_for_mb.
+
+    Yields:
+        The result of applying function_for_mb to each MarketBook object in the price file.
+
+    Example:
+        for total_matched in iterate_function_for_mb_on_entire_price_file('path/to/your/file.bz2',
+                                                                          betfairutil.calculate_total_matched):
+            print(total_matched)
+    """
+    g = price_file_reader.create_market_book_generator(price_file_path)
+    for mb in g:
+        yield function_for_mb(mb, *parameters)
+
+
+
+def reduce_function_for_mb_on_entire_price_file(price_file_path, function_for_mb, reduce_function, initial_value,
+                                                parameters=[]):
+    """
+    This function applies a specified function to each MarketBook object in a Betfair price file and incrementally
+    reduces the results into a single value, without keeping either the market books or the results in memory.
 
     Args:
         price_file_path (str): Path to the Betfair price file.
         function_for_mb (function): Function to be applied to each MarketBook object in the price file.
                                     The function should take a single non-optional argument, which is a MarketBook object.
+        reduce_function (function): Function that takes the value accumulated so far and the result for the next
+                                    market book, and returns the new accumulated value.
+        initial_value: The initial accumulated value.
         parameters (list): contains the additional parameters needed to call function_for_mb.
 
     Returns:
-        list: Returns a list of the results of applying function_for_mb to each MarketBook object in the price file.
+        The accumulated value after the last market book of the price file.
+
+    Example:
+        max_available_volume = reduce_function_for_mb_on_entire_price_file(
+            price_file_path='path/to/your/file.bz2',
+            function_for_mb=betfairutil.calculate_available_volume,
+            reduce_function=max,
+            initial_value=0,
+            parameters=[betfairutil.Side.BACK, 1000])
     """
-    market_books = betfairutil.read_prices_file(price_file_path)
+    accumulated_value = initial_value
+    for result in iterate_function_for_mb_on_entire_price_file(price_file_path=price_file_path,
+                                                                function_for_mb=function_for_mb,
+                                                                parameters=parameters):
+        accumulated_value = reduce_function(accumulated_value, result)
 
-    return [function_for_mb(mb, *parameters) for mb in market_books]
+    return accumulated_value
 
 
 
@@ -37,6 +117,8 @@ def apply_function_for_runner_on_entire_price_file(price_file_path, function_for
     """
     This function applies a specified function to each RunnerBook object within each MarketBook
     in a Betfair price file.
+    The runners are identified by their selection IDs (taken from the market definition of the first market book),
+    so the results are still produced when the runner names get changed during the match.
 
     Args:
         price_file_path (str): Path to the Betfair price file.
@@ -46,34 +128,502 @@ def apply_function_for_runner_on_entire_price_file(price_file_path, function_for
 
     Returns:
         list: Returns a list of the results of applying function_for_runner to each RunnerBook object in each MarketBook
-        in  the given price file.
+        in  the given price file (one list for each runner, in the order of the selection IDs in the first
+        market definition).
     """
-    market_books = betfairutil.read_prices_file(price_file_path)
-
-    all_runners_names = set(tuple(list_runners) for list_runners in
-            [[runner['name'] for runner in mb['marketDefinition']['runners']]
-             for mb in market_books])
-
-    if len(all_runners_names)==1:
-        runners = list(list(all_runners_names)[0])
-        result = [
-            [
-                function_for_runner(pricefileutils.get_runner_book_from_market_book(mb, runner_name=runner),
-                                    *parameters)
-                for mb in market_books
-            ]
-            for runner in runners
-        ]
-
-        return result
-
-    ### This is case is when the runner name get changed during the match
+    runner_index = pricefileutils.RunnerIndex()
+    selection_ids = None
+    result = []
+
+    g = price_file_reader.create_market_book_generator(price_file_path)
+    for mb in g:
+        if selection_ids is None:
+            selection_ids = [runner['id'] for runner in mb['marketDefinition']['runners']]
+            result = [[] for _ in selection_ids]
+
+        for runner_idx, selection_id in enumerate(selection_ids):
+            result[runner_idx].append(function_for_runner(runner_index.get_runner_book(mb, selection_id=selection_id),
+                                                          *parameters))
+
+    return result
+
+
+
+def extract_features_in_single_pass(price_file_path, funs_for_mb, funs_for_runners, parameters_for_functions={},
+                                    deque_len=8, build_order_book=True):
+    """
+    This function reads the market books of a Betfair price file only once and, while streaming them, applies every
+    function for MarketBook objects and every function for RunnerBook objects to each market book. During the same
+    pass it also detects the first in-play market book and keeps the few market books needed to calculate the
+    features of the entire price file (like the total volume traded or the pre-event volume), so that the file
+    doesn't have to be decompressed and parsed again.
+
+    Args:
+        price_file_path (str): Path to the Betfair price file.
+        funs_for_mb (dict): Dictionary with feature names as keys and functions to be applied to each MarketBook
+                            object as values (like constants.FUNS_FOR_MB).
+        funs_for_runners (dict): Dictionary with feature names as keys and functions to be applied to each
+                                 RunnerBook object as values (like constants.FUNS_FOR_RUNNERS).
+        parameters_for_functions (dict): contains the additional parameters needed to call the functions, with the
+                                         feature names as keys (like constants.PARAMETERS_FOR_FUNCTIONS).
+        deque_len (int): number of final market books kept in memory to calculate the total volume traded (see
+                         betfairutil.get_total_volume_traded_from_prices_file).
+        build_order_book (bool): If True, the columnar order book of the price file (see the order_book module) is
+                                 built during the same pass, so that the vectorized features can be calculated on it.
+
+    Returns:
+        dict: A dictionary containing:
+            - 'first_market_book': the first market book of the price file.
+            - 'first_market_definition': the market definition of the first market book.
+            - 'last_pre_event_market_book': the last market book before the market turned in play (None if the
+              market never turned in play).
+            - 'last_not_suspended_pre_event_market_book': the last market book before the market turned in play
+              where the market isn't SUSPENDED (the one at 'last_pre_event_idx' of 'market_index').
+            - 'last_market_books': a deque with the last 'deque_len' market books of the price file.
+            - 'inplay_idx': the index of the first in-play market book (None if the market never turned in play).
+            - 'market_index': the index of the in-play transition, the changes of status and the suspension windows
+              of the market (see order_book.get_market_phase_index), None if build_order_book is False.
+            - 'features_for_mb': a dictionary with the results of the functions in funs_for_mb (a list for each
+              feature).
+            - 'features_for_runners': a dictionary with the results of the functions in funs_for_runners (a list of
+              lists for each feature, one list for each runner, in the order of the selection IDs in the first
+              market definition).
+            - 'runners_names_changed': True if the runner names get changed during the match (the runners are
+              identified by their selection IDs, so their features are calculated anyway).
+            - 'order_book': the columnar order book of the price file (None if build_order_book is False).
+
+    Example:
+        single_pass = extract_features_in_single_pass(price_file_path='path/to/your/file.bz2',
+                                                      funs_for_mb=constants.FUNS_FOR_MB,
+                                                      funs_for_runners=constants.FUNS_FOR_RUNNERS,
+                                                      parameters_for_functions=constants.PARAMETERS_FOR_FUNCTIONS)
+    """
+    first_market_book = None
+    last_pre_event_market_book = None
+    last_not_suspended_pre_event_market_book = None
+    last_market_books = deque(maxlen=deque_len)
+    inplay_idx = None
+    selection_ids = None
+    runners_names = None
+    runners_names_changed = False
+    market_definition = None
+
+    features_for_mb = {name: [] for name in funs_for_mb}
+    features_for_runners = {}
+    runner_index = pricefileutils.RunnerIndex()
+    builder = order_book.OrderBookBuilder() if build_order_book else None
+
+    g = price_file_reader.create_market_book_generator(price_file_path)
+    for idx, mb in enumerate(g):
+        if first_market_book is None:
+            first_market_book = mb
+            selection_ids = [runner['id'] for runner in mb['marketDefinition']['runners']]
+            runners_names = tuple(runner['name'] for runner in mb['marketDefinition']['runners'])
+            features_for_runners = {name: [[] for _ in selection_ids] for name in funs_for_runners}
+
+        ### The runner names can only change with a new market definition, so they are checked only then
+        if mb['marketDefinition'] is not market_definition:
+            market_definition = mb['marketDefinition']
+            if not runners_names_changed:
+                runners_names_changed = tuple(runner['name'] for runner in market_definition['runners'])!=runners_names
+
+        if inplay_idx is None:
+            if mb['inplay']:
+                inplay_idx = idx
+            else:
+                last_pre_event_market_book = mb
+                if mb['status']!='SUSPENDED':
+                    last_not_suspended_pre_event_market_book = mb
+        last_market_books.append(mb)
+
+        if builder is not None:
+            builder.append(mb)
+
+        for name, function in funs_for_mb.items():
+            features_for_mb[name].append(function(mb, *parameters_for_functions.get(name, [])))
+
+        if funs_for_runners:
+            runner_books = [runner_index.get_runner_book(mb, selection_id=selection_id)
+                            for selection_id in selection_ids]
+            for name, function in funs_for_runners.items():
+                parameters = parameters_for_functions.get(name, [])
+                for runner_idx, runner_book in enumerate(runner_books):
+                    features_for_runners[name][runner_idx].append(function(runner_book, *parameters))
+
+    if inplay_idx is None:
+        last_pre_event_market_book = None
+        last_not_suspended_pre_event_market_book = None
+    columns = builder.build() if builder is not None else None
+
+    return {'first_market_book': first_market_book,
+            'first_market_definition': (first_market_book['marketDefinition'] if first_market_book is not None
+                                        else None),
+            'last_pre_event_market_book': last_pre_event_market_book,
+            'last_not_suspended_pre_event_market_book': last_not_suspended_pre_event_market_book,
+            'last_market_books': last_market_books,
+            'inplay_idx': inplay_idx,
+            'features_for_mb': features_for_mb,
+            'features_for_runners': features_for_runners,
+            'market_index': order_book.get_market_phase_index(columns) if columns is not None else None,
+            'runners_names_changed': runners_names_changed,
+            'order_book': columns}
+
+
+
+
+
+
+def extract_features_in_single_pass_with_cache(price_file_path, funs_for_mb={}, funs_for_runners={},
+                                               parameters_for_functions={}, cache_dir=None, use_order_book_engine=True,
+                                               ladders=False, pre_event_market_books=False):
+    """
+    This function is a cached version of extract_features_in_single_pass. When only vectorized features are needed
+    (so funs_for_mb and funs_for_runners are empty) the single pass is loaded from the cache of decoded price files,
+    if it is present, and the price file isn't decompressed at all. Otherwise the price file is read and the
+    result is saved in the cache for the next time.
+    When only vectorized features are needed the price file is read by the order book engine (see the
+    order_book_engine module), that builds the columnar order book directly from the deltas of the price file,
+    without creating a market book for every update.
+
+    Args:
+        price_file_path (str): Path to the Betfair price file.
+        funs_for_mb (dict): As in extract_features_in_single_pass.
+        funs_for_runners (dict): As in extract_features_in_single_pass.
+        parameters_for_functions (dict): As in extract_features_in_single_pass.
+        cache_dir (str or None): Directory of the cache (see get_price_file_cache_dir).
+        use_order_book_engine (bool): If False the columnar order book is always built from the market books (see
+        order_book.OrderBookBuilder), with its full ladders.
+        ladders (bool): If True the columnar order book must contain the full ladders of the runners and the index of
+        the entries ('entry_book', 'entry_runner', 'back_prices', ... 'lay_offsets'), that the order book engine
+        doesn't build: the order book is built from the market books, and an entry of the cache built by the engine
+        is replaced.
+        pre_event_market_books (bool): If True the result must contain the last pre-event market books
+        ('last_pre_event_market_book' and 'last_not_suspended_pre_event_market_book'), that are kept only when the
+        single pass is built from the market books: like for the ladders, an entry of the cache built by the engine
+        is replaced.
+
+    Returns:
+        dict: The same dictionary returned by extract_features_in_single_pass. When it is loaded from the cache, or
+        built by the order book engine, it contains only 'first_market_definition', 'inplay_idx', 'market_index',
+        'runners_names_changed' and 'order_book' (whose arrays are memory-mapped when loaded from the cache), and the
+        last pre-event market books if the entry of the cache was built from the market books.
+    """
+    if not funs_for_mb and not funs_for_runners:
+        single_pass = load_single_pass_from_cache(price_file_path=price_file_path, cache_dir=cache_dir)
+        if (single_pass is not None and (not ladders or 'entry_book' in single_pass['order_book'])
+                and (not pre_event_market_books or 'last_pre_event_market_book' in single_pass)):
+            return single_pass
+
+    ### the order book engine reads the raw lines, so it needs a local bz2 price file
+    if (use_order_book_engine and not ladders and not pre_event_market_books and not funs_for_mb and not funs_for_runners
+            and str(price_file_path).endswith(".bz2") and os.path.isfile(price_file_path)):
+        single_pass = order_book_engine.extract_order_book_from_price_file(price_file_path=price_file_path)
     else:
+        single_pass = extract_features_in_single_pass(price_file_path=price_file_path,
+                                                      funs_for_mb=funs_for_mb,
+                                                      funs_for_runners=funs_for_runners,
+                                                      parameters_for_functions=parameters_for_functions)
+    save_single_pass_to_cache(price_file_path=price_file_path, single_pass=single_pass, cache_dir=cache_dir)
+
+    return single_pass
+
+
+
+def get_last_pre_event_market_book_from_price_file(price_file_path, filter_suspended=True, cache_dir=None):
+    """
+    This function returns the last pre-event market book of a Betfair price file, together with the index of the
+    first in-play market book (the number of pre-event market books). Both are recorded by the single pass of the
+    price file (see extract_features_in_single_pass and order_book.get_market_phase_index) and saved in the cache
+    of decoded price files, so the price file is parsed only once, and not at all if it is already in the cache.
+
+    Args:
+        price_file_path (str): Path to the Betfair price file.
+        filter_suspended (bool): If True the pre-event market books where the market status is SUSPENDED are ignored
+        (like in betfairutil.get_last_pre_event_market_book_from_prices_file).
+        cache_dir (str or None): Directory of the cache (see get_price_file_cache_dir).
+
+    Returns:
+        tuple: The last pre-event market book (None if there isn't one) and the index of the first in-play market
+        book, or (None, None) if the market never turned in play.
+
+    Example:
+        pre_event_market_book, inplay_idx = get_last_pre_event_market_book_from_price_file('path/to/your/file.bz2')
+    """
+    single_pass = extract_features_in_single_pass_with_cache(price_file_path=price_file_path, cache_dir=cache_dir,
+                                                             pre_event_market_books=True)
+    inplay_idx = single_pass['market_index']['inplay_idx']
+    if inplay_idx is None:
+        return None, None
+
+    if filter_suspended:
+        return single_pass['last_not_suspended_pre_event_market_book'], inplay_idx
+
+    return single_pass['last_pre_event_market_book'], inplay_idx
+
+
+
+def get_price_file_cache_dir(cache_dir=None):
+    """
+    This function returns the directory of the cache of decoded price files. If cache_dir is None the directory is
+    read from the PRICE_FILE_CACHE_DIRECTORY environment variable (it can be set in the .env file, like
+    DATA_DIRECTORY). If neither is set the cache is disabled and None is returned.
+
+    Args:
+        cache_dir (str or None): Directory of the cache.
+
+    Returns:
+        str or None: The directory of the cache, or None if the cache is disabled.
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get("PRICE_FILE_CACHE_DIRECTORY")
+
+    return cache_dir
+
+
+
+def _get_cache_entry_dir(cache_dir, price_file_path):
+    key = hashlib.sha1(os.path.realpath(price_file_path).encode()).hexdigest()
+
+    return os.path.join(cache_dir, key)
+
+
+
+def load_single_pass_from_cache(price_file_path, cache_dir=None):
+    """
+    This function loads the single pass of a price file (see extract_features_in_single_pass) from the cache of
+    decoded price files. The columnar order book is memory-mapped, so only the columns that are used are
+    actually read from disk.
+    The entry of the cache is valid only if the size and the modification time of the price file are the same of
+    when the entry was saved, otherwise it is removed.
+
+    Args:
+        price_file_path (str): Path to the Betfair price file.
+        cache_dir (str or None): Directory of the cache (see get_price_file_cache_dir).
+
+    Returns:
+        dict or None: The single pass of the price file, or None if it isn't in the cache (or the cache is disabled).
+    """
+    cache_dir = get_price_file_cache_dir(cache_dir)
+    if cache_dir is None:
+        return None
+
+    entry_dir = _get_cache_entry_dir(cache_dir, price_file_path)
+    meta_path = os.path.join(entry_dir, 'meta.json')
+    try:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    stat = os.stat(price_file_path)
+    if meta['size']!=stat.st_size or meta['mtime_ns']!=stat.st_mtime_ns:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return None
+
+    columns = {}
+    for name in meta['columns']:
+        column_path = os.path.join(entry_dir, f"{name}.npy")
+        try:
+            columns[name] = np.load(column_path, mmap_mode='r')
+        ### empty arrays can't be memory-mapped
+        except ValueError:
+            columns[name] = np.load(column_path)
+
+    ### the modification time of meta.json records the last access, for the LRU eviction
+    os.utime(meta_path)
+
+    ### the index of the phases of the market is built from the (small) status and in-play columns
+    single_pass = {'first_market_definition': meta['first_market_definition'],
+                   'inplay_idx': meta['inplay_idx'],
+                   'market_index': order_book.get_market_phase_index(columns),
+                   'runners_names_changed': meta['runners_names_changed'],
+                   'order_book': columns}
+    ### (only the entries built from the market books have the last pre-event market books)
+    for name in PRE_EVENT_MARKET_BOOKS:
+        if name in meta:
+            single_pass[name] = meta[name]
+
+    return single_pass
+
+
+
+def save_single_pass_to_cache(price_file_path, single_pass, cache_dir=None,
+                              max_cache_size=constants.PRICE_FILE_CACHE_MAX_SIZE):
+    """
+    This function saves the single pass of a price file (see extract_features_in_single_pass) in the cache of decoded
+    price files: each column of the columnar order book is saved in a .npy file (so that it can be memory-mapped) and
+    the rest in a 'meta.json' file, together with the size and the modification time of the price file.
+    If the size of the cache exceeds max_cache_size the least recently used entries are removed.
+
+    Args:
+        price_file_path (str): Path to the Betfair price file.
+        single_pass (dict): The single pass of the price file (it must contain the columnar order book).
+        cache_dir (str or None): Directory of the cache (see get_price_file_cache_dir).
+        max_cache_size (int): Maximum size of the cache in bytes.
+    """
+    cache_dir = get_price_file_cache_dir(cache_dir)
+    if cache_dir is None or single_pass['order_book'] is None:
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    stat = os.stat(price_file_path)
+    entry_dir = _get_cache_entry_dir(cache_dir, price_file_path)
+
+    ### the entry is written in a temporary directory and then renamed, so that processes analysing price files in
+    ### parallel never see an incomplete entry
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp_')
+    nbytes = 0
+    for name, column in single_pass['order_book'].items():
+        column_path = os.path.join(tmp_dir, f"{name}.npy")
+        np.save(column_path, column)
+        nbytes += os.path.getsize(column_path)
+
+    meta = {'path': os.path.realpath(price_file_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'nbytes': nbytes,
+            'columns': list(single_pass['order_book']),
+            'first_market_definition': single_pass['first_market_definition'],
+            'inplay_idx': single_pass['inplay_idx'],
+            'runners_names_changed': single_pass['runners_names_changed']}
+    for name in PRE_EVENT_MARKET_BOOKS:
+        if name in single_pass:
+            meta[name] = single_pass[name]
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    evict_price_file_cache(cache_dir=cache_dir, max_cache_size=max_cache_size)
+
+
+
+def _get_resampled_cache_paths(entry_dir, interval_ms):
+    name = f"bars_{interval_ms}ms"
+
+    return os.path.join(entry_dir, f"{name}.json"), os.path.join(entry_dir, f"{name}.npz")
+
+
+
+def load_resampled_features_from_cache(price_file_path, interval_ms, cache_dir=None):
+    """
+    This function loads the features of a price file resampled into bars (see resampling.resample_features) from the
+    cache of decoded price files. Like the single pass, the resampled features are valid only if the size and the
+    modification time of the price file are the same of when they were saved.
+
+    Args:
+        price_file_path (str): Path to the Betfair price file.
+        interval_ms (int): The interval of the bars in milliseconds.
+        cache_dir (str or None): Directory of the cache (see get_price_file_cache_dir).
+
+    Returns:
+        tuple or None: The resampled features and the index of the in-play bar, or None if they aren't in the cache
+        (or the cache is disabled).
+    """
+    cache_dir = get_price_file_cache_dir(cache_dir)
+    if cache_dir is None:
+        return None
+
+    meta_path, arrays_path = _get_resampled_cache_paths(_get_cache_entry_dir(cache_dir, price_file_path), interval_ms)
+    try:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        stat = os.stat(price_file_path)
+        if meta['size']!=stat.st_size or meta['mtime_ns']!=stat.st_mtime_ns:
+            return None
+        with np.load(arrays_path) as arrays:
+            dict_bars = {feature_name: arrays[feature_name] if feature_name in arrays else meta['values'][feature_name]
+                         for feature_name in meta['features']}
+    except (OSError, ValueError, KeyError):
         return None
 
+    return dict_bars, meta['inplay_idx']
+
 
 
+def save_resampled_features_to_cache(price_file_path, interval_ms, dict_bars, bars_inplay_idx, cache_dir=None):
+    """
+    This function saves the features of a price file resampled into bars in the entry of the price file in the cache
+    of decoded price files (the arrays in a .npz file and the single values in a .json file), so they are removed
+    together with the entry. Nothing is saved if the price file has no entry in the cache.
+
+    Args:
+        price_file_path (str): Path to the Betfair price file.
+        interval_ms (int): The interval of the bars in milliseconds.
+        dict_bars (dict): The resampled features (see resampling.resample_features).
+        bars_inplay_idx (int or None): The index of the in-play bar.
+        cache_dir (str or None): Directory of the cache (see get_price_file_cache_dir).
+    """
+    cache_dir = get_price_file_cache_dir(cache_dir)
+    if cache_dir is None:
+        return
+
+    entry_dir = _get_cache_entry_dir(cache_dir, price_file_path)
+    if not os.path.isdir(entry_dir):
+        return
+
+    stat = os.stat(price_file_path)
+    meta_path, arrays_path = _get_resampled_cache_paths(entry_dir, interval_ms)
+    arrays = {feature_name: feature for feature_name, feature in dict_bars.items()
+              if isinstance(feature, np.ndarray)}
+    meta = {'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'inplay_idx': bars_inplay_idx,
+            'features': list(dict_bars),
+            'values': {feature_name: feature.item() if isinstance(feature, np.generic) else feature
+                       for feature_name, feature in dict_bars.items() if feature_name not in arrays}}
+
+    ### the files are written with temporary names and then renamed (the .json file last, because it makes the
+    ### resampled features visible)
+    try:
+        with tempfile.NamedTemporaryFile(dir=entry_dir, prefix='.tmp_', suffix='.npz', delete=False) as f:
+            np.savez(f, **arrays)
+        os.replace(f.name, arrays_path)
+        with tempfile.NamedTemporaryFile('w', dir=entry_dir, prefix='.tmp_', suffix='.json', delete=False) as f:
+            json.dump(meta, f)
+        os.replace(f.name, meta_path)
+    ### the entry has been removed in the meantime
+    except OSError:
+        return
+
+
+
+def _get_entry_nbytes(entry_dir, meta):
+    ### the size of the single pass plus the size of the resampled features
+    return meta['nbytes'] + sum(os.path.getsize(os.path.join(entry_dir, file_name))
+                                for file_name in os.listdir(entry_dir) if file_name.startswith('bars_'))
+
+
+
+def evict_price_file_cache(cache_dir, max_cache_size=constants.PRICE_FILE_CACHE_MAX_SIZE):
+    """
+    This function removes the least recently used entries of the cache of decoded price files until the size of the
+    cache is lower than max_cache_size.
 
+    Args:
+        cache_dir (str): Directory of the cache.
+        max_cache_size (int): Maximum size of the cache in bytes.
+    """
+    entries = []
+    for key in os.listdir(cache_dir):
+        meta_path = os.path.join(cache_dir, key, 'meta.json')
+        try:
+            with open(meta_path, 'r') as f:
+                nbytes = _get_entry_nbytes(os.path.join(cache_dir, key), json.load(f))
+            entries.append((os.path.getmtime(meta_path), nbytes, os.path.join(cache_dir, key)))
+        except (OSError, ValueError, KeyError):
+            continue
+
+    cache_size = sum(nbytes for _, nbytes, _ in entries)
+    for _, nbytes, entry_dir in sorted(entries):
+        if cache_size<=max_cache_size:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        cache_size -= nbytes
 
 
 
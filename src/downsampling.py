@@ -0,0 +1,134 @@
+"""
+This module contains the functions to downsample the time series of the features before plotting them, so that the
+plots of the in-play markets (that can have hundreds of thousands of market books) don't draw more points than the
+pixels of the image.
+
+The functions return the indexes of the points to keep (and not the values), so the series are plotted against their
+original indexes and the in-play marker (drawn at 'inplay_idx') stays aligned. Two methods are available:
+    - 'min_max': the series is divided in buckets and the minimum and the maximum of each bucket are kept (the
+      spikes are always preserved).
+    - 'lttb': largest-triangle-three-buckets, that keeps one point per bucket choosing the one that forms the largest
+      triangle with the point kept in the previous bucket and the average of the next bucket (it preserves the visual
+      shape of the series).
+"""
+
+import numpy as np
+
+DOWNSAMPLING_METHODS = ('min_max', 'lttb')
+
+
+def downsample_min_max(values, n_points):
+    """
+    This function selects the minimum and the maximum of each bucket of the series (n_points // 2 buckets of equal
+    size).
+
+    Args:
+        values (numpy.ndarray): The values of the series.
+        n_points (int): The maximum number of points to keep.
+
+    Returns:
+        numpy.ndarray: The sorted indexes of the points to keep.
+    """
+    n = len(values)
+    n_buckets = max(n_points // 2, 1)
+    bucket_size = -(-n // n_buckets)
+    n_buckets = -(-n // bucket_size)
+
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:n] = values
+    padded = padded.reshape(n_buckets, bucket_size)
+
+    ## The missing values are never selected (unless the whole bucket is missing)
+    offsets = np.arange(n_buckets) * bucket_size
+    idx_min = offsets + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1)
+    idx_max = offsets + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1)
+
+    return np.unique(np.concatenate([idx_min, idx_max]).clip(max=n-1))
+
+
+
+def downsample_lttb(values, n_points):
+    """
+    This function selects the points of the series with the largest-triangle-three-buckets algorithm: the first and
+    the last points are always kept and one point is kept for each of the n_points - 2 buckets in between.
+
+    Args:
+        values (numpy.ndarray): The values of the series.
+        n_points (int): The maximum number of points to keep (at least 3).
+
+    Returns:
+        numpy.ndarray: The sorted indexes of the points to keep.
+    """
+    n = len(values)
+    n_points = max(n_points, 3)
+    ## The missing values are replaced by the previous value, so they don't break the areas of the triangles
+    filled = values.copy()
+    missing = np.isnan(filled)
+    if missing.any():
+        last_valid = np.where(~missing, np.arange(n), 0)
+        np.maximum.accumulate(last_valid, out=last_valid)
+        filled = filled[last_valid]
+        filled[np.isnan(filled)] = 0.0
+
+    edges = np.linspace(1, n-1, n_points-1).astype(np.int64)
+    selected = np.empty(n_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for bucket in range(n_points-2):
+        start, end = edges[bucket], edges[bucket+1]
+        if end<=start:
+            selected[bucket+1] = start
+            continue
+        next_start, next_end = edges[bucket+1], (edges[bucket+2] if bucket+2<len(edges) else n)
+        next_x = (next_start + next_end - 1) / 2
+        next_y = filled[next_start:next_end].mean() if next_end>next_start else filled[-1]
+
+        x = np.arange(start, end)
+        areas = np.abs((previous - next_x) * (filled[start:end] - filled[previous])
+                       - (previous - x) * (next_y - filled[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket+1] = previous
+
+    return np.unique(selected)
+
+
+
+def downsample_indexes(values, method, n_points, keep=()):
+    """
+    This function returns the indexes of the points of a series to plot, downsampled with the given method.
+
+    Args:
+        values (list or numpy.ndarray): The values of the series.
+        method (str or None): 'min_max', 'lttb' or None (no downsampling).
+        n_points (int or None): The maximum number of points to keep (no downsampling if None or if the series is
+        shorter).
+        keep (tuple): Indexes that are always kept (like the index of the first in-play market book, so that the
+        series is exact around the in-play marker). The indexes out of the series are ignored.
+
+    Returns:
+        numpy.ndarray: The sorted indexes of the points to plot.
+
+    Example:
+        idx = downsample_indexes(feature, method='min_max', n_points=2000, keep=(inplay_idx-1, inplay_idx))
+        plt.plot(idx, np.asarray(feature)[idx])
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+
+    if method is None or n_points is None or n<=n_points:
+        return np.arange(n)
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError(f"Unknown downsampling method '{method}', it must be one of {DOWNSAMPLING_METHODS}")
+
+    if method=='min_max':
+        idx = downsample_min_max(values, n_points)
+    else:
+        idx = downsample_lttb(values, n_points)
+
+    keep = [k for k in keep if k is not None and 0<=k<n]
+    if keep:
+        idx = np.union1d(idx, keep)
+
+    return idx
@@ -0,0 +1,208 @@
+"""
+This module contains the functions to make the analysis of many price files (see
+data_analysis.analyse_and_plot_multiple_price_files) resumable.
+
+When a run is resumable, a job manifest is saved in the results directory, with the list of the price files to
+analyse, and the result of each price file is saved in a checkpoint as soon as it is analysed. If the run is
+interrupted (for example by a crash after hours of analysis), the next run with the same results directory loads the
+results of the price files that have a checkpoint and analyses only the remaining ones. When all the price files
+have been analysed the manifest is marked as complete.
+The manifest also stores the size and the modification time of each price file, so an incremental run (see
+update_job_manifest) can analyse only the price files that have been added or changed since the last run.
+"""
+
+import json
+import os
+import pickle
+
+from src import constants
+
+
+def _write_atomically(path, data):
+    ## the file is written next to the final one and then renamed, so it's never left half written
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+
+def get_job_manifest_path(results_dir):
+    return os.path.join(results_dir, constants.JOB_MANIFEST_FILE_NAME)
+
+
+
+def load_job_manifest(results_dir):
+    """
+    This function loads the job manifest of a results directory.
+
+    Args:
+        results_dir (str): The results directory.
+
+    Returns:
+        dict or None: The manifest (with the keys 'data_path', 'files' and 'complete', where 'files' is a list of
+        dictionaries with the keys 'path', 'file_name', 'size' and 'mtime_ns'), or None if the results directory
+        doesn't have a manifest.
+    """
+    manifest_path = get_job_manifest_path(results_dir)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+
+def save_job_manifest(results_dir, manifest):
+    """
+    This function saves the job manifest of a results directory (atomically, so an interrupted run never leaves a
+    corrupted manifest).
+
+    Args:
+        results_dir (str): The results directory.
+        manifest (dict): The manifest (see load_job_manifest).
+    """
+    _write_atomically(get_job_manifest_path(results_dir), json.dumps(manifest, indent=1).encode())
+
+
+
+def create_job_manifest(data_path, price_files):
+    """
+    This function creates the job manifest of the analysis of a list of price files.
+
+    Args:
+        data_path (str or None): The directory of the price files.
+        price_files (list): The paths of the price files, in the order in which they are analysed.
+
+    Returns:
+        dict: The manifest (see load_job_manifest).
+    """
+    files = []
+    for price_file in price_files:
+        stat = os.stat(price_file)
+        files.append({'path': price_file,
+                      'file_name': os.path.basename(price_file),
+                      'size': stat.st_size,
+                      'mtime_ns': stat.st_mtime_ns})
+
+    return {'data_path': data_path, 'files': files, 'complete': False}
+
+
+
+def update_job_manifest(results_dir, manifest, data_path, price_files):
+    """
+    This function updates the job manifest of a results directory with the price files that are currently in the
+    data directory (for the incremental analysis): the price files that are new, or whose size or modification time
+    have changed since they were analysed, lose their checkpoint (so they are analysed again), and the price files
+    that don't exist anymore are removed from the manifest together with their checkpoints.
+
+    Args:
+        results_dir (str): The results directory.
+        manifest (dict): The current manifest (see load_job_manifest).
+        data_path (str or None): The directory of the price files.
+        price_files (list): The paths of the price files currently in the data directory.
+
+    Returns:
+        tuple: The updated manifest (not complete, if any price file has to be analysed or has been removed) and
+        the list of the paths of the price files that have to be analysed again or for the first time.
+    """
+    new_manifest = create_job_manifest(data_path=data_path, price_files=price_files)
+    old_files = {file['path']: file for file in manifest['files']}
+
+    changed_files = []
+    for file in new_manifest['files']:
+        old_file = old_files.pop(file['path'], None)
+        if old_file is None or (old_file['size'], old_file['mtime_ns'])!=(file['size'], file['mtime_ns']):
+            changed_files.append(file['path'])
+            remove_price_file_checkpoint(results_dir, file['file_name'])
+
+    ## the price files left are the ones that have been removed from the data directory
+    for old_file in old_files.values():
+        remove_price_file_checkpoint(results_dir, old_file['file_name'])
+
+    new_manifest['complete'] = manifest['complete'] and not changed_files and not old_files
+
+    return new_manifest, changed_files
+
+
+
+def is_job_complete(results_dir):
+    """
+    This function checks if the analysis saved in a results directory has been completed: the manifest is marked as
+    complete, or (for the results directories created before the job manifests) the directory has no manifest but
+    contains the aggregate results.
+
+    Args:
+        results_dir (str): The results directory.
+
+    Returns:
+        bool: True if the analysis has been completed.
+    """
+    manifest = load_job_manifest(results_dir)
+    if manifest is None:
+        return os.path.exists(os.path.join(results_dir, constants.PICKLE_FILE_NAME_AGGREGATE_STATS))
+
+    return manifest['complete']
+
+
+
+def _get_checkpoint_path(results_dir, file_name):
+    return os.path.join(results_dir, constants.CHECKPOINTS_DIR_NAME, file_name.split(".bz2")[0] + ".pkl")
+
+
+
+def save_price_file_checkpoint(results_dir, file_name, dict_result):
+    """
+    This function saves the checkpoint of a price file: its result without the time series of the features (only
+    the features that are single values are kept, and the resampled features are dropped), so the checkpoints stay
+    small.
+
+    Args:
+        results_dir (str): The results directory.
+        file_name (str): The name of the price file.
+        dict_result (dict): The result of the price file (see data_analysis.analyse_and_plot_single_price_file).
+    """
+    checkpoint_path = _get_checkpoint_path(results_dir, file_name)
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+
+    checkpoint = dict(dict_result)
+    checkpoint['dict_features'] = {feature_name: feature
+                                   for feature_name, feature in dict_result['dict_features'].items()
+                                   if not hasattr(feature, '__len__') or isinstance(feature, str)}
+    if checkpoint.get('dict_bars') is not None:
+        checkpoint['dict_bars'] = None
+    _write_atomically(checkpoint_path, pickle.dumps(checkpoint))
+
+
+
+def load_price_file_checkpoint(results_dir, file_name):
+    """
+    This function loads the checkpoint of a price file (see save_price_file_checkpoint).
+
+    Args:
+        results_dir (str): The results directory.
+        file_name (str): The name of the price file.
+
+    Returns:
+        dict or None: The checkpointed result of the price file, or None if the price file has no checkpoint.
+    """
+    checkpoint_path = _get_checkpoint_path(results_dir, file_name)
+    if not os.path.exists(checkpoint_path):
+        return None
+
+    with open(checkpoint_path, 'rb') as f:
+        return pickle.load(f)
+
+
+
+def remove_price_file_checkpoint(results_dir, file_name):
+    """
+    This function removes the checkpoint of a price file (if it exists).
+
+    Args:
+        results_dir (str): The results directory.
+        file_name (str): The name of the price file.
+    """
+    checkpoint_path = _get_checkpoint_path(results_dir, file_name)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
@@ -0,0 +1,267 @@
+"""
+This module contains the functions to build and query a catalogue of the Betfair price files of a data directory.
+
+The catalogue is a SQLite database with one row per price file, containing the metadata of the market (market ID,
+event ID, event name, market type and name, open date, runners), the number of market books, the index of the first
+in-play market book and the size of the file. It is updated incrementally (only the price files that are new or that
+have changed since the last update are read), so the analyses can select the price files they need (for example all
+the Match Odds markets of Djokovic in January) with a query, without walking the data directory and opening every
+price file.
+"""
+
+import bz2
+import json
+import os
+import sqlite3
+
+from alive_progress import alive_it
+from betfairlightweight.compat import json as fast_json
+
+CATALOGUE_TABLE = 'markets'
+
+CATALOGUE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {CATALOGUE_TABLE} (
+    path TEXT PRIMARY KEY,
+    file_size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    market_id TEXT,
+    event_id TEXT,
+    event_name TEXT,
+    market_type TEXT,
+    market_name TEXT,
+    open_date TEXT,
+    runner_ids TEXT,
+    runner_names TEXT,
+    n_market_books INTEGER,
+    inplay_idx INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_{CATALOGUE_TABLE}_event_id ON {CATALOGUE_TABLE} (event_id);
+CREATE INDEX IF NOT EXISTS idx_{CATALOGUE_TABLE}_open_date ON {CATALOGUE_TABLE} (open_date);
+CREATE INDEX IF NOT EXISTS idx_{CATALOGUE_TABLE}_market_type ON {CATALOGUE_TABLE} (market_type);
+"""
+
+
+def connect_market_catalogue(catalogue_path):
+    """
+    This function opens the SQLite database of the catalogue (it is created, together with its table, in case it
+    doesn't exist).
+
+    Args:
+        catalogue_path (str): The path of the SQLite file of the catalogue.
+
+    Returns:
+        sqlite3.Connection: The connection to the catalogue (the rows are returned as sqlite3.Row objects).
+    """
+    connection = sqlite3.connect(catalogue_path)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(CATALOGUE_SCHEMA)
+
+    return connection
+
+
+
+def scan_price_file(price_file_path):
+    """
+    This function reads the metadata of a price file for the catalogue. The lines of the price file are decompressed
+    but only the ones that contain a market definition are parsed (each line of a price file is one market book, so
+    the index of the first in-play market book is the index of the first line with an in-play market definition).
+
+    Args:
+        price_file_path (str): Path to the Betfair price file.
+
+    Returns:
+        dict: A dictionary with the columns of the catalogue (except 'path', 'file_size' and 'mtime_ns'). The
+        'runner_ids' and 'runner_names' are JSON lists and 'inplay_idx' is None if the market never goes in-play.
+
+    Example:
+        row = scan_price_file('path/to/your/data/1.208791811.bz2')
+    """
+    row = {'market_id': None, 'event_id': None, 'event_name': None, 'market_type': None, 'market_name': None,
+           'open_date': None, 'runner_ids': None, 'runner_names': None, 'n_market_books': 0, 'inplay_idx': None}
+
+    with bz2.open(price_file_path, 'rb') as f:
+        for line in f:
+            if b'"mc"' not in line:
+                continue
+
+            if b'"marketDefinition"' in line and (row['market_id'] is None or row['inplay_idx'] is None):
+                for market_change in fast_json.loads(line)['mc']:
+                    market_definition = market_change.get('marketDefinition')
+                    if market_definition is None:
+                        continue
+                    if row['market_id'] is None:
+                        row.update({'market_id': market_change['id'],
+                                    'event_id': market_definition.get('eventId'),
+                                    'event_name': market_definition.get('eventName'),
+                                    'market_type': market_definition.get('marketType'),
+                                    'market_name': market_definition.get('name'),
+                                    'open_date': market_definition.get('openDate'),
+                                    'runner_ids': json.dumps([runner['id'] for runner in
+                                                              market_definition['runners']]),
+                                    'runner_names': json.dumps([runner.get('name') for runner in
+                                                                market_definition['runners']])})
+                    if row['inplay_idx'] is None and market_definition.get('inPlay'):
+                        row['inplay_idx'] = row['n_market_books']
+
+            row['n_market_books'] += 1
+
+    return row
+
+
+
+def update_market_catalogue(data_path, catalogue_path):
+    """
+    This function updates the catalogue with the price files found in a directory (and its subdirectories).
+    Only the price files that aren't in the catalogue, or whose size or modification time have changed since they
+    were catalogued, are read. The rows of the price files under 'data_path' that don't exist anymore are removed.
+
+    Args:
+        data_path (str): The path of the directory containing the price files.
+        catalogue_path (str): The path of the SQLite file of the catalogue (it is created in case it doesn't exist).
+
+    Returns:
+        int: The number of price files that have been (re)catalogued.
+
+    Example:
+        data_path = 'path/to/your/data'
+        catalogue_path = 'path/to/your/market_catalogue.sqlite'
+        update_market_catalogue(data_path, catalogue_path)
+    """
+    connection = connect_market_catalogue(catalogue_path)
+    data_path = os.path.realpath(data_path)
+
+    catalogued = {row['path']: (row['file_size'], row['mtime_ns'])
+                  for row in connection.execute(f"SELECT path, file_size, mtime_ns FROM {CATALOGUE_TABLE}")}
+
+    list_file_paths = []
+    found = set()
+    for root, _, files in os.walk(data_path):
+        for file_name in files:
+            if ".bz2" in file_name:
+                file_path = os.path.join(root, file_name)
+                stat = os.stat(file_path)
+                found.add(file_path)
+                if catalogued.get(file_path)!=(stat.st_size, stat.st_mtime_ns):
+                    list_file_paths.append((file_path, stat))
+
+    n_updated = 0
+    try:
+        for file_path, stat in alive_it(list_file_paths):
+            row = scan_price_file(file_path)
+            row.update({'path': file_path, 'file_size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+            connection.execute(f"INSERT OR REPLACE INTO {CATALOGUE_TABLE} ({', '.join(row)}) "
+                               f"VALUES ({', '.join(':' + column for column in row)})", row)
+            n_updated += 1
+
+            ## The catalogue is committed regularly, so an interrupted update doesn't lose all the work done
+            if n_updated%100==0:
+                connection.commit()
+
+        removed = [(path,) for path in catalogued
+                   if path not in found and path.startswith(os.path.join(data_path, ''))]
+        connection.executemany(f"DELETE FROM {CATALOGUE_TABLE} WHERE path = ?", removed)
+        connection.commit()
+    finally:
+        connection.close()
+
+    return n_updated
+
+
+
+def query_market_catalogue(catalogue_path, data_path=None, market_type=None, market_name=None, event_name=None,
+                           event_id=None, start_date=None, end_date=None, inplay=None):
+    """
+    This function selects the price files of the catalogue that satisfy all the given filters (the filters that are
+    None are ignored).
+
+    Args:
+        catalogue_path (str): The path of the SQLite file of the catalogue.
+        data_path (str or None): Only the price files in this directory (or its subdirectories) are selected.
+        market_type (str or None): The market type, like 'MATCH_ODDS'.
+        market_name (str or None): The market name, like 'Match Odds'.
+        event_name (str or None): A substring of the event name (case insensitive), like 'Djokovic'.
+        event_id (str or None): The event ID.
+        start_date (str or None): The minimum open date of the market, in ISO format (like '2023-01-01').
+        end_date (str or None): The maximum open date of the market, in ISO format (a date like '2023-01-31'
+        includes the whole day).
+        inplay (bool or None): If True only the markets that go in-play are selected, if False only the ones that
+        don't.
+
+    Returns:
+        list: The rows of the selected price files, as dictionaries ordered by path. The 'runner_ids' and
+        'runner_names' columns are decoded into lists.
+
+    Example:
+        rows = query_market_catalogue('path/to/your/market_catalogue.sqlite',
+                                      market_type='MATCH_ODDS',
+                                      event_name='Djokovic',
+                                      start_date='2023-01-01',
+                                      end_date='2023-01-31')
+    """
+    conditions = []
+    parameters = []
+
+    if data_path is not None:
+        conditions.append("path LIKE ? ESCAPE '\\'")
+        prefix = os.path.join(os.path.realpath(data_path), '')
+        parameters.append(prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    if market_type is not None:
+        conditions.append("market_type = ?")
+        parameters.append(market_type)
+    if market_name is not None:
+        conditions.append("market_name = ?")
+        parameters.append(market_name)
+    if event_name is not None:
+        conditions.append("event_name LIKE ?")
+        parameters.append(f"%{event_name}%")
+    if event_id is not None:
+        conditions.append("event_id = ?")
+        parameters.append(str(event_id))
+    if start_date is not None:
+        conditions.append("open_date >= ?")
+        parameters.append(start_date)
+    if end_date is not None:
+        ## The open dates are ISO timestamps, so a date without time includes the whole day
+        conditions.append("open_date <= ?")
+        parameters.append(end_date + ('T99' if len(end_date)==10 else ''))
+    if inplay is not None:
+        conditions.append("inplay_idx IS NOT NULL" if inplay else "inplay_idx IS NULL")
+
+    query = f"SELECT * FROM {CATALOGUE_TABLE}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY path"
+
+    connection = connect_market_catalogue(catalogue_path)
+    try:
+        rows = [dict(row) for row in connection.execute(query, parameters)]
+    finally:
+        connection.close()
+
+    for row in rows:
+        row['runner_ids'] = json.loads(row['runner_ids']) if row['runner_ids'] is not None else None
+        row['runner_names'] = json.loads(row['runner_names']) if row['runner_names'] is not None else None
+
+    return rows
+
+
+
+def get_price_files_from_market_catalogue(catalogue_path, **filters):
+    """
+    This function returns the paths of the price files of the catalogue that satisfy the given filters (see
+    query_market_catalogue). The result can be passed as the 'price_files' argument of the functions of the
+    data_analysis module, so that only the selected price files are analysed.
+
+    Args:
+        catalogue_path (str): The path of the SQLite file of the catalogue.
+        **filters: The filters of query_market_catalogue.
+
+    Returns:
+        list: The paths of the selected price files.
+
+    Example:
+        price_files = get_price_files_from_market_catalogue('path/to/your/market_catalogue.sqlite',
+                                                            market_type='MATCH_ODDS',
+                                                            event_name='Djokovic')
+    """
+    return [row['path'] for row in query_market_catalogue(catalogue_path, **filters)]
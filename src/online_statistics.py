@@ -0,0 +1,482 @@
+"""
+This module contains the streaming (online) statistics used to aggregate the results of many price files without
+keeping the results of every price file in memory. The aggregators can be updated one price file at the time and
+merged together, so the price files can also be analysed by parallel workers and their aggregators merged at the end.
+"""
+
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from src import constants
+
+
+class MeanCorrelationAggregator:
+    """
+    This class calculates the mean of many correlation matrices (one for each price file) in O(features^2) memory,
+    keeping only a running sum and a count for each pair of features. The matrices are aligned by feature name, so
+    price files with different (or differently ordered) features can be aggregated together: the mean of each pair is
+    calculated only on the matrices that contain both the features, and the NaN values are ignored (like np.nanmean).
+
+    Example:
+        aggregator = MeanCorrelationAggregator()
+        for df_features in list_df_features:
+            aggregator.update(df_features.corr())
+        mean_matrix = aggregator.mean()
+    """
+
+    def __init__(self):
+        self.features = []
+        self._feature_idx = {}
+        self._sum = np.zeros((0, 0))
+        self._count = np.zeros((0, 0), dtype=np.int64)
+        self.n_matrices = 0
+
+
+    def _get_indexes(self, features):
+        new_features = [feature for feature in features if feature not in self._feature_idx]
+        if new_features:
+            for feature in new_features:
+                self._feature_idx[feature] = len(self.features)
+                self.features.append(feature)
+            n = len(self.features)
+            old_n = self._sum.shape[0]
+            self._sum = np.pad(self._sum, ((0, n-old_n), (0, n-old_n)))
+            self._count = np.pad(self._count, ((0, n-old_n), (0, n-old_n)))
+
+        return np.array([self._feature_idx[feature] for feature in features], dtype=np.intp)
+
+
+    def update(self, corr_matrix):
+        """
+        Adds a correlation matrix to the aggregator.
+
+        Args:
+            corr_matrix (pandas.DataFrame): A correlation matrix with the names of the features as index and columns
+            (like the result of DataFrame.corr()).
+        """
+        features = list(corr_matrix.columns)
+        values = corr_matrix.loc[features, features].to_numpy(dtype=float)
+        idx = self._get_indexes(features)
+        valid = ~np.isnan(values)
+
+        self._sum[np.ix_(idx, idx)] += np.where(valid, values, 0.0)
+        self._count[np.ix_(idx, idx)] += valid
+        self.n_matrices += 1
+
+
+    def merge(self, other):
+        """
+        Adds the matrices aggregated by another aggregator (for example the one of a parallel worker) to this
+        aggregator.
+
+        Args:
+            other (MeanCorrelationAggregator): The aggregator to merge.
+
+        Returns:
+            MeanCorrelationAggregator: This aggregator.
+        """
+        idx = self._get_indexes(other.features)
+
+        self._sum[np.ix_(idx, idx)] += other._sum
+        self._count[np.ix_(idx, idx)] += other._count
+        self.n_matrices += other.n_matrices
+
+        return self
+
+
+    def mean(self):
+        """
+        Returns:
+            pandas.DataFrame: The mean correlation matrix, with the features in the order in which they have been
+            first seen (NaN for the pairs of features that never had a valid correlation).
+        """
+        mean_matrix = np.where(self._count>0, self._sum / np.maximum(self._count, 1), np.nan)
+
+        return pd.DataFrame(mean_matrix, index=list(self.features), columns=list(self.features))
+
+
+
+class KLLSketch:
+    """
+    This class is a KLL quantile sketch (Karnin, Lang and Liberty, "Optimal Quantile Approximation in Streams"): it
+    keeps a small sample of the values in a hierarchy of compactors, where each value of the level h represents 2^h
+    values of the stream, so any quantile can be approximated in O(k) memory, however many values are added. When a
+    level is full its values are sorted and one every two (starting from a random offset) is promoted to the next
+    level. The sketches can be merged (level by level), so they can be calculated for each price file, or each day,
+    and combined. While no level has been compacted yet the sketch contains all the values and the quantiles are
+    exact (with the same linear interpolation of numpy.quantile and pandas.DataFrame.describe).
+
+    Args:
+        k (int): The size of the biggest compactor, it sets the accuracy (the rank error is roughly 1.7 / k).
+        seed (int or None): The seed of the random offsets of the compactions. If None the seed is derived from
+        constants.QUANTILE_SKETCH_SEED and from the values of the first compaction, so the same values always give
+        the same sketch, while the sketches of different values (that are merged together) have independent
+        offsets.
+
+    Example:
+        sketch = KLLSketch()
+        for volumes in list_volumes:
+            sketch.update(volumes)
+        percentile_95 = sketch.quantile(0.95)
+    """
+
+    def __init__(self, k=constants.QUANTILE_SKETCH_K, seed=None):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self.seed = seed
+        ## created at the first compaction (see _get_rng)
+        self._rng = None
+
+
+    def _get_rng(self):
+        if self._rng is None:
+            seed = self.seed
+            if seed is None:
+                seed = [constants.QUANTILE_SKETCH_SEED, zlib.crc32(np.sort(self.levels[0]).tobytes())]
+            self._rng = np.random.default_rng(seed)
+
+        return self._rng
+
+
+    def _capacity(self, level):
+        ## the capacities decrease geometrically from the top level down
+        return max(2, int(np.ceil(self.k * (2 / 3)**(len(self.levels) - 1 - level))))
+
+
+    def _compress(self):
+        level = 0
+        while level<len(self.levels):
+            if len(self.levels[level])>=self._capacity(level):
+                if level + 1==len(self.levels):
+                    self.levels.append(np.empty(0))
+                values = np.sort(self.levels[level])
+                ## with an odd number of values the last one stays in the level
+                n_promoted = len(values) - len(values) % 2
+                offset = self._get_rng().integers(2)
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], values[offset:n_promoted:2]])
+                self.levels[level] = values[n_promoted:]
+                ## the capacities change when a level is added, so the levels are checked again from the bottom
+                level = 0
+                continue
+            level += 1
+
+
+    def update(self, values):
+        """
+        Adds values to the sketch (the missing values are ignored).
+
+        Args:
+            values (numpy.ndarray or list): The values.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values)==0:
+            return
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += len(values)
+        self._compress()
+
+
+    def merge(self, other):
+        """
+        Adds the values of another sketch to this sketch.
+
+        Args:
+            other (KLLSketch): The sketch to merge.
+
+        Returns:
+            KLLSketch: This sketch.
+        """
+        for level, values in enumerate(other.levels):
+            if level==len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], values])
+        self.n += other.n
+        self._compress()
+
+        return self
+
+
+    def _get_weighted_values(self):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_values), 2.0**level)
+                                  for level, level_values in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+
+        return values[order], weights[order]
+
+
+    def quantile(self, q):
+        """
+        Approximates one or more quantiles of the values.
+
+        Args:
+            q (float or numpy.ndarray): The quantile, or an array of quantiles, between 0 and 1.
+
+        Returns:
+            float or numpy.ndarray: The approximated quantiles (NaN if the sketch is empty).
+        """
+        if self.n==0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        if len(self.levels)==1:
+            return np.quantile(self.levels[0], q)
+
+        values, weights = self._get_weighted_values()
+        cumulative_weights = np.cumsum(weights)
+        idx = np.searchsorted(cumulative_weights, np.asarray(q) * cumulative_weights[-1], side='left')
+
+        return values[np.clip(idx, 0, len(values) - 1)]
+
+
+    def mean(self):
+        """
+        Approximates the mean of the values (it is exact while no level has been compacted).
+
+        Returns:
+            float: The approximated mean (NaN if the sketch is empty).
+        """
+        if self.n==0:
+            return np.nan
+        values, weights = self._get_weighted_values()
+
+        return float(np.average(values, weights=weights))
+
+
+    def truncate(self, max_value):
+        """
+        Returns a copy of the sketch that contains only the values lower than max_value (for example to exclude the
+        outliers from the quantiles and the histogram).
+
+        Args:
+            max_value (float): The limit of the values.
+
+        Returns:
+            KLLSketch: The truncated sketch.
+        """
+        truncated = KLLSketch(k=self.k)
+        truncated.levels = [level_values[level_values<max_value] for level_values in self.levels]
+        truncated.n = int(sum(len(level_values) * 2**level for level, level_values in enumerate(truncated.levels)))
+
+        return truncated
+
+
+    def histogram(self, bins):
+        """
+        Approximates the histogram of the values.
+
+        Args:
+            bins (numpy.ndarray): The edges of the bins (like in numpy.histogram).
+
+        Returns:
+            numpy.ndarray: The approximated number of values in each bin.
+        """
+        values, weights = self._get_weighted_values()
+        counts, _ = np.histogram(values, bins=bins, weights=weights)
+
+        return counts
+
+
+
+class StreamingStatistics:
+    """
+    This class calculates the statistics of a feature in a single pass over its values, that can be added in batches
+    (for example the values of each price file) and merged with the ones of other instances: the count, the number of
+    missing values, the mean and the variance (with the algorithm of Welford, merging the batches with the formula of
+    Chan et al.), the minimum, the maximum and the quantiles (approximated by a KLLSketch).
+
+    Args:
+        sketch_k (int): The size of the quantile sketch (see KLLSketch).
+
+    Example:
+        statistics = StreamingStatistics()
+        for volumes in list_volumes:
+            statistics.update(volumes)
+        print(statistics.describe())
+    """
+
+    def __init__(self, sketch_k=constants.QUANTILE_SKETCH_K):
+        self.count = 0
+        self.n_missing = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = np.nan
+        self.max = np.nan
+        self.sketch = KLLSketch(k=sketch_k)
+
+
+    def _merge_moments(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self._m2 += m2 + delta**2 * self.count * count / total
+        self.count = total
+
+
+    def update(self, values):
+        """
+        Adds a batch of values.
+
+        Args:
+            values (numpy.ndarray or list): The values (the missing ones are counted separately).
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        missing = np.isnan(values)
+        self.n_missing += int(np.count_nonzero(missing))
+        values = values[~missing]
+        if len(values)==0:
+            return
+
+        batch_mean = values.mean()
+        self._merge_moments(len(values), batch_mean, float(np.sum((values - batch_mean)**2)))
+        self.min = np.fmin(self.min, values.min())
+        self.max = np.fmax(self.max, values.max())
+        self.sketch.update(values)
+
+
+    def merge(self, other):
+        """
+        Adds the values of another instance to this instance.
+
+        Args:
+            other (StreamingStatistics): The statistics to merge.
+
+        Returns:
+            StreamingStatistics: This instance.
+        """
+        self.n_missing += other.n_missing
+        if other.count>0:
+            self._merge_moments(other.count, other.mean, other._m2)
+            self.min = np.fmin(self.min, other.min)
+            self.max = np.fmax(self.max, other.max)
+            self.sketch.merge(other.sketch)
+
+        return self
+
+
+    @property
+    def variance(self):
+        ## the sample variance, like pandas
+        return self._m2 / (self.count - 1) if self.count>1 else np.nan
+
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+
+    def describe(self, percentiles=(0.25, 0.5, 0.75)):
+        """
+        Args:
+            percentiles (tuple): The percentiles to include.
+
+        Returns:
+            pandas.Series: The statistics of the values, with the same index of pandas.Series.describe (count, mean,
+            std, min, percentiles and max).
+        """
+        quantiles = self.quantile(np.asarray(percentiles)) if len(percentiles) else []
+        index = (['count', 'mean', 'std', 'min'] + [f"{percentile * 100:g}%" for percentile in percentiles] +
+                 ['max'])
+        values = ([float(self.count), self.mean if self.count>0 else np.nan, np.sqrt(self.variance), self.min] +
+                  list(quantiles) + [self.max])
+
+        return pd.Series(values, index=index, dtype=float)
+
+
+
+class FeatureStatisticsAggregator:
+    """
+    This class aggregates the StreamingStatistics of many features (aligned by feature name), so that the aggregate
+    statistics and the missing data of the features of one price file, or of all the price files of a day or of a
+    month, are calculated from the aggregators of the single price files, without keeping their values (or their
+    DataFrames) in memory.
+
+    Example:
+        aggregator = FeatureStatisticsAggregator()
+        for dict_result in dict_all_results.values():
+            aggregator.merge(dict_result['feature_statistics'])
+        df_aggregate_stats = aggregator.describe()
+        df_missing_data = aggregator.missing_data()
+    """
+
+    def __init__(self):
+        self.statistics = {}
+        ## the number of missing values and the number of values of the features that are only in the missing data
+        self.missing_counts = {}
+        self.n_updates = 0
+
+
+    def update(self, dict_features, missing_only=()):
+        """
+        Adds the values of the features.
+
+        Args:
+            dict_features (dict): The values of the features (lists or arrays), with the names of the features as
+            keys (a pandas.DataFrame is also accepted).
+            missing_only (list): The names of the features whose missing values are counted, but that aren't
+            described (like the datetime columns in pandas.DataFrame.describe).
+        """
+        for feature_name, values in dict_features.items():
+            if feature_name in missing_only:
+                n_missing, n_values = self.missing_counts.get(feature_name, (0, 0))
+                self.missing_counts[feature_name] = (n_missing + int(pd.isnull(values).sum()), n_values + len(values))
+                continue
+            if feature_name not in self.statistics:
+                self.statistics[feature_name] = StreamingStatistics()
+            self.statistics[feature_name].update(values)
+        self.n_updates += 1
+
+
+    def merge(self, other):
+        """
+        Adds the statistics aggregated by another aggregator to this aggregator.
+
+        Args:
+            other (FeatureStatisticsAggregator): The aggregator to merge.
+
+        Returns:
+            FeatureStatisticsAggregator: This aggregator.
+        """
+        for feature_name, statistics in other.statistics.items():
+            if feature_name not in self.statistics:
+                self.statistics[feature_name] = StreamingStatistics()
+            self.statistics[feature_name].merge(statistics)
+        ## (the aggregators saved before the missing only features don't have them)
+        missing_counts = getattr(self, 'missing_counts', {})
+        for feature_name, (n_missing, n_values) in getattr(other, 'missing_counts', {}).items():
+            previous_n_missing, previous_n_values = missing_counts.get(feature_name, (0, 0))
+            missing_counts[feature_name] = (previous_n_missing + n_missing, previous_n_values + n_values)
+        self.missing_counts = missing_counts
+        self.n_updates += other.n_updates
+
+        return self
+
+
+    def describe(self):
+        """
+        Returns:
+            pandas.DataFrame: The statistics of each feature (in the columns), like pandas.DataFrame.describe.
+        """
+        return pd.DataFrame({feature_name: statistics.describe()
+                             for feature_name, statistics in self.statistics.items()})
+
+
+    def missing_data(self):
+        """
+        Returns:
+            pandas.DataFrame: The count ('Total') and the percentage ('Percent') of missing values of each feature,
+            sorted in descending order of the count, like data_analysis.calculate_missing_data (the features that
+            are only in the missing data included).
+        """
+        missing_counts = {feature_name: (statistics.n_missing, statistics.n_missing + statistics.count)
+                          for feature_name, statistics in self.statistics.items()}
+        missing_counts.update(getattr(self, 'missing_counts', {}))
+        total = pd.Series({feature_name: n_missing for feature_name, (n_missing, _) in missing_counts.items()},
+                          dtype=np.int64)
+        n_values = pd.Series({feature_name: n_values for feature_name, (_, n_values) in missing_counts.items()},
+                             dtype=np.int64)
+        percent = total / n_values
+
+        return pd.concat([total.sort_values(ascending=False), percent.sort_values(ascending=False)], axis=1,
+                         keys=['Total', 'Percent'])
@@ -0,0 +1,428 @@
+"""
+This module contains the columnar representation of the order book of a Betfair price file and the vectorized versions
+of the features calculated on it.
+
+The columnar order book is a dictionary of typed NumPy arrays built once per price file (while its market books are
+streamed by data_processing.extract_features_in_single_pass). The features are then calculated with array operations
+on the entire price file, instead of calling a function for each MarketBook/RunnerBook object.
+
+The columns of the order book are the following (n is the number of market books, r the number of runners and e the
+number of (market book, runner) entries, i.e. the runners present in each market book):
+    - 'publish_time' (int64, n): publish time of each market book in epoch milliseconds.
+    - 'status' (int8, n): status of the market, as an index of MARKET_STATUSES.
+    - 'inplay' (bool, n): in-play flag of each market book.
+    - 'total_matched' (float64, n): total matched on the market (as betfairutil.calculate_total_matched).
+    - 'selection_ids' (int64, r): selection IDs of the runners, in the order of the market definition.
+    - 'runner_status' (int8, n x r): status of each runner in the market definition, as an index of RUNNER_STATUSES
+      (-1 if the runner is not in the market definition).
+    - 'runner_present' (bool, n x r): True if the runner is present in the 'runners' of the market book.
+    - 'last_traded_price' (float64, n x r): last traded price of each runner (NaN if missing).
+    - 'traded_volume' (float64, n x r): volume traded on each runner.
+    - 'best_back_price', 'best_back_size', 'best_lay_price', 'best_lay_size' (float64, n x r): best price and size
+      available on each side of the book (NaN if the side of the book is empty).
+    - 'entry_book', 'entry_runner' (int64, e): market book index and runner index of each entry.
+    - 'back_prices', 'back_sizes', 'lay_prices', 'lay_sizes' (float64): full ladders of all the entries, concatenated
+      in the order of the entries.
+    - 'back_offsets', 'lay_offsets' (int64, e + 1): position in the ladders of the first level of each entry.
+"""
+
+from array import array
+
+import betfairutil
+import numpy as np
+
+MARKET_STATUSES = ['INACTIVE', 'OPEN', 'SUSPENDED', 'CLOSED']
+RUNNER_STATUSES = ['ACTIVE', 'WINNER', 'LOSER', 'PLACED', 'REMOVED_VACANT', 'REMOVED', 'HIDDEN']
+
+BETFAIR_PRICES = np.array(sorted(betfairutil.BETFAIR_PRICE_TO_PRICE_INDEX_MAP), dtype=np.float64)
+
+
+class OrderBookBuilder:
+    """
+    This class accumulates the market books of a price file (one at the time, in chronological order) into
+    compact typed buffers, and converts them into the columnar order book at the end.
+
+    Example:
+        builder = OrderBookBuilder()
+        for market_book in betfairutil.create_market_book_generator_from_prices_file(price_file):
+            builder.append(market_book)
+        columns = builder.build()
+    """
+
+    def __init__(self):
+        self.publish_time = array('q')
+        self.status = array('b')
+        self.inplay = array('b')
+        self.total_matched = array('d')
+
+        self.runner_positions = {}
+        self.market_definition_idx = array('q')
+        self.market_definitions_runner_status = []
+
+        self.entry_book = array('q')
+        self.entry_runner = array('q')
+        self.last_traded_price = array('d')
+        self.traded_volume = array('d')
+        self.back_prices = array('d')
+        self.back_sizes = array('d')
+        self.lay_prices = array('d')
+        self.lay_sizes = array('d')
+        self.back_offsets = array('q', [0])
+        self.lay_offsets = array('q', [0])
+
+        self._market_definition = None
+
+    def _get_runner_position(self, selection_id):
+        position = self.runner_positions.get(selection_id)
+        if position is None:
+            position = len(self.runner_positions)
+            self.runner_positions[selection_id] = position
+
+        return position
+
+    def append(self, market_book):
+        """
+        Append a market book (as a dictionary) to the order book.
+
+        :param market_book: The next market book of the price file
+        """
+        book_idx = len(self.publish_time)
+        self.publish_time.append(market_book['publishTime'])
+        self.status.append(MARKET_STATUSES.index(market_book['status']))
+        self.inplay.append(bool(market_book['inplay']))
+        self.total_matched.append(betfairutil.calculate_total_matched(market_book))
+
+        ### The market definition is shared by the market books until it changes, so the status of the runners is
+        ### re-read only when a new market definition arrives
+        market_definition = market_book.get('marketDefinition', {})
+        if market_definition is not self._market_definition:
+            self._market_definition = market_definition
+            self.market_definitions_runner_status.append({
+                self._get_runner_position(runner['id']): RUNNER_STATUSES.index(runner['status'])
+                for runner in market_definition.get('runners', [])
+            })
+        self.market_definition_idx.append(len(self.market_definitions_runner_status) - 1)
+
+        for runner in market_book.get('runners', []):
+            ex = runner.get('ex', {})
+            self.entry_book.append(book_idx)
+            self.entry_runner.append(self._get_runner_position(runner['selectionId']))
+
+            last_price = runner.get('lastPriceTraded')
+            self.last_traded_price.append(np.nan if last_price is None else last_price)
+            self.traded_volume.append(sum(ps['size'] for ps in ex.get('tradedVolume', [])))
+
+            available_to_back = ex.get('availableToBack', [])
+            self.back_prices.extend([price_size['price'] for price_size in available_to_back])
+            self.back_sizes.extend([price_size['size'] for price_size in available_to_back])
+            available_to_lay = ex.get('availableToLay', [])
+            self.lay_prices.extend([price_size['price'] for price_size in available_to_lay])
+            self.lay_sizes.extend([price_size['size'] for price_size in available_to_lay])
+            self.back_offsets.append(len(self.back_prices))
+            self.lay_offsets.append(len(self.lay_prices))
+
+    def build(self):
+        """
+        Convert the market books appended so far into the columnar order book.
+
+        :return: The columnar order book, as a dictionary of NumPy arrays (see the documentation of the module)
+        """
+        n_books = len(self.publish_time)
+        n_runners = len(self.runner_positions)
+
+        columns = {
+            'publish_time': np.frombuffer(self.publish_time, dtype=np.int64).copy(),
+            'status': np.frombuffer(self.status, dtype=np.int8).copy(),
+            'inplay': np.frombuffer(self.inplay, dtype=np.int8).astype(bool),
+            'total_matched': np.frombuffer(self.total_matched, dtype=np.float64).copy(),
+            'selection_ids': np.array(list(self.runner_positions), dtype=np.int64),
+            'entry_book': np.frombuffer(self.entry_book, dtype=np.int64).copy(),
+            'entry_runner': np.frombuffer(self.entry_runner, dtype=np.int64).copy(),
+            'back_prices': np.frombuffer(self.back_prices, dtype=np.float64).copy(),
+            'back_sizes': np.frombuffer(self.back_sizes, dtype=np.float64).copy(),
+            'lay_prices': np.frombuffer(self.lay_prices, dtype=np.float64).copy(),
+            'lay_sizes': np.frombuffer(self.lay_sizes, dtype=np.float64).copy(),
+            'back_offsets': np.frombuffer(self.back_offsets, dtype=np.int64).copy(),
+            'lay_offsets': np.frombuffer(self.lay_offsets, dtype=np.int64).copy(),
+        }
+
+        ### One row for each market definition, then one row for each market book
+        market_definitions_runner_status = np.full((len(self.market_definitions_runner_status), n_runners), -1,
+                                                   dtype=np.int8)
+        for definition_idx, statuses in enumerate(self.market_definitions_runner_status):
+            for position, status in statuses.items():
+                market_definitions_runner_status[definition_idx, position] = status
+        columns['runner_status'] = market_definitions_runner_status[
+            np.frombuffer(self.market_definition_idx, dtype=np.int64)]
+
+        entry_book = columns['entry_book']
+        entry_runner = columns['entry_runner']
+
+        runner_present = np.zeros((n_books, n_runners), dtype=bool)
+        runner_present[entry_book, entry_runner] = True
+        columns['runner_present'] = runner_present
+
+        for name, values in (('last_traded_price', self.last_traded_price), ('traded_volume', self.traded_volume)):
+            column = np.full((n_books, n_runners), np.nan if name=='last_traded_price' else 0.0)
+            column[entry_book, entry_runner] = np.frombuffer(values, dtype=np.float64)
+            columns[name] = column
+
+        for side in ('back', 'lay'):
+            offsets = columns[f'{side}_offsets']
+            has_levels = np.diff(offsets) > 0
+            best_level = offsets[:-1][has_levels]
+            for field in ('price', 'size'):
+                column = np.full((n_books, n_runners), np.nan)
+                column[entry_book[has_levels], entry_runner[has_levels]] = columns[f'{side}_{field}s'][best_level]
+                columns[f'best_{side}_{field}'] = column
+
+        return columns
+
+
+def build_order_book_from_market_books(market_books):
+    """
+    Build the columnar order book from an iterable of market books (like a list returned by
+    betfairutil.read_prices_file or a generator returned by betfairutil.create_market_book_generator_from_prices_file).
+
+    :param market_books: The market books of a price file, in chronological order
+    :return: The columnar order book, as a dictionary of NumPy arrays (see the documentation of the module)
+    """
+    builder = OrderBookBuilder()
+    for market_book in market_books:
+        builder.append(market_book)
+
+    return builder.build()
+
+
+def _get_runs(values):
+    ### the start of each run of equal values
+    return np.flatnonzero(np.diff(values, prepend=values[:1] - 1 if len(values) else values)!=0)
+
+
+def get_market_phase_index(columns):
+    """
+    Build the index of the phases of the market from the 'status' and 'inplay' columns of the columnar order book: the
+    in-play transition, the changes of status (run-length encoded) and the suspension windows. The index is a few
+    small integer arrays (one entry for each change, not for each market book), and the features are split at the
+    in-play transition without copying them (see split_pre_event_in_play).
+
+    :param columns: The columnar order book of a price file (only 'status' and 'inplay' are read)
+    :return: A dictionary with:
+        'inplay_idx': the index of the first in-play market book (None if the market never turned in play);
+        'last_pre_event_idx': the index of the last pre-event market book where the market isn't SUSPENDED (None if
+        the market never turned in play, or if it was suspended until it turned in play);
+        'inplay_change_idx' (int64): the indexes of the market books where the in-play flag changes (the first
+        market book included);
+        'status_change_idx' (int64) and 'statuses' (int8): the indexes of the market books where the status of the
+        market changes (the first market book included) and the new status, as an index of MARKET_STATUSES;
+        'suspension_windows' (int64, k x 2): the [start, end) market book indexes of each suspension of the market.
+    """
+    status = np.asarray(columns['status'])
+    inplay = np.asarray(columns['inplay'], dtype=np.int8)
+
+    inplay_change_idx = _get_runs(inplay).astype(np.int64)
+    inplay_starts = inplay_change_idx[inplay[inplay_change_idx]==1]
+    status_change_idx = _get_runs(status).astype(np.int64)
+    statuses = status[status_change_idx].astype(np.int8)
+
+    ### a suspension ends at the next change of status (or at the end of the price file)
+    run_ends = np.append(status_change_idx[1:], len(status))
+    suspended = statuses==MARKET_STATUSES.index('SUSPENDED')
+    suspension_windows = np.stack([status_change_idx[suspended], run_ends[suspended]], axis=1)
+
+    inplay_idx = int(inplay_starts[0]) if len(inplay_starts) else None
+    last_pre_event_idx = None
+    if inplay_idx is not None:
+        not_suspended = np.flatnonzero(status[:inplay_idx]!=MARKET_STATUSES.index('SUSPENDED'))
+        last_pre_event_idx = int(not_suspended[-1]) if len(not_suspended) else None
+
+    return {'inplay_idx': inplay_idx,
+            'last_pre_event_idx': last_pre_event_idx,
+            'inplay_change_idx': inplay_change_idx,
+            'status_change_idx': status_change_idx,
+            'statuses': statuses,
+            'suspension_windows': suspension_windows}
+
+
+def split_pre_event_in_play(feature, inplay_idx):
+    """
+    Split a feature (one value for each market book) into its pre-event and in-play parts. The parts are views of the
+    feature, so nothing is copied.
+
+    :param feature: The values of the feature (a NumPy array, or a list that is converted to an array)
+    :param inplay_idx: The index of the first in-play market book (None if the market never turned in play)
+    :return: The pre-event and the in-play values (the in-play values are empty if the market never turned in play)
+    """
+    feature = np.asarray(feature)
+    if inplay_idx is None:
+        return feature, feature[len(feature):]
+
+    return feature[:inplay_idx], feature[inplay_idx:]
+
+
+def get_total_volume_traded(columns, deque_len=8):
+    """
+    Vectorized version of betfairutil.get_total_volume_traded_from_prices_file (check its documentation for the
+    reason why the last deque_len market books are searched in reverse order).
+
+    :param columns: The columnar order book of a price file
+    :param deque_len: Number of final market books searched for a non-zero total volume traded
+    :return: The total volume traded, or None if the market was pulled by Betfair (i.e. all runners have a status of "REMOVED")
+    """
+    total_matched = columns['total_matched']
+    runner_status = columns['runner_status']
+    removed = RUNNER_STATUSES.index('REMOVED')
+    in_market_definition = runner_status!=-1
+
+    for book_idx in range(len(total_matched) - 1, max(len(total_matched) - deque_len, 0) - 1, -1):
+        if total_matched[book_idx] > 0:
+            return total_matched[book_idx].item()
+        if np.all(runner_status[book_idx][in_market_definition[book_idx]]==removed):
+            return None
+
+    if len(total_matched) > 0:
+        return 0
+
+
+def get_pre_event_volume_traded(columns, inplay_idx):
+    """
+    Vectorized version of betfairutil.get_pre_event_volume_traded_from_prices_file.
+
+    :param columns: The columnar order book of a price file
+    :param inplay_idx: The index of the first in-play market book (None if the market never turned in play)
+    :return: The total matched on the last market book before the market turned in play, or None if there isn't one
+    """
+    if inplay_idx is not None and inplay_idx > 0:
+        return columns['total_matched'][inplay_idx - 1].item()
+
+
+def get_publish_times(columns):
+    """
+    Vectorized version of the 'Publish time' feature. The publish times are kept as epoch milliseconds (they are
+    converted to datetimes only when they are plotted).
+
+    :param columns: The columnar order book of a price file
+    :return: An int64 array with the publish time of each market book in epoch milliseconds
+    """
+    return np.array(columns['publish_time'], dtype=np.int64)
+
+
+def calculate_total_matched(columns):
+    """
+    Vectorized version of betfairutil.calculate_total_matched.
+
+    :param columns: The columnar order book of a price file
+    :return: An array with the total matched of each market book
+    """
+    return np.array(columns['total_matched'])
+
+
+def calculate_available_volume(columns, side, max_book_percentage):
+    """
+    Vectorized version of betfairutil.calculate_available_volume. For each depth of the ladders the volume of all
+    the runners is summed, as long as every runner of the market book has a price at that depth, and it is included
+    in the available volume if the book percentage at that depth is lower than max_book_percentage.
+
+    :param columns: The columnar order book of a price file
+    :param side: Indicate whether to get the available volume on the back or lay side
+    :param max_book_percentage: Maximum book percentage value to use for calculating the volume
+    :return: An array with the available volume of each market book
+    """
+    side_name = 'back' if side is betfairutil.Side.BACK else 'lay'
+    ### The order book built by the order book engine has the available volume already calculated (but not the
+    ### ladders to calculate it with a different maximum book percentage)
+    if f'available_volume_{side_name}' in columns:
+        if columns['available_volume_max_book_percentage'][0]==max_book_percentage:
+            return np.array(columns[f'available_volume_{side_name}'])
+        if f'{side_name}_prices' not in columns:
+            raise ValueError(f"The order book has the available volume only for a maximum book percentage of "
+                             f"{columns['available_volume_max_book_percentage'][0]}, the ladders are needed for the "
+                             f"other ones (see ladders in data_processing.extract_features_in_single_pass_with_cache)")
+
+    prices = columns[f'{side_name}_prices']
+    sizes = columns[f'{side_name}_sizes']
+    offsets = columns[f'{side_name}_offsets']
+    entry_book = columns['entry_book']
+    n_books = len(columns['publish_time'])
+
+    ### The usable depth of each market book is the shortest ladder among its runners
+    entry_depth = np.diff(offsets)
+    usable_depth = np.full(n_books, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(usable_depth, entry_book, entry_depth)
+    usable_depth[usable_depth==np.iinfo(np.int64).max] = 0
+
+    level_book = np.repeat(entry_book, entry_depth)
+    level_depth = np.arange(len(prices)) - np.repeat(offsets[:-1], entry_depth)
+    usable = level_depth < usable_depth[level_book]
+
+    ### Each (market book, depth) pair is a group, numbered consecutively
+    group_start = np.concatenate(([0], np.cumsum(usable_depth)[:-1]))
+    group = group_start[level_book[usable]] + level_depth[usable]
+    n_groups = int(usable_depth.sum())
+    group_book_percentage = np.bincount(group, weights=1.0/prices[usable], minlength=n_groups)
+    group_size = np.bincount(group, weights=sizes[usable], minlength=n_groups)
+    group_book = np.repeat(np.arange(n_books), usable_depth)
+
+    included = group_book_percentage <= max_book_percentage
+
+    return np.bincount(group_book, weights=np.where(included, group_size, 0.0), minlength=n_books)
+
+
+def get_spread(columns):
+    """
+    Vectorized version of betfairutil.get_spread (difference between the best available to lay and best available
+    to back prices in terms of number of steps on the Betfair price ladder).
+
+    :param columns: The columnar order book of a price file
+    :return: An array (market books x runners) with the spread of each runner (NaN if one side of the book is empty)
+    """
+    if 'spread' in columns:
+        return np.array(columns['spread'])
+
+    best_back_price = columns['best_back_price']
+    best_lay_price = columns['best_lay_price']
+    spread = np.full(best_back_price.shape, np.nan)
+    valid = ~np.isnan(best_back_price) & ~np.isnan(best_lay_price)
+    spread[valid] = (np.searchsorted(BETFAIR_PRICES, best_lay_price[valid])
+                     - np.searchsorted(BETFAIR_PRICES, best_back_price[valid]))
+
+    return spread
+
+
+def get_mid_price(columns):
+    """
+    Vectorized version of betfairutil.get_mid_price.
+
+    :param columns: The columnar order book of a price file
+    :return: An array (market books x runners) with the mid price of each runner (NaN if one side of the book is empty)
+    """
+    if 'mid_price' in columns:
+        return np.array(columns['mid_price'])
+
+    return (columns['best_back_price'] + columns['best_lay_price']) / 2
+
+
+def calculate_order_book_imbalance(columns):
+    """
+    Vectorized version of betfairutil.calculate_order_book_imbalance.
+
+    :param columns: The columnar order book of a price file
+    :return: An array (market books x runners) with the order book imbalance of each runner (NaN if one side of the book is empty)
+    """
+    if 'order_book_imbalance' in columns:
+        return np.array(columns['order_book_imbalance'])
+
+    back_size = columns['best_back_size']
+    lay_size = columns['best_lay_size']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (back_size - lay_size) / (back_size + lay_size)
+
+
+def get_last_traded_prices(columns):
+    """
+    Vectorized version of pricefileutils.get_last_traded_prices_from_runner (missing prices are replaced by 0).
+
+    :param columns: The columnar order book of a price file
+    :return: An array (market books x runners) with the last traded price of each runner
+    """
+    return np.nan_to_num(columns['last_traded_price'], nan=0.0)
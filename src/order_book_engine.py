@@ -0,0 +1,512 @@
+"""
+This module contains the order book engine: it builds the columnar order book of a price file (see the order_book
+module) directly from the raw "mcm" messages of the price file, applying each delta to a compact state of the
+market, instead of materialising a full market book for every update (like betfairutil and
+order_book.OrderBookBuilder do).
+
+Each runner has a ladder for each side of the book (and one for the traded volume), that keeps its levels sorted, so
+the best level and the level at any depth are found without sorting. When a delta ('atb', 'atl', 'batb', 'batl',
+'bdatb', 'bdatl', 'trd' or 'ltp') arrives, only the runners it changes are updated, together with their
+features (best prices and sizes, spread, mid price and order book imbalance), and the available volume of the market
+is recalculated only from the first depth of the book that has changed. The state of the runners is recorded only when it changes
+and is forward filled into the columns at the end, so the cost of each update depends on the size of the delta and
+not on the size of the order book.
+
+The deltas are applied with the same rules of the betfairlightweight cache (a size of 0 removes a level, an empty
+'trd' clears the traded volume, a full image ('img') resets the market, a new runner can arrive with a runner
+change, the traded volume is the sum of 'trd' and not 'tv', like in betfairutil.calculate_total_matched) and a row
+is recorded for every line of the price file, so the columns are the same built by OrderBookBuilder from the market
+books of the price file (the sums of the traded volumes are equal up to floating point rounding). The ladders aren't
+stored in the columns: the available volume is calculated by the engine (for one maximum book percentage) and saved
+in the columns 'available_volume_back' and 'available_volume_lay', and the spread, mid price and order book
+imbalance in 'spread', 'mid_price' and 'order_book_imbalance' (see the vectorized functions in the order_book
+module, that use these columns when they are present).
+The price files contain a single market: the changes of other markets (if any) are ignored.
+"""
+
+import bisect
+from array import array
+
+import numpy as np
+from betfairlightweight.compat import json as fast_json
+
+from src import constants, order_book, price_file_reader
+
+BETFAIR_PRICES = order_book.BETFAIR_PRICES.tolist()
+RUNNER_COLUMNS = ('last_traded_price', 'traded_volume', 'best_back_price', 'best_back_size', 'best_lay_price',
+                  'best_lay_size', 'spread', 'mid_price', 'order_book_imbalance')
+MISSING_RUNNER_STATE = (False, -1, np.nan, 0.0, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan)
+
+
+class Ladder:
+    """
+    This class holds one side of the book of a runner (or its traded volume): the levels (price and size) keyed by
+    price (or by position, for the ladders of the best prices 'batb', 'batl', 'bdatb' and 'bdatl'), with their keys
+    kept sorted. The total size of the levels can be kept up to date too (with a compensated sum, so it doesn't
+    drift when many deltas are applied). After each update 'changed_depth' is the smallest depth whose level has
+    changed (or shifted, because a level above it has been added or removed), None if no level has changed.
+    """
+
+    __slots__ = ('levels', 'keys', 'reverse', 'keyed_by_position', 'track_total', 'changed_depth', '_total',
+                 '_compensation')
+
+    def __init__(self, reverse=False, keyed_by_position=False, track_total=False):
+        self.levels = {}
+        self.keys = []
+        self.reverse = reverse
+        self.keyed_by_position = keyed_by_position
+        self.track_total = track_total
+        self.changed_depth = None
+        self._total = 0.0
+        self._compensation = 0.0
+
+    def _add_to_total(self, value):
+        ### Neumaier summation
+        total = self._total + value
+        if abs(self._total)>=abs(value):
+            self._compensation += (self._total - total) + value
+        else:
+            self._compensation += (value - total) + self._total
+        self._total = total
+
+    @property
+    def total(self):
+        return self._total + self._compensation
+
+    def update(self, changes):
+        """
+        Apply the changes of a delta to the ladder.
+
+        :param changes: A list of [price, size] (or [position, price, size]) changes, where a size of 0 removes the level
+        """
+        keys = self.keys
+        changed_depth = None
+        for change in changes:
+            key = change[0]
+            if self.keyed_by_position:
+                price, size = change[1], change[2]
+            else:
+                price, size = change[0], change[1]
+            previous = self.levels.get(key)
+
+            if size==0:
+                if previous is None:
+                    continue
+                del self.levels[key]
+                idx = bisect.bisect_left(keys, key)
+                depth = len(keys) - 1 - idx if self.reverse else idx
+                del keys[idx]
+                if self.track_total:
+                    self._add_to_total(-previous[1])
+            else:
+                if previous is None:
+                    idx = bisect.bisect_left(keys, key)
+                    keys.insert(idx, key)
+                else:
+                    idx = bisect.bisect_left(keys, key)
+                    if self.track_total:
+                        self._add_to_total(-previous[1])
+                depth = len(keys) - 1 - idx if self.reverse else idx
+                self.levels[key] = (price, size)
+                if self.track_total:
+                    self._add_to_total(size)
+
+            if changed_depth is None or depth<changed_depth:
+                changed_depth = depth
+
+        self.changed_depth = changed_depth
+
+    def clear(self):
+        self.changed_depth = 0 if self.keys else None
+        self.levels = {}
+        self.keys = []
+        self._total = 0.0
+        self._compensation = 0.0
+
+    def get_level(self, depth):
+        """
+        Get a level of the ladder.
+
+        :param depth: The depth of the level (0 is the best one)
+        :return: The (price, size) of the level, or None if the ladder is shorter
+        """
+        if depth>=len(self.keys):
+            return None
+
+        return self.levels[self.keys[-1 - depth] if self.reverse else self.keys[depth]]
+
+
+class RunnerState:
+    """
+    This class holds the state of a runner of the market: its ladders, last traded price and status.
+    """
+
+    __slots__ = ('selection_id', 'position', 'status', 'last_traded_price', 'traded', 'available_to_back',
+                 'available_to_lay', 'best_available_to_back', 'best_available_to_lay',
+                 'best_display_available_to_back', 'best_display_available_to_lay')
+
+    def __init__(self, selection_id, position):
+        self.selection_id = selection_id
+        self.position = position
+        self.status = -1
+        self.last_traded_price = None
+        self.traded = Ladder(track_total=True)
+        self.available_to_back = Ladder(reverse=True)
+        self.available_to_lay = Ladder()
+        self.best_available_to_back = Ladder(keyed_by_position=True)
+        self.best_available_to_lay = Ladder(keyed_by_position=True)
+        self.best_display_available_to_back = Ladder(keyed_by_position=True)
+        self.best_display_available_to_lay = Ladder(keyed_by_position=True)
+
+    def update(self, runner_change):
+        """
+        Apply a runner change ('rc') to the runner.
+
+        :param runner_change: The runner change
+        :return: A tuple with the smallest changed depth of the back side and of the lay side of the book (None if the
+            side hasn't changed)
+        """
+        if 'ltp' in runner_change:
+            self.last_traded_price = runner_change['ltp']
+        if 'trd' in runner_change:
+            if runner_change['trd']:
+                self.traded.update(runner_change['trd'])
+            else:
+                self.traded.clear()
+
+        changed_depths = []
+        for side, keys_and_ladders in (('back', (('atb', self.available_to_back),
+                                                 ('batb', self.best_available_to_back),
+                                                 ('bdatb', self.best_display_available_to_back))),
+                                       ('lay', (('atl', self.available_to_lay),
+                                                ('batl', self.best_available_to_lay),
+                                                ('bdatl', self.best_display_available_to_lay)))):
+            updated_ladders = [ladder for key, ladder in keys_and_ladders if key in runner_change]
+            if not updated_ladders:
+                changed_depths.append(None)
+                continue
+            ladder_before = self.get_ladder(side)
+            for key, ladder in keys_and_ladders:
+                if key in runner_change:
+                    ladder.update(runner_change[key])
+            ladder_after = self.get_ladder(side)
+            ### when the ladder used for the side of the book is a different one, the whole side has changed
+            if ladder_after is not ladder_before:
+                changed_depths.append(0)
+            elif ladder_after is not None and any(ladder is ladder_after for ladder in updated_ladders):
+                changed_depths.append(ladder_after.changed_depth)
+            else:
+                changed_depths.append(None)
+
+        return tuple(changed_depths)
+
+    def get_ladder(self, side):
+        """
+        Get the ladder of a side of the book, with the same priority of the market books of betfairlightweight (the
+        full ladder, then the best display prices, then the best prices).
+
+        :param side: 'back' or 'lay'
+        :return: The ladder, or None if the side of the book is empty
+        """
+        if side=='back':
+            ladders = (self.available_to_back, self.best_display_available_to_back, self.best_available_to_back)
+        else:
+            ladders = (self.available_to_lay, self.best_display_available_to_lay, self.best_available_to_lay)
+        for ladder in ladders:
+            if ladder.keys:
+                return ladder
+
+        return None
+
+    def get_state(self):
+        """
+        Calculate the features of the runner from its current state.
+
+        :return: A tuple with the presence, the status and the values of RUNNER_COLUMNS
+        """
+        back_ladder = self.get_ladder('back')
+        lay_ladder = self.get_ladder('lay')
+        best_back_price, best_back_size = back_ladder.get_level(0) if back_ladder is not None else (np.nan, np.nan)
+        best_lay_price, best_lay_size = lay_ladder.get_level(0) if lay_ladder is not None else (np.nan, np.nan)
+
+        if back_ladder is not None and lay_ladder is not None:
+            spread = (bisect.bisect_left(BETFAIR_PRICES, best_lay_price)
+                      - bisect.bisect_left(BETFAIR_PRICES, best_back_price))
+            mid_price = (best_back_price + best_lay_price) / 2
+            order_book_imbalance = (best_back_size - best_lay_size) / (best_back_size + best_lay_size)
+        else:
+            spread = mid_price = order_book_imbalance = np.nan
+
+        return (True, self.status,
+                np.nan if self.last_traded_price is None else self.last_traded_price,
+                self.traded.total, best_back_price, best_back_size, best_lay_price, best_lay_size,
+                spread, mid_price, order_book_imbalance)
+
+
+class OrderBookEngine:
+    """
+    This class builds the columnar order book of a price file from its raw "mcm" messages, one line at the time.
+
+    Example:
+        engine = OrderBookEngine()
+        for line in price_file_reader.iterate_price_file_lines(price_file):
+            engine.process_line(line)
+        columns = engine.build()
+    """
+
+    def __init__(self, max_book_percentage=constants.AVAILABLE_VOLUME_MAX_BOOK_PERCENTAGE):
+        self.max_book_percentage = max_book_percentage
+        self.market_id = None
+        self.runners = {}
+        self.runner_positions = {}
+        self.market_definition = None
+        self.first_market_definition = None
+        self.runners_names = None
+        self.runners_names_changed = False
+        self.status = -1
+        self.inplay = False
+        self.publish_time = 0
+        self.total_matched = 0.0
+        self.available_volume = {'back': 0.0, 'lay': 0.0}
+
+        self.publish_times = array('q')
+        self.statuses = array('b')
+        self.inplays = array('b')
+        self.total_matched_values = array('d')
+        self.available_volume_values = {'back': array('d'), 'lay': array('d')}
+
+        ### The state of a runner is recorded (as an entry) only in the rows where it changes
+        self.entry_row = array('q')
+        self.entry_runner = array('q')
+        self.entry_present = array('b')
+        self.entry_status = array('b')
+        self.entry_values = {name: array('d') for name in RUNNER_COLUMNS}
+
+        self._runners_by_position = {}
+        self._changed_runners = set()
+        ### The smallest depth changed on each side of the book since the last row, and the available volume of the
+        ### depths above each depth (so only the changed depths are summed again)
+        self._changed_depths = {'back': None, 'lay': None}
+        self._available_volume_by_depth = {'back': [0.0], 'lay': [0.0]}
+        self._total_matched_changed = False
+
+    def _get_runner(self, selection_id, handicap=0):
+        runner = self.runners.get((selection_id, handicap))
+        if runner is None:
+            position = self.runner_positions.setdefault(selection_id, len(self.runner_positions))
+            runner = RunnerState(selection_id, position)
+            self.runners[(selection_id, handicap)] = runner
+            self._runners_by_position[position] = runner
+            self._changed_runners.add(runner.position)
+            self._changed_depths = {'back': 0, 'lay': 0}
+
+        return runner
+
+    def _reset_market(self):
+        ### A full image replaces the whole state of the market (like a new cache in betfairlightweight)
+        self._changed_runners.update(runner.position for runner in self.runners.values())
+        self.runners = {}
+        self._runners_by_position = {}
+        self.market_definition = None
+        self.status = -1
+        self.inplay = False
+        self._changed_depths = {'back': 0, 'lay': 0}
+        self._total_matched_changed = True
+
+    def _process_market_definition(self, market_definition):
+        self.market_definition = market_definition
+        if self.first_market_definition is None:
+            self.first_market_definition = market_definition
+            self.runners_names = tuple(runner.get('name') for runner in market_definition.get('runners', []))
+        elif not self.runners_names_changed:
+            self.runners_names_changed = (tuple(runner.get('name') for runner in market_definition.get('runners', []))
+                                          !=self.runners_names)
+
+        status = market_definition.get('status')
+        self.status = order_book.MARKET_STATUSES.index(status) if status in order_book.MARKET_STATUSES else -1
+        self.inplay = bool(market_definition.get('inPlay'))
+
+        statuses = {}
+        for runner_definition in market_definition.get('runners', []):
+            runner = self._get_runner(runner_definition['id'], runner_definition.get('hc', 0))
+            statuses[runner.position] = order_book.RUNNER_STATUSES.index(runner_definition['status'])
+        ### The status of the runners that aren't in the market definition is -1 (like in OrderBookBuilder)
+        for runner in self.runners.values():
+            status = statuses.get(runner.position, -1)
+            if status!=runner.status:
+                runner.status = status
+                self._changed_runners.add(runner.position)
+
+    def process_market_change(self, market_change):
+        """
+        Apply a market change ('mc') to the state of the market.
+
+        :param market_change: The market change
+        """
+        if market_change.get('img'):
+            self._reset_market()
+        if 'marketDefinition' in market_change:
+            self._process_market_definition(market_change['marketDefinition'])
+
+        for runner_change in market_change.get('rc', []):
+            runner = self._get_runner(runner_change['id'], runner_change.get('hc', 0))
+            for side, changed_depth in zip(('back', 'lay'), runner.update(runner_change)):
+                if changed_depth is not None and (self._changed_depths[side] is None
+                                                  or changed_depth<self._changed_depths[side]):
+                    self._changed_depths[side] = changed_depth
+            self._changed_runners.add(runner.position)
+            if 'trd' in runner_change:
+                self._total_matched_changed = True
+
+    def process_line(self, line):
+        """
+        Apply a line of the price file (a "mcm" message) to the state of the market and record a row of the order
+        book (once the market has been created, a row is recorded for every line, like the market books generated by
+        betfairutil).
+
+        :param line: The line of the price file (bytes or str)
+        """
+        try:
+            data = fast_json.loads(line)
+        except ValueError:
+            data = None
+
+        if data is not None and data.get('op')=='mcm' and data.get('ct')!='HEARTBEAT':
+            for market_change in data.get('mc', []):
+                if self.market_id is None:
+                    self.market_id = market_change['id']
+                elif market_change['id']!=self.market_id:
+                    continue
+                self.publish_time = data['pt']
+                self.process_market_change(market_change)
+
+        if self.market_id is not None:
+            self._record_row()
+
+    def _calculate_available_volume(self, side, from_depth):
+        ### Same algorithm (and order of the sums) of betfairutil.calculate_available_volume, on the sorted ladders
+        ### and starting from the first changed depth
+        volume_by_depth = self._available_volume_by_depth[side]
+        ladders = [runner.get_ladder(side) for runner in self.runners.values()]
+        if not ladders or any(ladder is None for ladder in ladders):
+            self._available_volume_by_depth[side] = [0.0]
+            return 0.0
+
+        ladders = [(ladder.levels, ladder.keys, ladder.reverse, len(ladder.keys) - 1) for ladder in ladders]
+        usable_depth = min(last_idx for _, _, _, last_idx in ladders) + 1
+        start_depth = min(from_depth, len(volume_by_depth) - 1, usable_depth)
+        del volume_by_depth[start_depth + 1:]
+        available_volume = volume_by_depth[start_depth]
+
+        max_book_percentage = self.max_book_percentage
+        for depth in range(start_depth, usable_depth):
+            book_percentage = 0.0
+            size = 0.0
+            for levels, keys, reverse, last_idx in ladders:
+                level_price, level_size = levels[keys[last_idx - depth] if reverse else keys[depth]]
+                book_percentage += 1.0 / level_price
+                size += level_size
+            if book_percentage<=max_book_percentage:
+                available_volume += size
+            volume_by_depth.append(available_volume)
+
+        return available_volume
+
+    def _record_row(self):
+        row = len(self.publish_times)
+
+        if self._total_matched_changed:
+            total_matched = 0.0
+            for runner in self.runners.values():
+                total_matched += runner.traded.total
+            self.total_matched = total_matched
+            self._total_matched_changed = False
+        for side, changed_depth in self._changed_depths.items():
+            if changed_depth is not None:
+                self.available_volume[side] = self._calculate_available_volume(side, changed_depth)
+                self._changed_depths[side] = None
+
+        self.publish_times.append(self.publish_time)
+        self.statuses.append(self.status)
+        self.inplays.append(self.inplay)
+        self.total_matched_values.append(self.total_matched)
+        self.available_volume_values['back'].append(self.available_volume['back'])
+        self.available_volume_values['lay'].append(self.available_volume['lay'])
+
+        if self._changed_runners:
+            for position in sorted(self._changed_runners):
+                runner = self._runners_by_position.get(position)
+                state = runner.get_state() if runner is not None else MISSING_RUNNER_STATE
+                self.entry_row.append(row)
+                self.entry_runner.append(position)
+                self.entry_present.append(state[0])
+                self.entry_status.append(state[1])
+                for name, value in zip(RUNNER_COLUMNS, state[2:]):
+                    self.entry_values[name].append(value)
+            self._changed_runners.clear()
+
+    def build(self):
+        """
+        Convert the rows recorded so far into the columnar order book.
+
+        :return: The columnar order book, as a dictionary of NumPy arrays (see the documentation of the module)
+        """
+        n_books = len(self.publish_times)
+        n_runners = len(self.runner_positions)
+
+        columns = {
+            'publish_time': np.frombuffer(self.publish_times, dtype=np.int64).copy(),
+            'status': np.frombuffer(self.statuses, dtype=np.int8).copy(),
+            'inplay': np.frombuffer(self.inplays, dtype=np.int8).astype(bool),
+            'total_matched': np.frombuffer(self.total_matched_values, dtype=np.float64).copy(),
+            'selection_ids': np.array(list(self.runner_positions), dtype=np.int64),
+            'available_volume_back': np.frombuffer(self.available_volume_values['back'], dtype=np.float64).copy(),
+            'available_volume_lay': np.frombuffer(self.available_volume_values['lay'], dtype=np.float64).copy(),
+            'available_volume_max_book_percentage': np.array([self.max_book_percentage], dtype=np.float64),
+        }
+
+        ### The index of the last entry of each runner in each row, forward filled (-1 before the first entry)
+        last_entry = np.full((n_books, n_runners), -1, dtype=np.int64)
+        last_entry[np.frombuffer(self.entry_row, dtype=np.int64),
+                   np.frombuffer(self.entry_runner, dtype=np.int64)] = np.arange(len(self.entry_row))
+        np.maximum.accumulate(last_entry, axis=0, out=last_entry)
+        has_entry = last_entry>=0
+        entries = last_entry[has_entry]
+
+        entry_columns = [('runner_present', self.entry_present, np.int8, MISSING_RUNNER_STATE[0]),
+                         ('runner_status', self.entry_status, np.int8, MISSING_RUNNER_STATE[1])]
+        entry_columns += [(name, self.entry_values[name], np.float64, default)
+                          for name, default in zip(RUNNER_COLUMNS, MISSING_RUNNER_STATE[2:])]
+        for name, values, dtype, default in entry_columns:
+            column = np.full((n_books, n_runners), default, dtype=dtype)
+            column[has_entry] = np.frombuffer(values, dtype=dtype)[entries]
+            columns[name] = column
+        columns['runner_present'] = columns['runner_present'].astype(bool)
+
+        return columns
+
+
+def extract_order_book_from_price_file(price_file_path,
+                                       max_book_percentage=constants.AVAILABLE_VOLUME_MAX_BOOK_PERCENTAGE):
+    """
+    Build the columnar order book of a price file with the order book engine, reading the lines of the price file
+    with price_file_reader.iterate_price_file_lines.
+
+    :param price_file_path: Path to the price file (compressed with bz2)
+    :param max_book_percentage: Maximum book percentage used to calculate the available volume
+    :return: A dictionary with the same keys of the single pass loaded from the cache of decoded price files (see
+        data_processing.load_single_pass_from_cache): 'first_market_definition', 'inplay_idx', 'market_index',
+        'runners_names_changed' and 'order_book'
+    """
+    engine = OrderBookEngine(max_book_percentage=max_book_percentage)
+    for line in price_file_reader.iterate_price_file_lines(price_file_path):
+        engine.process_line(line)
+    columns = engine.build()
+
+    market_index = order_book.get_market_phase_index(columns)
+
+    return {'first_market_definition': engine.first_market_definition,
+            'inplay_idx': market_index['inplay_idx'],
+            'market_index': market_index,
+            'runners_names_changed': engine.runners_names_changed,
+            'order_book': columns}
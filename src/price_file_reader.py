@@ -0,0 +1,278 @@
+"""
+This module contains the reader of the Betfair price files used by the data_processing module, a faster replacement
+of betfairutil.create_market_book_generator_from_prices_file that returns exactly the same market books.
+
+The reader has three parts:
+    - Block-parallel bz2 decompression: a bz2 file is a sequence of independently compressed blocks, that start with
+      a 48 bits magic number at any bit offset. The blocks are found scanning the compressed data, each block is
+      wrapped in a standalone bz2 stream and the blocks are decompressed by a pool of threads (the bz2 module releases
+      the GIL while decompressing). If the blocks can't be found, or one of them can't be decompressed, the (rest of
+      the) file is decompressed sequentially.
+    - Line decoding: the decompressed lines are passed as bytes to the betfairlightweight listener, that parses them
+      with orjson (betfairlightweight uses orjson when it is installed), without decoding them to strings first.
+    - Pipelining: the decompression runs in a background thread that fills a bounded queue of decompressed chunks,
+      while the main thread splits the lines and updates the market books, so decompression and parsing overlap.
+"""
+
+import bz2
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import betfairutil
+from betfairlightweight.exceptions import ListenerError
+from betfairlightweight.streaming import StreamListener
+
+from src import constants
+
+BLOCK_MAGIC = 0x314159265359
+END_OF_STREAM_MAGIC = 0x177245385090
+MAGIC_BITS = 48
+CRC_BITS = 32
+## The level in the header of the standalone streams only sets the maximum size of the blocks, so the maximum is safe
+STREAM_HEADER = b"BZh9"
+SEQUENTIAL_CHUNK_SIZE = 1024**2
+
+
+def _find_magic_bit_offsets(data, magic):
+    ## For each of the 8 possible bit offsets of the magic number inside a byte, the bytes that are entirely covered
+    ## by the magic number are searched with bytes.find and then the whole magic number is checked
+    offsets = []
+    for shift in range(8):
+        total_bits = shift + MAGIC_BITS
+        n_bytes = (total_bits + 7) // 8
+        pattern = (magic << (n_bytes * 8 - total_bits)).to_bytes(n_bytes, 'big')
+        first_full, last_full = (1 if shift else 0), (n_bytes - 1 if total_bits % 8 else n_bytes)
+        needle = pattern[first_full:last_full]
+
+        position = data.find(needle)
+        while position!=-1:
+            start_byte = position - first_full
+            if start_byte>=0 and start_byte + n_bytes<=len(data):
+                value = int.from_bytes(data[start_byte:start_byte+n_bytes], 'big')
+                if (value >> (n_bytes * 8 - total_bits)) & ((1 << MAGIC_BITS) - 1)==magic:
+                    offsets.append(start_byte * 8 + shift)
+            position = data.find(needle, position + 1)
+
+    return sorted(offsets)
+
+
+
+def _extract_bits(data, start_bit, n_bits):
+    start_byte, end_byte = start_bit // 8, (start_bit + n_bits + 7) // 8
+    value = int.from_bytes(data[start_byte:end_byte], 'big')
+
+    return (value >> ((end_byte - start_byte) * 8 - (start_bit % 8) - n_bits)) & ((1 << n_bits) - 1)
+
+
+
+def find_bz2_blocks(data):
+    """
+    This function finds the compressed blocks of bz2 data (one or more concatenated bz2 streams).
+
+    Args:
+        data (bytes): The compressed data.
+
+    Returns:
+        list or None: The (start bit, end bit) of each block (the start is the position of its magic number and the
+        end is the position of the next magic number), or None if the data doesn't look like a bz2 file.
+    """
+    if not data.startswith(b"BZh"):
+        return None
+
+    block_offsets = _find_magic_bit_offsets(data, BLOCK_MAGIC)
+    end_offsets = _find_magic_bit_offsets(data, END_OF_STREAM_MAGIC)
+    if not block_offsets or not end_offsets:
+        return None
+
+    boundaries = sorted(block_offsets + end_offsets)
+    next_boundary = dict(zip(boundaries[:-1], boundaries[1:]))
+    blocks = [(start, next_boundary[start]) for start in block_offsets if start in next_boundary]
+
+    return blocks if len(blocks)==len(block_offsets) else None
+
+
+
+def decompress_bz2_block(data, start_bit, end_bit):
+    """
+    This function decompresses one block of bz2 data, wrapping it in a standalone bz2 stream (header, block,
+    end-of-stream magic number and combined CRC, that for a single block is the CRC of the block).
+
+    Args:
+        data (bytes): The compressed data.
+        start_bit (int): The position of the magic number of the block.
+        end_bit (int): The position of the end of the block.
+
+    Returns:
+        bytes: The decompressed block.
+    """
+    n_bits = end_bit - start_bit
+    block = _extract_bits(data, start_bit, n_bits)
+    block_crc = _extract_bits(data, start_bit + MAGIC_BITS, CRC_BITS)
+
+    stream = (((block << MAGIC_BITS) | END_OF_STREAM_MAGIC) << CRC_BITS) | block_crc
+    stream_bits = n_bits + MAGIC_BITS + CRC_BITS
+    padding = (-stream_bits) % 8
+    stream = (stream << padding).to_bytes((stream_bits + padding) // 8, 'big')
+
+    return bz2.decompress(STREAM_HEADER + stream)
+
+
+
+def _iterate_decompressed_chunks_in_parallel(data, blocks, workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        ## only a limited number of blocks are decompressed ahead, so the decompressed blocks don't fill the memory
+        window = 2 * workers
+        futures = [executor.submit(decompress_bz2_block, data, start, end) for start, end in blocks[:window]]
+        for idx in range(len(blocks)):
+            if idx + window<len(blocks):
+                start, end = blocks[idx + window]
+                futures.append(executor.submit(decompress_bz2_block, data, start, end))
+            yield futures[idx].result()
+            futures[idx] = None
+
+
+
+def iterate_decompressed_chunks(price_file_path, workers=None):
+    """
+    This function decompresses a bz2 price file in chunks. The blocks of the files bigger than
+    constants.PRICE_FILE_READER_MIN_PARALLEL_SIZE are decompressed in parallel by 'workers' threads. If a block can't
+    be decompressed independently, the rest of the file is decompressed sequentially with the bz2 module, from the
+    first byte that hasn't been yielded yet.
+
+    Args:
+        price_file_path (str): Path to the price file (compressed with bz2).
+        workers (int or None): Number of threads that decompress the blocks (constants.PRICE_FILE_READER_WORKERS if
+        None, and the number of CPUs if that is None too).
+
+    Returns:
+        generator: The decompressed chunks, in order.
+    """
+    if workers is None:
+        workers = constants.PRICE_FILE_READER_WORKERS or os.cpu_count() or 1
+
+    n_bytes_yielded = 0
+    if workers>1 and os.path.getsize(price_file_path)>=constants.PRICE_FILE_READER_MIN_PARALLEL_SIZE:
+        with open(price_file_path, 'rb') as f:
+            data = f.read()
+        blocks = find_bz2_blocks(data)
+        if blocks:
+            try:
+                for chunk in _iterate_decompressed_chunks_in_parallel(data, blocks, workers):
+                    yield chunk
+                    n_bytes_yielded += len(chunk)
+                return
+            except (OSError, ValueError, EOFError):
+                ## a block couldn't be decompressed on its own, so the rest of the file is decompressed sequentially
+                pass
+
+    with bz2.open(price_file_path, 'rb') as f:
+        ## the bytes already yielded by the parallel decompression are skipped (the chunks have been consumed)
+        f.seek(n_bytes_yielded)
+        while True:
+            chunk = f.read(SEQUENTIAL_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+
+def _iterate_in_background(iterable, max_queued):
+    ## the iterable is consumed by a background thread, the items (or the exception raised) are passed through a
+    ## bounded queue
+    items = queue.Queue(maxsize=max_queued)
+    stop = threading.Event()
+    end = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            items.put((end, None))
+        except BaseException as e:
+            items.put((end, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, exception = items.get()
+            if item is end:
+                if exception is not None:
+                    raise exception
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+
+def iterate_price_file_lines(price_file_path, workers=None, pipelined=True):
+    """
+    This function returns the lines of a bz2 price file as bytes (without the line terminator), decompressing the
+    file with iterate_decompressed_chunks.
+
+    Args:
+        price_file_path (str): Path to the price file (compressed with bz2).
+        workers (int or None): Number of threads that decompress the blocks (see iterate_decompressed_chunks).
+        pipelined (bool): If True the file is decompressed by a background thread while the lines are consumed.
+
+    Returns:
+        generator: The lines of the price file.
+    """
+    chunks = iterate_decompressed_chunks(price_file_path, workers=workers)
+    if pipelined:
+        chunks = _iterate_in_background(chunks, max_queued=constants.PRICE_FILE_READER_MAX_QUEUED_CHUNKS)
+
+    remainder = b""
+    for chunk in chunks:
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        yield from lines
+
+    if remainder:
+        yield remainder
+
+
+
+def create_market_book_generator(price_file_path, workers=None, pipelined=True, **kwargs):
+    """
+    This function returns a generator of the market books of a price file, the same (dictionaries) returned by
+    betfairutil.create_market_book_generator_from_prices_file with lightweight=True. The local ".bz2" files are read
+    with the reader of this module (see iterate_price_file_lines), the other files (not compressed with bz2, or
+    remote) with betfairutil.
+
+    Args:
+        price_file_path (str): Path to the price file.
+        workers (int or None): Number of threads that decompress the blocks (see iterate_decompressed_chunks).
+        pipelined (bool): If True the file is decompressed by a background thread while the market books are
+        generated.
+        **kwargs: Passed to the betfairlightweight StreamListener.
+
+    Returns:
+        generator: The market books of the price file.
+
+    Example:
+        for mb in create_market_book_generator('path/to/your/data/1.208791811.bz2'):
+            print(mb['publishTime'])
+    """
+    if not (str(price_file_path).endswith(".bz2") and os.path.isfile(price_file_path)):
+        yield from betfairutil.create_market_book_generator_from_prices_file(price_file_path, **kwargs)
+        return
+
+    ## The same listener (and stream registration) of betfairlightweight's HistoricalGeneratorStream
+    listener = StreamListener(max_latency=None, lightweight=True, update_clk=False, **kwargs)
+    listener.register_stream(0, "marketSubscription")
+
+    for line in iterate_price_file_lines(price_file_path, workers=workers, pipelined=pipelined):
+        if listener.on_data(line) is False:
+            raise ListenerError("HISTORICAL", line)
+        yield from listener.snap()
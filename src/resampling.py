@@ -0,0 +1,249 @@
+"""
+This module contains the functions to resample the time series of the features of a price file into bars of a fixed
+interval of publish time (like 1 second, 10 seconds or 1 minute), so that the correlations and the plots aren't
+weighted by the frequency of the updates (the in-play markets can have hundreds of market books per minute, the
+pre-event ones a few).
+
+The market books are grouped by the bar that contains their publish time and each feature is aggregated with the
+aggregation of its name (see get_resampling_aggregation and constants.RESAMPLING_AGGREGATIONS):
+    - 'ohlc': open, high, low and close of the bar (the prices, like 'Mid price'). The close keeps the name of the
+      feature and the others are added with the suffixes ' open', ' high' and ' low'.
+    - 'last': the last value of the bar (the cumulative volumes, like 'Total matched', and the state of the order
+      book, like 'Spread').
+    - 'sum': the sum of the values of the bar (the volumes matched by each market book, 'Matched').
+    - 'mean': the average of the values of the bar.
+Like in pandas.DataFrame.resample, the missing values are ignored (a bar whose values are all missing has a missing
+value, except for 'sum' that is 0). All the aggregations are vectorized (numpy reduceat on the boundaries of the bars),
+so the resampling costs a few passes over the features.
+"""
+
+import re
+
+import numpy as np
+
+from src import constants
+
+RESAMPLING_AGGREGATIONS = ('ohlc', 'last', 'sum', 'mean')
+OHLC_SUFFIXES = (' open', ' high', ' low')
+INTERVAL_UNITS_MS = {'ms': 1, 's': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000}
+
+
+def parse_resample_interval(interval):
+    """
+    This function converts the interval of the bars to milliseconds.
+
+    Args:
+        interval (int or str): The interval in milliseconds, or a string with a unit ('ms', 's', 'm' or 'h'), like
+        '500ms', '1s', '10s' or '1m'.
+
+    Returns:
+        int: The interval in milliseconds.
+
+    Example:
+        parse_resample_interval('10s')
+        # returns 10000
+    """
+    if isinstance(interval, str):
+        match = re.fullmatch(r"\s*(\d+)\s*(ms|s|m|h)\s*", interval)
+        if match is None:
+            raise ValueError(f"Invalid resample interval '{interval}', it must be like '500ms', '1s', '10s' or '1m'")
+        interval = int(match.group(1)) * INTERVAL_UNITS_MS[match.group(2)]
+
+    interval = int(interval)
+    if interval<=0:
+        raise ValueError(f"The resample interval must be positive, not {interval}")
+
+    return interval
+
+
+
+def get_resampling_aggregation(feature_name, resampling_aggregations=None):
+    """
+    This function returns the aggregation of a feature: the one of the feature in 'resampling_aggregations' (or in
+    constants.RESAMPLING_AGGREGATIONS if it is None), looked up by the name of the feature and then by the name
+    without the runner suffix (like 'Mid price' for 'Mid price_1'), or constants.RESAMPLING_AGGREGATION_DEFAULT.
+
+    Args:
+        feature_name (str): The name of the feature.
+        resampling_aggregations (dict or None): The aggregations of the features.
+
+    Returns:
+        str: The aggregation (one of RESAMPLING_AGGREGATIONS).
+    """
+    if resampling_aggregations is None:
+        resampling_aggregations = constants.RESAMPLING_AGGREGATIONS
+
+    if feature_name in resampling_aggregations:
+        return resampling_aggregations[feature_name]
+
+    return resampling_aggregations.get(feature_name.rsplit("_", 1)[0], constants.RESAMPLING_AGGREGATION_DEFAULT)
+
+
+
+def calculate_bars(publish_times, interval_ms):
+    """
+    This function groups the market books by the bar of their publish time (the publish times must be sorted, like
+    the ones of a price file).
+
+    Args:
+        publish_times (numpy.ndarray or list): The publish times of the market books in epoch milliseconds.
+        interval_ms (int): The interval of the bars in milliseconds.
+
+    Returns:
+        tuple: The number of each bar (publish time // interval_ms) and the index of the first market book of each
+        bar (only the bars that contain at least one market book).
+    """
+    buckets = np.asarray(publish_times, dtype=np.int64) // interval_ms
+    if len(buckets)==0:
+        return buckets, np.empty(0, dtype=np.int64)
+    starts = np.insert(np.flatnonzero(np.diff(buckets)) + 1, 0, 0)
+
+    return buckets[starts], starts
+
+
+
+def _last_valid(values, starts, ends):
+    ## the index of the last value that isn't missing up to each position, compared with the start of the bar
+    valid_idx = np.maximum.accumulate(np.where(np.isnan(values), -1, np.arange(len(values))))[ends]
+    found = valid_idx>=starts
+
+    return np.where(found, values[np.where(found, valid_idx, 0)], np.nan)
+
+
+
+def _first_valid(values, starts, ends):
+    ## the index of the first value that isn't missing from each position, compared with the end of the bar
+    n = len(values)
+    valid_idx = np.minimum.accumulate(np.where(np.isnan(values), n, np.arange(n))[::-1])[::-1][starts]
+    found = valid_idx<=ends
+
+    return np.where(found, values[np.where(found, valid_idx, 0)], np.nan)
+
+
+
+def aggregate_feature(values, starts, aggregation):
+    """
+    This function aggregates the values of a feature in each bar.
+
+    Args:
+        values (numpy.ndarray or list): The values of the feature (one for each market book).
+        starts (numpy.ndarray): The index of the first market book of each bar (see calculate_bars).
+        aggregation (str): The aggregation (one of RESAMPLING_AGGREGATIONS).
+
+    Returns:
+        dict: The aggregated values, with the keys 'open', 'high', 'low' and 'close' for 'ohlc' and the key
+        'close' for the other aggregations.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(starts)==0:
+        return {key: np.empty(0) for key in (('open', 'high', 'low', 'close') if aggregation=='ohlc' else ('close',))}
+    ends = np.append(starts[1:], len(values)) - 1
+
+    if aggregation=='ohlc':
+        ## fmax and fmin ignore the missing values
+        return {'open': _first_valid(values, starts, ends),
+                'high': np.fmax.reduceat(values, starts),
+                'low': np.fmin.reduceat(values, starts),
+                'close': _last_valid(values, starts, ends)}
+    if aggregation=='last':
+        return {'close': _last_valid(values, starts, ends)}
+    if aggregation=='sum':
+        return {'close': np.add.reduceat(np.nan_to_num(values, nan=0.0), starts)}
+    if aggregation=='mean':
+        valid = ~np.isnan(values)
+        counts = np.add.reduceat(valid.astype(np.int64), starts)
+        sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {'close': np.where(counts>0, sums / np.maximum(counts, 1), np.nan)}
+
+    raise ValueError(f"Unknown aggregation '{aggregation}', it must be one of {RESAMPLING_AGGREGATIONS}")
+
+
+
+def resample_features(dict_features, inplay_idx, interval, resampling_aggregations=None, fill_empty=False):
+    """
+    This function resamples the features of a price file (as returned by data_analysis.extract_features_from_price_file)
+    into bars of a fixed interval of publish time.
+    The 'Publish time' of each bar is the start of the bar (in epoch milliseconds). The features that are lists or
+    arrays with one value for each market book are aggregated (see aggregate_feature and get_resampling_aggregation),
+    the single values are kept as they are and the other lists (like 'Pre-event diff time', that doesn't have a value
+    for each market book) are dropped.
+
+    Args:
+        dict_features (dict): The features of the price file (it must contain 'Publish time').
+        inplay_idx (int or None): The index of the first in-play market book.
+        interval (int or str): The interval of the bars (see parse_resample_interval).
+        resampling_aggregations (dict or None): The aggregations of the features (see get_resampling_aggregation).
+        fill_empty (bool): If False only the bars that contain at least one market book are returned. If True there
+        is a bar for each interval between the first and the last market book: the empty bars have the close of the
+        previous bar (also as open, high and low), 0 for 'sum' and a missing value for 'mean'.
+
+    Returns:
+        dict: The resampled features.
+        int or None: The index of the bar that contains the first in-play market book.
+
+    Example:
+        dict_features, inplay_idx = data_analysis.extract_features_from_price_file('path/to/your/file.bz2')
+        dict_bars, bars_inplay_idx = resample_features(dict_features, inplay_idx, '10s')
+    """
+    interval_ms = parse_resample_interval(interval)
+    publish_times = np.asarray(dict_features['Publish time'], dtype=np.int64)
+    n_market_books = len(publish_times)
+    bar_numbers, starts = calculate_bars(publish_times, interval_ms)
+
+    if fill_empty and len(bar_numbers):
+        all_bar_numbers = np.arange(bar_numbers[0], bar_numbers[-1] + 1)
+        ## the index of the last bar with market books up to each bar
+        last_bar_idx = np.searchsorted(bar_numbers, all_bar_numbers, side='right') - 1
+        empty = bar_numbers[last_bar_idx]!=all_bar_numbers
+    else:
+        all_bar_numbers, last_bar_idx, empty = bar_numbers, None, None
+
+    def fill(aggregated, key, aggregation):
+        if last_bar_idx is None:
+            return aggregated[key]
+        filled = aggregated[key][last_bar_idx]
+        if aggregation=='sum':
+            filled[empty] = 0.0
+        elif aggregation=='mean':
+            filled[empty] = np.nan
+        else:
+            filled[empty] = aggregated['close'][last_bar_idx][empty]
+        return filled
+
+    dict_bars = {}
+    for feature_name, feature in dict_features.items():
+        if feature_name=='Publish time':
+            dict_bars[feature_name] = all_bar_numbers * interval_ms
+        elif not isinstance(feature, (list, np.ndarray)):
+            dict_bars[feature_name] = feature
+        elif len(feature)==n_market_books:
+            aggregation = get_resampling_aggregation(feature_name, resampling_aggregations)
+            aggregated = aggregate_feature(feature, starts, aggregation)
+            dict_bars[feature_name] = fill(aggregated, 'close', aggregation)
+            if aggregation=='ohlc':
+                for suffix in OHLC_SUFFIXES:
+                    dict_bars[feature_name+suffix] = fill(aggregated, suffix.strip(), aggregation)
+
+    bars_inplay_idx = None
+    if inplay_idx is not None and inplay_idx<n_market_books:
+        bars_inplay_idx = int(np.searchsorted(all_bar_numbers, publish_times[inplay_idx] // interval_ms))
+
+    return dict_bars, bars_inplay_idx
+
+
+
+def get_close_features(dict_bars):
+    """
+    This function removes the open, high and low of the 'ohlc' features from the resampled features, so that every
+    feature has a single series (the close of the bars), like the features that aren't resampled.
+
+    Args:
+        dict_bars (dict): The resampled features (see resample_features).
+
+    Returns:
+        dict: The resampled features without the open, high and low.
+    """
+    ohlc_names = {feature_name+suffix for feature_name in dict_bars for suffix in OHLC_SUFFIXES}
+
+    return {feature_name: feature for feature_name, feature in dict_bars.items() if feature_name not in ohlc_names}
@@ -0,0 +1,193 @@
+"""
+This module contains the functions of the results store: a columnar (Parquet) store of the results of the analysis of
+the price files, with one row per market (price file) containing its single-value features (name, event ID, date,
+total volume traded, pre-event volume, ...), its aggregate statistics (one column per feature and statistic, like
+'Spread_1__mean') and its missing data.
+
+The store is a directory of Parquet files (parts): every run of the analysis appends a new part, so the store can be
+shared by the analyses of different days and updated without rewriting it. The rows are identified by the path of
+the price file, and when a price file is analysed again the most recent row is the one that is loaded. The
+distributions over all the analysed markets (like the distribution of the total volume traded) are then a single read
+of one column, instead of loading the pickle files of every results directory.
+"""
+
+import os
+import time
+import uuid
+
+import betfairutil
+import numpy as np
+import pandas as pd
+
+KEY_COLUMN = 'path'
+TIMESTAMP_COLUMN = 'analysed_at'
+REMOVED_COLUMN = 'removed'
+
+
+def price_file_result_to_row(price_file_path, dict_result):
+    """
+    This function converts the result of the analysis of a price file into a row of the results store.
+
+    Args:
+        price_file_path (str): Path to the price file.
+        dict_result (dict): The result of the price file (see data_analysis.analyse_and_plot_single_price_file, or a
+        checkpoint of it).
+
+    Returns:
+        dict: The row, with the columns 'path', 'file_name', 'market_id', 'inplay_idx', the single-value features
+        (with their names as columns), '<feature>__<statistic>' for the aggregate statistics and
+        '<feature>__missing_total' and '<feature>__missing_percent' for the missing data.
+    """
+    file_name = os.path.basename(price_file_path)
+    row = {KEY_COLUMN: os.path.realpath(price_file_path),
+           'file_name': file_name,
+           'market_id': betfairutil.get_market_id_from_string(file_name) or file_name.split(".bz2")[0],
+           'inplay_idx': dict_result.get('inplay_idx')}
+
+    for feature_name, feature in dict_result['dict_features'].items():
+        if not hasattr(feature, '__len__') or isinstance(feature, str):
+            row[feature_name] = feature.item() if isinstance(feature, np.generic) else feature
+
+    for feature_name, stats in dict_result['aggr_stats'].items():
+        for stat_name, value in stats.items():
+            row[f"{feature_name}__{stat_name}"] = float(value)
+
+    for feature_name, missing_data in dict_result['missing_data'].iterrows():
+        row[f"{feature_name}__missing_total"] = int(missing_data['Total'])
+        row[f"{feature_name}__missing_percent"] = float(missing_data['Percent'])
+
+    return row
+
+
+
+def append_to_results_store(store_dir, rows, removed_price_files=()):
+    """
+    This function appends rows to the results store, writing a new Parquet part.
+
+    Args:
+        store_dir (str): The directory of the results store (it is created in case it doesn't exist).
+        rows (list): The rows to append (see price_file_result_to_row).
+        removed_price_files (list): The paths of the price files whose rows have to be removed from the store (for
+        example because they have been deleted from the data directory). Their removal is appended as a row that
+        hides the previous ones.
+
+    Returns:
+        str or None: The path of the new part, or None if there was nothing to append.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    timestamp = int(time.time() * 1000)
+    rows = ([dict(row, **{TIMESTAMP_COLUMN: timestamp, REMOVED_COLUMN: False}) for row in rows] +
+            [{KEY_COLUMN: os.path.realpath(price_file), TIMESTAMP_COLUMN: timestamp, REMOVED_COLUMN: True}
+             for price_file in removed_price_files])
+    if not rows:
+        return None
+
+    df = pd.DataFrame(rows)
+    ## the numeric results are always stored as floats, so the parts have compatible schemas even when some values
+    ## are missing (like in the rows of the removed price files)
+    for column in df.columns:
+        if column!=TIMESTAMP_COLUMN and pd.api.types.is_integer_dtype(df[column]):
+            df[column] = df[column].astype(np.float64)
+
+    os.makedirs(store_dir, exist_ok=True)
+    part_path = os.path.join(store_dir, f"part-{timestamp}-{uuid.uuid4().hex}.parquet")
+    tmp_path = part_path + ".tmp"
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+    ## the part is visible to the readers only once it is complete
+    os.replace(tmp_path, part_path)
+
+    return part_path
+
+
+
+def _get_parts(store_dir):
+    if not os.path.exists(store_dir):
+        return []
+
+    return sorted(os.path.join(store_dir, file_name) for file_name in os.listdir(store_dir)
+                  if file_name.endswith(".parquet"))
+
+
+
+def load_results_store(store_dir, columns=None, include_history=False):
+    """
+    This function loads the results store. The parts can have different columns (for example markets with a
+    different number of runners): the missing columns are loaded as null values.
+
+    Args:
+        store_dir (str): The directory of the results store.
+        columns (list or None): The columns to load (all the columns if None). Only these columns are read from the
+        Parquet files.
+        include_history (bool): If False (the default) only the most recent row of each price file is returned, and
+        the removed price files are excluded. If True all the rows ever appended are returned.
+
+    Returns:
+        pandas.DataFrame: The rows of the store (one per price file, unless include_history is True).
+
+    Example:
+        df = load_results_store('path/to/your/results_store', columns=['Total volume traded'])
+        df['Total volume traded'].quantile([0.5, 0.9, 0.99])
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    parts = _get_parts(store_dir)
+    if not parts:
+        return pd.DataFrame(columns=columns)
+
+    schema = pa.unify_schemas([pq.read_schema(part) for part in parts])
+    columns_to_read = None
+    if columns is not None:
+        columns_to_read = list(dict.fromkeys([KEY_COLUMN, TIMESTAMP_COLUMN, REMOVED_COLUMN] +
+                                             [column for column in columns if column in schema.names]))
+    df = ds.dataset(parts, schema=schema, format='parquet').to_table(columns=columns_to_read).to_pandas()
+
+    if not include_history:
+        ## the parts are sorted by time, so the last row of each price file is the most recent
+        df = df.drop_duplicates(subset=KEY_COLUMN, keep='last')
+        df = df[~df[REMOVED_COLUMN].astype(bool)].reset_index(drop=True)
+
+    if columns is not None:
+        df = df.reindex(columns=columns)
+
+    return df
+
+
+
+def get_results_store_column(store_dir, column):
+    """
+    This function returns the (non null) values of one column of the results store, like 'Total volume traded', for
+    all the price files in the store.
+
+    Args:
+        store_dir (str): The directory of the results store.
+        column (str): The name of the column.
+
+    Returns:
+        numpy.ndarray: The values of the column.
+    """
+    values = load_results_store(store_dir, columns=[column])[column]
+
+    return values.dropna().to_numpy()
+
+
+
+def compact_results_store(store_dir):
+    """
+    This function rewrites the results store in a single part containing only the most recent row of each price
+    file (the parts accumulate with the appends, compacting the store makes the reads faster).
+
+    Args:
+        store_dir (str): The directory of the results store.
+    """
+    parts = _get_parts(store_dir)
+    if len(parts)<=1:
+        return
+
+    df = load_results_store(store_dir).drop(columns=[TIMESTAMP_COLUMN, REMOVED_COLUMN])
+    append_to_results_store(store_dir, df.to_dict('records'))
+    for part in parts:
+        os.remove(part)
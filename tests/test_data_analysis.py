@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import synthetic_price_files
+from src import correlation, data_analysis
+
+
+@pytest.fixture
+def price_file(tmp_path, monkeypatch):
+    monkeypatch.delenv("PRICE_FILE_CACHE_DIRECTORY", raising=False)
+    price_file_path = str(tmp_path / "1.100000001.bz2")
+    synthetic_price_files.generate_synthetic_price_file(price_file_path, n_updates=2000, n_runners=2)
+
+    return price_file_path
+
+
+
+@pytest.mark.parametrize("correlation_max_samples, correlation_bucket_ms", [(100, None), (None, 5000), (50, 5000)])
+def test_correlation_subsampling_is_threaded(price_file, tmp_path, correlation_max_samples, correlation_bucket_ms):
+    dict_features, _ = data_analysis.extract_features_from_price_file(price_file=price_file)
+    df_features = pd.DataFrame.from_dict({k: v for k, v in data_analysis.get_features_to_plot(dict_features).items()
+                                          if k not in ('Pre-event diff time', 'In-play diff time', 'Publish time')})
+    df_subsampled = correlation.subsample_features(df_features, max_samples=correlation_max_samples,
+                                                   publish_times=dict_features['Publish time'],
+                                                   bucket_ms=correlation_bucket_ms)
+    assert len(df_subsampled)<len(df_features)
+    expected = df_subsampled.corr()
+
+    matrix = data_analysis.calculate_correlation_matrix_of_price_file(
+        price_file, correlation_max_samples=correlation_max_samples, correlation_bucket_ms=correlation_bucket_ms)
+    np.testing.assert_allclose(matrix.loc[expected.index, expected.columns], expected, atol=1e-10)
+
+    results = data_analysis.analyse_and_plot_single_price_file(
+        price_file, str(tmp_path), write_results=False, plot=False,
+        correlation_max_samples=correlation_max_samples, correlation_bucket_ms=correlation_bucket_ms)
+    np.testing.assert_allclose(results['corr_matrices']['pearson'].loc[expected.index, expected.columns],
+                               expected, atol=1e-10)
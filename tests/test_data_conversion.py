@@ -0,0 +1,82 @@
+import betfairutil
+import numpy as np
+import pytest
+
+from benchmarks import synthetic_price_files
+from src import data_conversion, data_processing, order_book, price_file_reader
+
+DEPTH = 3
+
+
+@pytest.fixture
+def price_file(tmp_path, monkeypatch):
+    monkeypatch.delenv("PRICE_FILE_CACHE_DIRECTORY", raising=False)
+    price_file_path = str(tmp_path / "1.100000001.bz2")
+    synthetic_price_files.generate_synthetic_price_file(price_file_path, n_updates=300, n_runners=3, ladder_depth=5)
+
+    return price_file_path
+
+
+
+def _get_ladder_level(ladder, level):
+    if level<len(ladder):
+        return ladder[level]['price'], ladder[level]['size']
+
+    return np.nan, np.nan
+
+
+
+def test_price_file_to_data_frame(price_file):
+    df = data_conversion.price_file_to_data_frame(price_file, depth=DEPTH)
+    market_books = list(price_file_reader.create_market_book_generator(price_file))
+
+    assert set(df['market_book_idx'])==set(range(len(market_books)))
+    assert (df['market_id']=="1.100000001").all()
+    assert (df['date']=="2023-01-01").all()
+
+    for row in df.itertuples(index=False):
+        mb = market_books[row.market_book_idx]
+        runner = betfairutil.get_runner_book_from_market_book(mb, selection_id=row.selection_id)
+        assert row.publish_time==mb['publishTime']
+        assert row.status==mb['status']
+        assert row.inplay==mb['inplay']
+        assert row.total_matched==pytest.approx(betfairutil.calculate_total_matched(mb))
+        assert row.runner_status==runner['status']
+        assert row.last_traded_price==pytest.approx(runner.get('lastPriceTraded') or np.nan, nan_ok=True)
+        for side, ladder in (('back', runner['ex']['availableToBack']), ('lay', runner['ex']['availableToLay'])):
+            for level in range(DEPTH):
+                price, size = _get_ladder_level(ladder, level)
+                assert getattr(row, f'{side}_price_{level+1}')==pytest.approx(price, nan_ok=True)
+                assert getattr(row, f'{side}_size_{level+1}')==pytest.approx(size, nan_ok=True)
+
+
+
+def test_price_file_to_data_frame_replaces_cache_of_order_book_engine(price_file, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    single_pass = data_processing.extract_features_in_single_pass_with_cache(price_file, cache_dir=cache_dir)
+    assert 'entry_book' not in single_pass['order_book']
+
+    single_pass = data_processing.extract_features_in_single_pass_with_cache(price_file, cache_dir=cache_dir,
+                                                                             ladders=True)
+    assert 'entry_book' in single_pass['order_book']
+    single_pass = data_processing.load_single_pass_from_cache(price_file, cache_dir=cache_dir)
+    assert 'entry_book' in single_pass['order_book']
+
+
+
+@pytest.mark.parametrize("side", [betfairutil.Side.BACK, betfairutil.Side.LAY])
+@pytest.mark.parametrize("max_book_percentage", [1000, 105])
+def test_available_volume(price_file, side, max_book_percentage):
+    expected = [betfairutil.calculate_available_volume(mb, side, max_book_percentage)
+                for mb in price_file_reader.create_market_book_generator(price_file)]
+
+    columns = data_processing.extract_features_in_single_pass_with_cache(price_file, ladders=True)['order_book']
+    np.testing.assert_allclose(order_book.calculate_available_volume(columns, side, max_book_percentage), expected)
+
+    columns = data_processing.extract_features_in_single_pass_with_cache(price_file)['order_book']
+    if max_book_percentage==1000:
+        np.testing.assert_allclose(order_book.calculate_available_volume(columns, side, max_book_percentage),
+                                   expected)
+    else:
+        with pytest.raises(ValueError):
+            order_book.calculate_available_volume(columns, side, max_book_percentage)
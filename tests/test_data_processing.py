@@ -0,0 +1,43 @@
+import betfairutil
+import pytest
+
+from benchmarks import synthetic_price_files
+from src import data_processing, price_file_reader
+from utils import pricefileutils
+
+
+@pytest.fixture
+def price_file(tmp_path, monkeypatch):
+    monkeypatch.delenv("PRICE_FILE_CACHE_DIRECTORY", raising=False)
+    price_file_path = str(tmp_path / "1.100000001.bz2")
+    synthetic_price_files.generate_synthetic_price_file(price_file_path, n_updates=1000, n_runners=2)
+
+    return price_file_path
+
+
+
+@pytest.mark.parametrize("filter_suspended", [True, False])
+def test_get_last_pre_event_market_book_from_price_file(price_file, tmp_path, monkeypatch, filter_suspended):
+    expected = betfairutil.get_last_pre_event_market_book_from_prices_file(price_file,
+                                                                           filter_suspended=filter_suspended)
+    cache_dir = str(tmp_path / "cache")
+    ## the entry of the cache built by the order book engine doesn't have the market books, so it is replaced
+    data_processing.extract_features_in_single_pass_with_cache(price_file, cache_dir=cache_dir)
+
+    market_book, inplay_idx = data_processing.get_last_pre_event_market_book_from_price_file(
+        price_file, filter_suspended=filter_suspended, cache_dir=cache_dir)
+    assert market_book==expected
+    assert inplay_idx==pricefileutils.get_last_pre_event_market_book_id_from_prices_file(price_file)
+
+    single_pass = data_processing.load_single_pass_from_cache(price_file, cache_dir=cache_dir)
+    last_pre_event_idx = single_pass['market_index']['last_pre_event_idx']
+    assert single_pass['order_book']['publish_time'][last_pre_event_idx]==(
+        data_processing.get_last_pre_event_market_book_from_price_file(price_file, cache_dir=cache_dir)[0]['publishTime'])
+
+    ## the market books are then read from the cache, without parsing the price file
+    def fail(*args, **kwargs):
+        raise AssertionError("The price file has been parsed")
+
+    monkeypatch.setattr(price_file_reader, "create_market_book_generator", fail)
+    assert data_processing.get_last_pre_event_market_book_from_price_file(
+        price_file, filter_suspended=filter_suspended, cache_dir=cache_dir)==(expected, inplay_idx)
@@ -0,0 +1,41 @@
+import numpy as np
+
+from src import online_statistics
+
+QUANTILES = np.array([0.05, 0.25, 0.5, 0.75, 0.95])
+
+
+def test_sketch_is_deterministic():
+    values = np.random.default_rng(1).lognormal(0, 0.5, 200000)
+    quantiles = []
+    for _ in range(3):
+        statistics = online_statistics.StreamingStatistics()
+        statistics.update(values)
+        quantiles.append(statistics.quantile(QUANTILES))
+
+    np.testing.assert_array_equal(quantiles[0], quantiles[1])
+    np.testing.assert_array_equal(quantiles[0], quantiles[2])
+
+
+
+def test_sketch_is_exact_before_compaction():
+    values = np.random.default_rng(1).normal(size=300)
+    statistics = online_statistics.StreamingStatistics()
+    statistics.update(values)
+
+    np.testing.assert_allclose(statistics.quantile(QUANTILES), np.quantile(values, QUANTILES))
+
+
+
+def test_merged_sketches_rank_error():
+    rng = np.random.default_rng(2)
+    list_values = [rng.lognormal(0, 1, rng.integers(500, 5000)) for _ in range(200)]
+    merged = online_statistics.StreamingStatistics()
+    for values in list_values:
+        statistics = online_statistics.StreamingStatistics()
+        statistics.update(values)
+        merged.merge(statistics)
+
+    all_values = np.concatenate(list_values)
+    ranks = [np.mean(all_values<quantile) for quantile in merged.quantile(QUANTILES)]
+    np.testing.assert_allclose(ranks, QUANTILES, atol=0.01)
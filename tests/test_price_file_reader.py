@@ -0,0 +1,47 @@
+import bz2
+
+import pytest
+
+from benchmarks import synthetic_price_files
+from src import constants, price_file_reader
+
+
+@pytest.fixture
+def price_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "PRICE_FILE_READER_MIN_PARALLEL_SIZE", 0)
+    price_file_path = str(tmp_path / "1.100000001.bz2")
+    synthetic_price_files.generate_synthetic_price_file(price_file_path, n_updates=20000, n_runners=3)
+
+    return price_file_path
+
+
+
+def test_parallel_decompression(price_file):
+    with bz2.open(price_file, 'rb') as f:
+        expected = f.read()
+    with open(price_file, 'rb') as f:
+        assert len(price_file_reader.find_bz2_blocks(f.read()))>2
+
+    assert b"".join(price_file_reader.iterate_decompressed_chunks(price_file, workers=2))==expected
+
+
+
+@pytest.mark.parametrize("failing_block", [0, 2])
+def test_sequential_fallback_when_a_block_fails(price_file, monkeypatch, failing_block):
+    with bz2.open(price_file, 'rb') as f:
+        expected = f.read()
+
+    decompress_bz2_block = price_file_reader.decompress_bz2_block
+    with open(price_file, 'rb') as f:
+        failing_start = price_file_reader.find_bz2_blocks(f.read())[failing_block][0]
+
+    def decompress_or_fail(data, start_bit, end_bit):
+        if start_bit==failing_start:
+            raise OSError("Invalid data stream")
+        return decompress_bz2_block(data, start_bit, end_bit)
+
+    monkeypatch.setattr(price_file_reader, "decompress_bz2_block", decompress_or_fail)
+
+    assert b"".join(price_file_reader.iterate_decompressed_chunks(price_file, workers=2))==expected
+    lines = list(price_file_reader.iterate_price_file_lines(price_file, workers=2))
+    assert lines==expected.rstrip(b"\n").split(b"\n")
@@ -5,6 +5,9 @@ of Betfair price files.
 It also contains additional functions useful to extract information from the price files (functions not present in the betfairutil library).
 """
 
+import functools
+import os
+
 import betfairutil
 from betfairlightweight.resources.bettingresources import (MarketBook,
                                                            RunnerBook)
@@ -61,22 +64,92 @@ def get_runner_book_from_market_book(
             return return_type(**runner)
 
 
-def get_last_pre_event_market_book_id_from_prices_file(
-    path_to_prices_file, filter_suspended = True):
+class RunnerIndex:
+    """
+    Index of the runners of a price file, used to extract runner books from its market books in constant time.
+
+    The runner names are mapped to selection IDs once for each market definition (the market books share the same
+    market definition object until it changes), and the position of each selection ID in the 'runners' of a market
+    book is computed once for each market book. The runner books returned are the dictionaries contained in the
+    market book (not copies), so they must not be modified.
+
+    Example:
+        runner_index = RunnerIndex()
+        for market_book in betfairutil.create_market_book_generator_from_prices_file(price_file):
+            runner_book = runner_index.get_runner_book(market_book, runner_name="Djokovic")
+    """
+
+    def __init__(self):
+        self._market_definition = None
+        self._name_to_selection_id = {}
+        self._runners = None
+        self._selection_id_to_position = {}
+
+    def get_selection_id(self, market_book, runner_name):
+        """
+        Get the selection ID of a runner from its name, using the market definition of the given market book.
+
+        :param market_book: A market book as a dictionary
+        :param runner_name: The name of the runner
+        :return: The selection ID of the runner, or None if there is no runner with that name
+        """
+        market_definition = market_book.get("marketDefinition")
+        if market_definition is not self._market_definition:
+            self._market_definition = market_definition
+            self._name_to_selection_id = {
+                runner.get("name"): runner.get("id")
+                for runner in (market_definition or {}).get("runners", [])
+            }
+
+        return self._name_to_selection_id.get(runner_name)
+
+    def get_runner_book(self, market_book, selection_id=None, runner_name=None):
+        """
+        Get a runner book from a market book, without copying it. The runner can be identified either by ID or name.
+
+        :param market_book: A market book as a dictionary. Alternatively can be None - if so, None will be returned
+        :param selection_id: Optionally identify the runner book to extract by the runner's ID
+        :param runner_name: Alternatively identify the runner book to extract by the runner's name
+        :return: The runner book (the dictionary contained in the market book) if it can be found, otherwise None
+        :raises: ValueError if both selection_id and runner_name are given
+        """
+        if market_book is None:
+            return None
+
+        if selection_id is not None and runner_name is not None:
+            raise ValueError("Both selection_id and runner_name were given")
+
+        if selection_id is None:
+            selection_id = self.get_selection_id(market_book, runner_name)
+            if selection_id is None:
+                return None
+
+        runners = market_book.get("runners", [])
+        if runners is not self._runners:
+            self._runners = runners
+            self._selection_id_to_position = {}
+            for position, runner in enumerate(runners):
+                self._selection_id_to_position.setdefault(runner.get("selectionId"), position)
+
+        position = self._selection_id_to_position.get(selection_id)
+        if position is not None:
+            return runners[position]
+
+
+def get_last_pre_event_market_book_id_from_prices_file(path_to_prices_file):
     """
-    Search a prices file for the last market book before the market turned in play
-    and returns the index of this last pre-event market book.
+    Search a prices file for the boundary between the pre-event and the in-play market books and return the index of
+    the first in-play market book (the number of pre-event market books). The market books are parsed only up to the
+    first in-play one, and never after it (data_processing.get_last_pre_event_market_book_from_price_file also returns
+    the last pre-event market book, filtering the suspended ones).
 
     :param path_to_prices_file: The prices file to search
-    :param filter_suspended: Optionally ignore any pre-event market books where the market status is SUSPENDED
-    :return: The last pre-event market book, where the status is not SUSPENDED if filter_suspended has been set to True, provided one such market book exists in the prices file. If not then None will be returned
+    :return: The index of the first in-play market book, or None if the market never turned in play
     """
     g = betfairutil.create_market_book_generator_from_prices_file(path_to_prices_file)
     for idx, market_book in enumerate(g):
         if market_book["inplay"]:
             return idx
-        # if not filter_suspended or market_book["status"] != "SUSPENDED":
-        #     pre_event_market_book = market_book
 
 
 
@@ -90,22 +163,40 @@ def get_last_traded_prices_from_runner(runner_book):
 
 
 
-def get_name_match(price_file):
-    market_books = betfairutil.read_prices_file(price_file)
+def get_first_market_definition(price_file):
+    """
+    Read the first market definition of a price file, without decompressing and parsing the entire file: the file
+    is read only up to the first line that contains a market definition. The result is cached (the cache is shared
+    by all the functions that read the metadata of the price files, like get_name_match, get_event_id and
+    get_event_date) and it is invalidated when the size or the modification time of the file change.
+
+    :param price_file: The path of the price file
+    :return: The first market definition of the price file as a dictionary (it is shared by the cache, so it must not be modified), or None if the file doesn't contain any market definition
+    """
+    stat = os.stat(price_file)
 
-    return market_books[0]['marketDefinition']['eventName']
+    return _read_first_market_definition(os.path.realpath(price_file), stat.st_size, stat.st_mtime_ns)
 
 
-def get_event_id(price_file):
-    market_books = betfairutil.read_prices_file(price_file)
+@functools.lru_cache(maxsize=100000)
+def _read_first_market_definition(price_file, size, mtime_ns):
+    return betfairutil.get_first_market_definition_from_prices_file(price_file)
 
-    return market_books[0]['marketDefinition']['eventId']
+
+def get_name_match(price_file):
+    return get_first_market_definition(price_file)['eventName']
+
+
+def get_event_id(price_file):
+    return get_first_market_definition(price_file)['eventId']
 
 
 def get_event_date(price_file):
-    market_books = betfairutil.read_prices_file(price_file)
+    return get_first_market_definition(price_file)['openDate']
+
 
-    return market_books[0]['marketDefinition']['openDate']
+def get_market_name(price_file):
+    return get_first_market_definition(price_file)['name']
 
 
 
@@ -115,5 +206,5 @@ def get_event_date(price_file):
 if __name__=="__main__":
     path = "/Users/william.devena/Desktop/UCL/RESEARCH_PROJECT/QST/Data/matches/nadal_deminaur.bz2"
 
-    pre_event_market_book, idx = get_last_pre_event_market_book_id_from_prices_file(path)
+    idx = get_last_pre_event_market_book_id_from_prices_file(path)
     print(idx)
\ No newline at end of file
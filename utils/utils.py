@@ -1,8 +1,9 @@
 import os
 
-import betfairutil
 from alive_progress import alive_it
 
+from utils import pricefileutils
+
 
 def get_bet_names_from_event_folder(event_path):
     """
@@ -34,8 +35,7 @@ def get_bet_names_from_event_folder(event_path):
     dir_names = {}
     for file in alive_it(os.listdir(event_path)):
         if ".bz2" in file:
-            market_books = betfairutil.read_prices_file(os.path.join(event_path, file))
-            dir_names[file] = market_books[0]['marketDefinition']["name"]
+            dir_names[file] = pricefileutils.get_market_name(os.path.join(event_path, file))
 
     return dir_names
 
@@ -72,9 +72,9 @@ def get_bet_names_for_each_event(events_folder):
     for root, _, files in alive_it(list(os.walk(events_folder))):
         for file in files:
             if ".bz2" in file:
-                market_books = betfairutil.read_prices_file(os.path.join(root, file))
-                event = market_books[0]['marketDefinition']['eventName']
-                name = market_books[0]['marketDefinition']['name']
+                market_definition = pricefileutils.get_first_market_definition(os.path.join(root, file))
+                event = market_definition['eventName']
+                name = market_definition['name']
 
                 if event in dict_names_and_events:
                     dict_names_and_events[event].append(name)